@@ -0,0 +1,583 @@
+"""
+Module Name: Benchmark Suite Module
+Source Path: benchmarks/benchmark_suite.py
+
+Description:
+
+This module contains repeatable performance benchmarks for the project. Each benchmark runs against
+deterministic synthetic data from the Synthetic Data Module, times the operation several times and
+records the minimum, median and mean wall-clock time. The results of a run are saved as a JSON file
+named after the current git commit, so that the performance of two commits can be compared with the
+--compare option.
+
+Example usage from the root of the repository:
+
+    python3 -m benchmarks.benchmark_suite --profile quick
+    python3 -m benchmarks.benchmark_suite --compare benchmarks/results/<commit>.json
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import argparse
+import contextlib
+import datetime
+import gzip
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from typing import Callable
+
+import numpy as np
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPOSITORY_ROOT not in sys.path:
+    sys.path.insert(0, REPOSITORY_ROOT)
+
+from benchmarks import synthetic_data as sd
+from modules import data_loading as dl
+from modules import snapshot
+from modules.array_entities import ArrayCity
+from modules.config import TorontoConfig
+from modules.entities import City, Neighbourhood
+from modules.epidemic_curves import EpidemicCurves
+from modules.regression import BatchedRegressionModel, ExponentialRegressionModel, \
+    RegressionCache, median_pairwise_slope, repeated_median_slope, theil_sen_slope
+
+RESULTS_DIRECTORY = os.path.join(REPOSITORY_ROOT, 'benchmarks', 'results')
+
+RESULTS_SCHEMA_VERSION = 1
+
+PROFILES = {
+    'quick': {
+        'repeats': 3,
+        'loading_rows': [10_000],
+        'full_load_rows': 10_000,
+        'parallel_workers': [1, 2, 4],
+        'scaling_neighbourhoods': [140, 1_000],
+        'angle_divisors': [100, 1_000],
+        'vectorized_angle_divisors': [100, 1_000, 10_000],
+        'batched_models': [1_000],
+        'robust_points': [1_000, 10_000],
+        'pairwise_points_limit': 10_000,
+        'geocoding_points': [1_000_000],
+        'render': True
+    },
+    'full': {
+        'repeats': 5,
+        'loading_rows': [10_000, 100_000, 1_000_000],
+        'full_load_rows': 100_000,
+        'parallel_workers': [1, 2, 4, 8],
+        'scaling_neighbourhoods': [140, 1_000, 10_000],
+        'angle_divisors': [100, 1_000, 10_000],
+        'vectorized_angle_divisors': [100, 1_000, 10_000, 100_000],
+        'batched_models': [1_000, 10_000],
+        'robust_points': [1_000, 10_000, 100_000],
+        'pairwise_points_limit': 10_000,
+        'geocoding_points': [1_000_000, 10_000_000],
+        'render': True
+    }
+}
+
+
+class BenchmarkResult:
+    """
+    Class to represent the timings of a single benchmark for one set of parameters.
+
+    Instance Attributes:
+        - name: the name of the benchmark.
+        - params: the parameters the benchmark was run with.
+        - timings: the wall-clock time of each repeat in seconds.
+
+    Representation Invariants:
+        - len(self.timings) >= 1
+    """
+
+    name: str
+    params: dict[str, any]
+    timings: list[float]
+
+    def __init__(self, name: str, params: dict[str, any], timings: list[float]) -> None:
+        self.name = name
+        self.params = params
+        self.timings = timings
+
+    def key(self) -> str:
+        """
+        Returns a string identifying the benchmark and its parameters.
+
+        >>> BenchmarkResult('regression', {'angle_divisor': 100}, [1.0]).key()
+        'regression[angle_divisor=100]'
+        """
+        params = ','.join(str(name) + '=' + str(self.params[name]) for name in sorted(self.params))
+        return self.name + '[' + params + ']'
+
+    def to_json(self) -> dict[str, any]:
+        """
+        Returns a JSON serialisable summary of the result.
+        """
+        return {
+            'name': self.name,
+            'params': self.params,
+            'repeats': len(self.timings),
+            'min': min(self.timings),
+            'median': statistics.median(self.timings),
+            'mean': statistics.mean(self.timings),
+            'timings': self.timings
+        }
+
+
+@contextlib.contextmanager
+def silenced_output() -> None:
+    """
+    Context manager discarding everything printed while it is active. The modules print a progress
+    line for every neighbourhood and case, which would otherwise dominate the measurements.
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def time_callable(function: Callable[[], any], repeats: int,
+                  setup: Callable[[], any] = None) -> list[float]:
+    """
+    Returns the wall-clock time in seconds of repeats calls of function. If setup is given, it is
+    called untimed before each repeat.
+    """
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        with silenced_output():
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def build_synthetic_city(num_neighbourhoods: int, seed: int = 0) -> City:
+    """
+    Returns a City with num_neighbourhoods synthetic neighbourhoods whose cases per capita are set
+    directly, without loading any cases.
+    """
+    rng = np.random.default_rng(seed)
+    regions = sd.generate_regions(num_neighbourhoods, seed)
+    weights = sd.case_weights(regions)
+    city = City('Toronto', sum(region.population for region in regions))
+
+    for region, weight in zip(regions, weights):
+        neighbourhood = Neighbourhood(region.name, region.population, city,
+                                      region.median_household_income)
+        neighbourhood.num_cases_per_cap = float(weight * num_neighbourhoods * 5000
+                                                * rng.uniform(0.8, 1.2))
+        city.add_sub_region(neighbourhood)
+
+    return city
+
+
+# Benchmarks
+
+def benchmark_data_loading(profile: dict[str, any], directory: str) -> list[BenchmarkResult]:
+    """
+    Benchmarks DataLoadingToronto. A single call of load_covid_cases is timed at every size in the
+    profile. A full load of every neighbourhood with one file pass and one add_covid_case call per
+    case, a single pass load with bulk insertion (as done by init_toronto_model), parallel loads
+    with each of the profile's numbers of worker processes and a load of the gzipped case file are
+    timed at the profile's full load size, as are saving and loading a snapshot of the built model and
+    computing the epidemic curves of its neighbourhoods.
+    """
+    config = TorontoConfig()
+    loader = dl.DataLoadingToronto(config.start_date, config.end_date)
+    results = []
+
+    for rows in profile['loading_rows']:
+        paths = sd.generate_dataset(directory, rows)
+        with silenced_output():
+            city = loader.load_super_region(paths['regions'])
+            neighbourhoods = loader.load_sub_regions(paths['regions'], city)
+        neighbourhood = next(iter(neighbourhoods.values()))
+
+        timings = time_callable(lambda: loader.load_covid_cases(paths['cases'], neighbourhood),
+                                profile['repeats'])
+        results.append(BenchmarkResult('load_covid_cases', {'rows': rows}, timings))
+
+    paths = sd.generate_dataset(directory, profile['full_load_rows'])
+
+    def full_load() -> None:
+        toronto = loader.load_super_region(paths['regions'])
+        for hood in loader.load_sub_regions(paths['regions'], toronto).values():
+            toronto.add_sub_region(hood)
+            for case in loader.load_covid_cases(paths['cases'], hood).values():
+                hood.add_covid_case(case)
+
+    timings = time_callable(full_load, 1)
+    results.append(BenchmarkResult('full_load', {'rows': profile['full_load_rows']}, timings))
+
+    def single_pass_load() -> None:
+        toronto = loader.load_super_region(paths['regions'])
+        toronto.add_sub_regions(loader.load_sub_regions(paths['regions'], toronto).values())
+        cases, _, _ = loader.load_new_covid_cases(paths['cases'], toronto)
+        for name, neighbourhood_cases in cases.items():
+            toronto.neighbourhoods[name].add_covid_cases(neighbourhood_cases, take_ownership=True)
+
+    timings = time_callable(single_pass_load, profile['repeats'])
+    results.append(BenchmarkResult('single_pass_load', {'rows': profile['full_load_rows']},
+                                   timings))
+
+    def parallel_load(workers: int) -> None:
+        toronto = loader.load_super_region(paths['regions'])
+        toronto.add_sub_regions(loader.load_sub_regions(paths['regions'], toronto).values())
+        loader.load_new_covid_cases(paths['cases'], toronto, workers=workers)
+
+    for workers in profile['parallel_workers']:
+        timings = time_callable(lambda: parallel_load(workers), profile['repeats'])
+        results.append(BenchmarkResult('parallel_load', {'rows': profile['full_load_rows'],
+                                                         'workers': workers}, timings))
+
+    compressed_path = paths['cases'] + '.gz'
+    with open(paths['cases'], 'rb') as source, gzip.open(compressed_path, 'wb') as out:
+        shutil.copyfileobj(source, out)
+
+    def compressed_load() -> None:
+        toronto = loader.load_super_region(paths['regions'])
+        toronto.add_sub_regions(loader.load_sub_regions(paths['regions'], toronto).values())
+        loader.load_new_covid_cases(compressed_path, toronto)
+
+    timings = time_callable(compressed_load, profile['repeats'])
+    results.append(BenchmarkResult('compressed_load', {'rows': profile['full_load_rows'],
+                                                       'compression': 'gzip'}, timings))
+
+    with silenced_output():
+        toronto = loader.load_super_region(paths['regions'])
+        toronto.add_sub_regions(loader.load_sub_regions(paths['regions'], toronto).values())
+        cases, watermark, _ = loader.load_new_covid_cases(paths['cases'], toronto)
+    for name, neighbourhood_cases in cases.items():
+        toronto.neighbourhoods[name].add_covid_cases(neighbourhood_cases, take_ownership=True)
+    toronto.update_economic_scaling()
+    toronto.update_case_scaling()
+    toronto.regression_model = ExponentialRegressionModel(
+        [(hood.scaled_economic_index, hood.scaled_case_index)
+         for hood in toronto.neighbourhoods.values()], config.regression['angle_divisor'])
+
+    snapshot_path = os.path.join(directory, 'model.snapshot')
+    regions, watermarks = {'Toronto': toronto}, {'Toronto': watermark}
+    params = {'rows': profile['full_load_rows']}
+    results.append(BenchmarkResult('save_snapshot', params, time_callable(
+        lambda: snapshot.save_snapshot(snapshot_path, regions, watermarks), profile['repeats'])))
+    results.append(BenchmarkResult('load_snapshot', params, time_callable(
+        lambda: snapshot.load_snapshot(snapshot_path), profile['repeats'])))
+    results.append(BenchmarkResult('load_snapshot_cases', params, time_callable(
+        lambda: snapshot.load_snapshot(snapshot_path, load_cases=True), profile['repeats'])))
+
+    case_arrays = snapshot.CaseArrays.from_city(toronto)
+    populations = np.array([hood.population for hood in toronto.neighbourhoods.values()])
+
+    def epidemic_curves() -> None:
+        curves = EpidemicCurves.from_case_arrays(case_arrays, populations, config.start_date,
+                                                 config.end_date)
+        curves.incidence_per_capita()
+        curves.doubling_times()
+
+    results.append(BenchmarkResult('epidemic_curves', params,
+                                   time_callable(epidemic_curves, profile['repeats'])))
+
+    return results
+
+
+def benchmark_super_region_scaling(profile: dict[str, any]) -> list[BenchmarkResult]:
+    """
+    Benchmarks building a SuperRegion and updating its economic and case scaling for an increasing
+    number of sub regions.
+    """
+    results = []
+
+    for num_neighbourhoods in profile['scaling_neighbourhoods']:
+        params = {'neighbourhoods': num_neighbourhoods}
+        timings = time_callable(lambda: build_synthetic_city(num_neighbourhoods),
+                                profile['repeats'])
+        results.append(BenchmarkResult('super_region_build', params, timings))
+
+        city = build_synthetic_city(num_neighbourhoods)
+
+        def update_scaling() -> None:
+            city.update_economic_scaling()
+            city.update_case_scaling()
+
+        timings = time_callable(update_scaling, profile['repeats'])
+        results.append(BenchmarkResult('super_region_scaling', params, timings))
+
+        array_city = ArrayCity.from_city(city)
+
+        def update_array_scaling() -> None:
+            array_city.update_economic_scaling()
+            array_city.update_case_scaling()
+            array_city.regression_coordinates()
+
+        timings = time_callable(update_array_scaling, profile['repeats'])
+        results.append(BenchmarkResult('array_city_scaling', params, timings))
+
+    return results
+
+
+def benchmark_regression(profile: dict[str, any]) -> list[BenchmarkResult]:
+    """
+    Benchmarks fitting an ExponentialRegressionModel to the coordinates of 140 synthetic
+    neighbourhoods for every angle_divisor in the profile with the legacy and vectorized angle
+    sweeps, restoring the same fit from a RegressionCache, fitting batches of two-covariate
+    exponential models with BatchedRegressionModel, and estimating robust slopes of outlier-heavy
+    data.
+    """
+    city = build_synthetic_city(140)
+    city.update_economic_scaling()
+    city.update_case_scaling()
+    coordinates = [(hood.scaled_economic_index, hood.scaled_case_index)
+                   for hood in city.neighbourhoods.values()]
+    results = []
+
+    for angle_divisor in profile['angle_divisors']:
+        timings = time_callable(lambda: ExponentialRegressionModel(coordinates, angle_divisor),
+                                profile['repeats'])
+        results.append(BenchmarkResult('exponential_regression', {'angle_divisor': angle_divisor},
+                                       timings))
+
+    # The vectorized sweep reproduces the fits above, so it is also timed at larger divisors.
+    for angle_divisor in profile['vectorized_angle_divisors']:
+        timings = time_callable(
+            lambda: ExponentialRegressionModel(coordinates, angle_divisor, 'vectorized'),
+            profile['repeats'])
+        results.append(BenchmarkResult('exponential_regression_vectorized',
+                                       {'angle_divisor': angle_divisor}, timings))
+
+    cache = RegressionCache()
+    cache.fit(ExponentialRegressionModel, coordinates, 1000)
+    timings = time_callable(lambda: cache.fit(ExponentialRegressionModel, coordinates, 1000),
+                            profile['repeats'])
+    results.append(BenchmarkResult('memoized_regression', {'angle_divisor': 1000}, timings))
+
+    rng = np.random.default_rng(0)
+    for num_models in profile['batched_models']:
+        design = rng.uniform(0, 10, (num_models, len(coordinates), 2))
+        targets = np.exp(0.5 - 0.1 * design[:, :, 0]) * rng.lognormal(0, 0.2, design.shape[:2])
+        timings = time_callable(lambda: BatchedRegressionModel(design, targets, 'exponential'),
+                                profile['repeats'])
+        results.append(BenchmarkResult('batched_regression', {'models': num_models}, timings))
+
+    # Robust slopes of outlier-heavy data, against enumerating every pair of points.
+    for num_points in profile['robust_points']:
+        x = rng.uniform(0, 10, num_points)
+        y = 0.5 * x + rng.standard_cauchy(num_points)
+        params = {'points': num_points}
+        estimators = [('theil_sen', theil_sen_slope)]
+        if num_points <= profile['pairwise_points_limit']:
+            estimators += [('theil_sen_pairwise', median_pairwise_slope),
+                           ('repeated_median', repeated_median_slope)]
+
+        for name, estimator in estimators:
+            timings = time_callable(lambda: estimator(x, y), profile['repeats'])
+            results.append(BenchmarkResult(name, params, timings))
+
+    return results
+
+
+def benchmark_geocoding(profile: dict[str, any]) -> list[BenchmarkResult]:
+    """
+    Benchmarks building the NeighbourhoodGeocoder spatial index and assigning uniformly random
+    points inside the city's bounding box to neighbourhoods.
+    """
+    from modules.geocoding import NeighbourhoodGeocoder
+
+    config = TorontoConfig()
+    results = []
+
+    with silenced_output():
+        geocoder = NeighbourhoodGeocoder(config.paths['shapes'])
+    timings = time_callable(lambda: NeighbourhoodGeocoder(config.paths['shapes']),
+                            profile['repeats'])
+    results.append(BenchmarkResult('geocoder_index_build', {}, timings))
+
+    rng = np.random.default_rng(0)
+    xmin, ymin, xmax, ymax = geocoder.boundaries.bbox
+    for num_points in profile['geocoding_points']:
+        longitudes = rng.uniform(xmin, xmax, num_points)
+        latitudes = rng.uniform(ymin, ymax, num_points)
+        timings = time_callable(lambda: geocoder.assign(longitudes, latitudes), profile['repeats'])
+        results.append(BenchmarkResult('geocoder_assign', {'points': num_points}, timings))
+
+    return results
+
+
+def benchmark_rendering(profile: dict[str, any]) -> list[BenchmarkResult]:
+    """
+    Benchmarks the RegionVisual heatmaps and scatter plot on a synthetic model with the real
+    neighbourhood names, using the non-interactive Agg backend.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from modules.preprocessing import PreprocessingSystem
+    from modules.visualizer import RegionVisual
+
+    city = build_synthetic_city(140)
+    city.update_economic_scaling()
+    city.update_case_scaling()
+    system = PreprocessingSystem()
+    system.regions['Toronto'] = city
+    visual = RegionVisual(system)
+    results = []
+
+    renders = {
+        'heatmap_covid': lambda: visual.toronto_heatmap('Covid'),
+        'heatmap_income': lambda: visual.toronto_heatmap('Income'),
+        'heatmap_thumbnail': lambda: visual.draw_toronto_heatmap('Covid', (3, 2.5), 72),
+        'heatmap_raster': lambda: visual.toronto_heatmap('Covid', raster=True),
+        'heatmap_raster_thumbnail':
+            lambda: visual.draw_toronto_raster_heatmap('Covid', (3, 2.5), 72),
+        'scatter': visual.toronto_scatter_visual
+    }
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # plt.show() warns under the Agg backend.
+        for name, render in renders.items():
+            timings = time_callable(render, profile['repeats'], setup=lambda: plt.close('all'))
+            results.append(BenchmarkResult('render_' + name, {}, timings))
+    plt.close('all')
+
+    return results
+
+
+# Results
+
+def current_commit() -> str:
+    """
+    Returns the hash of the current git commit, or 'unknown' outside a git repository.
+    """
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPOSITORY_ROOT,
+                                capture_output=True, text=True, check=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(profile_name: str, selected: list[str] = None) -> dict[str, any]:
+    """
+    Runs the benchmarks of a profile and returns the JSON serialisable results. If selected is
+    given, only the benchmarks with those names are run.
+    """
+    profile = PROFILES[profile_name]
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        benchmarks = {
+            'loading': lambda: benchmark_data_loading(profile, directory),
+            'scaling': lambda: benchmark_super_region_scaling(profile),
+            'regression': lambda: benchmark_regression(profile),
+            'geocoding': lambda: benchmark_geocoding(profile),
+            'rendering': lambda: benchmark_rendering(profile) if profile['render'] else []
+        }
+
+        for name, benchmark in benchmarks.items():
+            if selected is None or name in selected:
+                print('[benchmarks.benchmark_suite] Running ' + name + ' benchmarks')
+                results.extend(benchmark())
+
+    return {
+        'schema': RESULTS_SCHEMA_VERSION,
+        'commit': current_commit(),
+        'profile': profile_name,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [result.to_json() for result in results]
+    }
+
+
+def save_results(results: dict[str, any], path: str = None) -> str:
+    """
+    Saves results as JSON and returns the path written. By default the file is named after the
+    commit and profile of the results inside benchmarks/results.
+    """
+    if path is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        path = os.path.join(RESULTS_DIRECTORY,
+                            results['commit'] + '_' + results['profile'] + '.json')
+
+    with open(path, 'w') as out:
+        json.dump(results, out, indent=2)
+
+    return path
+
+
+def compare_results(baseline: dict[str, any], current: dict[str, any],
+                    threshold: float = 1.1) -> list[str]:
+    """
+    Returns a report line for every benchmark present in both result sets, comparing median times.
+    Lines for benchmarks that became slower by more than threshold are marked as regressions.
+
+    >>> old = {'results': [{'name': 'a', 'params': {}, 'median': 1.0}]}
+    >>> new = {'results': [{'name': 'a', 'params': {}, 'median': 2.0}]}
+    >>> compare_results(old, new)
+    ['REGRESSION a[]: 1.000000s -> 2.000000s (x2.00)']
+    """
+    def index(results: dict[str, any]) -> dict[str, float]:
+        return {BenchmarkResult(result['name'], result['params'], [0.0]).key(): result['median']
+                for result in results['results']}
+
+    baseline_medians = index(baseline)
+    current_medians = index(current)
+    report = []
+
+    for key in current_medians:
+        if key in baseline_medians:
+            ratio = current_medians[key] / baseline_medians[key]
+            status = 'REGRESSION' if ratio > threshold else 'ok'
+            report.append(status + ' ' + key + ': ' + format(baseline_medians[key], '.6f') + 's -> '
+                          + format(current_medians[key], '.6f') + 's (x' + format(ratio, '.2f')
+                          + ')')
+
+    return report
+
+
+def main() -> None:
+    """
+    Runs the benchmark suite from command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Run the performance benchmarks.')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='quick')
+    parser.add_argument('--only', nargs='*', help='names of the benchmarks to run')
+    parser.add_argument('--output', help='path of the JSON results file')
+    parser.add_argument('--compare', help='path of a JSON results file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.1)
+    args = parser.parse_args()
+
+    os.chdir(REPOSITORY_ROOT)  # TorontoConfig paths are relative to the repository root.
+    results = run_benchmarks(args.profile, args.only)
+    path = save_results(results, args.output)
+    print('[benchmarks.benchmark_suite] Results saved to ' + path)
+
+    for result in results['results']:
+        print(BenchmarkResult(result['name'], result['params'], [0.0]).key() + ': median '
+              + format(result['median'], '.6f') + 's')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            report = compare_results(json.load(baseline_file), results, args.threshold)
+        print('\n'.join(report))
+        if any(line.startswith('REGRESSION') for line in report):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+"""
+Module Name: Memory Benchmark Module
+Source Path: benchmarks/memory_benchmark.py
+
+Description:
+
+This module enforces a memory budget for building and drawing the Toronto model. For every
+synthetic dataset size, the model is built by PreprocessingSystem.init_toronto_model and drawn by
+RegionVisual in a fresh interpreter. The run is split into stages (regions, loading, scaling,
+regression, rendering) by instrumenting the methods init_toronto_model calls, and for each stage
+the peak resident set size, the peak of the memory traced by tracemalloc above the start of the
+stage, and the source lines that allocated the most memory kept by the stage are recorded.
+
+The benchmark fails if the traced peak of a stage is over its budget, or if the peak resident set
+size of the whole pipeline is over its budget, where each budget is a fixed number of bytes plus a
+number of bytes per case row. Memory regressions are then caught before they reach the shared
+workers, on which running out of memory kills other jobs.
+
+Example usage from the root of the repository:
+
+    python3 -m benchmarks.memory_benchmark
+    python3 -m benchmarks.memory_benchmark --rows 10k 100k 1m --top 10 --out memory.json
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import warnings
+from typing import Optional
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPOSITORY_ROOT not in sys.path:
+    sys.path.insert(0, REPOSITORY_ROOT)
+
+from benchmarks import synthetic_data as sd
+from benchmarks.benchmark_suite import silenced_output
+from modules.config import TorontoConfig
+
+MEGABYTE = 1 << 20
+
+# Budget of the traced peak of each stage, as (fixed bytes, bytes per case row). Loading covers
+# both parsing the case file and building the CovidCase entities, which are created row by row as
+# the file is parsed. New case rows are parsed a block at a time, so loading only holds one block
+# of the case file at once, besides the cases themselves.
+STAGE_BUDGETS = {
+    'regions': (1 * MEGABYTE, 0),
+    'loading': (8 * MEGABYTE, 250),
+    'scaling': (1 * MEGABYTE, 0),
+    'regression': (2 * MEGABYTE, 0),
+    'rendering': (120 * MEGABYTE, 0)
+}
+
+# Budget of the peak resident set size of the whole pipeline, as (fixed bytes, bytes per case row).
+# The fixed part covers the interpreter, NumPy and Matplotlib.
+PEAK_RSS_BUDGET = (256 * MEGABYTE, 600)
+
+# Number of allocating source lines reported per stage.
+DEFAULT_TOP = 5
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets the peak resident set size of this process, and returns whether it could be reset.
+    This is only supported by Linux.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> int:
+    """
+    Returns the peak resident set size of this process in bytes, since it was last reset.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def top_allocators(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot,
+                   top: int) -> list[dict[str, any]]:
+    """
+    Returns the top source lines by memory allocated between the snapshots and still held at the
+    second one.
+    """
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+               tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+               tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>')]
+    differences = after.filter_traces(filters).compare_to(before.filter_traces(filters),
+                                                          'lineno')
+
+    return [{'line': str(difference.traceback), 'bytes': difference.size_diff,
+             'blocks': difference.count_diff}
+            for difference in differences[:top] if difference.size_diff > 0]
+
+
+class StageRecorder:
+    """
+    Class to record the memory measurements of consecutive stages of the pipeline, where each
+    stage ends when the next one starts. The traced measurements are only taken if tracemalloc is
+    tracing.
+
+    Instance Attributes:
+        - stages: the names of the stages, in the order they run.
+        - top: the number of allocating source lines reported per stage.
+        - measurements: the measurements of every finished stage, in order.
+
+    Representation Invariants:
+        - len(self.measurements) <= len(self.stages)
+    """
+
+    stages: list[str]
+    top: int
+    measurements: list[dict[str, any]]
+    _stage: Optional[str]
+    _before: Optional[tracemalloc.Snapshot]
+    _start_bytes: int
+
+    def __init__(self, stages: list[str], top: int) -> None:
+        self.stages = stages
+        self.top = top
+        self.measurements = []
+        self._stage = None
+        self._before = None
+        self._start_bytes = 0
+
+    def start(self, name: str) -> None:
+        """
+        Finishes the current stage, if any, and starts measuring the stage called name, if it is
+        the stage after the last one started. Otherwise nothing is done, since an instrumented
+        method may also be called outside of the stage it starts (such as the scaling of the empty
+        city, computed when the city is created).
+        """
+        started = len(self.measurements) + (self._stage is not None)
+        if started == len(self.stages) or self.stages[started] != name:
+            return
+
+        self.finish()
+        reset_peak_rss()
+        if tracemalloc.is_tracing():
+            self._before = tracemalloc.take_snapshot()
+            self._start_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self._stage = name
+
+    def finish(self) -> None:
+        """
+        Finishes the current stage, if any, and records its measurements.
+        """
+        if self._stage is None:
+            return
+
+        measurement = {'stage': self._stage, 'peak_rss': peak_rss()}
+        if tracemalloc.is_tracing():
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            measurement.update({'traced_peak': peak_bytes - self._start_bytes,
+                                'retained': current_bytes - self._start_bytes,
+                                'top_allocators': top_allocators(self._before,
+                                                                 tracemalloc.take_snapshot(),
+                                                                 self.top)})
+        self.measurements.append(measurement)
+        self._stage = None
+
+    def instrument(self, owner: any, attribute: str, before: Optional[str] = None,
+                   after: Optional[str] = None) -> None:
+        """
+        Replaces the method attribute of owner (a class or an instance) with a wrapper that starts
+        the stage called before when the method is called, and the stage called after when it
+        returns.
+        """
+        method = getattr(owner, attribute)
+
+        def wrapper(*args, **kwargs) -> any:
+            if before is not None:
+                self.start(before)
+            result = method(*args, **kwargs)
+            if after is not None:
+                self.start(after)
+            return result
+
+        setattr(owner, attribute, wrapper)
+
+
+def measure_pipeline(top: int, traced: bool) -> dict[str, any]:
+    """
+    Builds the Toronto model with PreprocessingSystem.init_toronto_model and draws it, and returns
+    the memory measurements of every stage. The working directory must be laid out like the data
+    directory of the repository, since the model is loaded, drawn and cached with TorontoConfig.
+
+    The stages of init_toronto_model are split by instrumenting the methods it calls: regions
+    (reading the regions and building the city and its neighbourhoods) ends when
+    refresh_toronto_model is called, loading (parsing the covid cases and adding a CovidCase per
+    case to the neighbourhoods) ends when the scaling is updated, and scaling ends when
+    toronto_model_regression is called. Parsing and building the entities are one stage, since
+    each CovidCase is created as its row is parsed.
+
+    If traced is True, the allocations are traced with tracemalloc. Tracing adds to the resident
+    set size and slows the pipeline down, so the peak resident set size of each stage (since the
+    end of the previous one, where it can be reset) is measured by an untraced run.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    from modules.entities import City
+    from modules.preprocessing import PreprocessingSystem
+    from modules.visualizer import RegionVisual
+
+    system = PreprocessingSystem()
+    recorder = StageRecorder(list(STAGE_BUDGETS), top)
+    recorder.instrument(system, 'refresh_toronto_model', before='loading')
+    recorder.instrument(City, 'update_economic_scaling', before='scaling')
+    recorder.instrument(system, 'toronto_model_regression', before='regression')
+
+    if traced:
+        tracemalloc.start()
+
+    with silenced_output(), warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # plt.show() warns under the Agg backend.
+        recorder.start('regions')
+        system.init_toronto_model()
+
+        recorder.start('rendering')
+        visual = RegionVisual(system)
+        visual.toronto_heatmap('Covid')
+        visual.toronto_heatmap('Income')
+        visual.toronto_scatter_visual()
+        plt.close('all')
+        recorder.finish()
+
+    tracemalloc.stop()
+
+    return {'cases': sum(len(neighbourhood.cases) for neighbourhood
+                         in system.regions['Toronto'].neighbourhoods.values()),
+            'peak_rss': max(measurement['peak_rss'] for measurement in recorder.measurements),
+            'stages': recorder.measurements}
+
+
+def run_measurement(regions_path: str, cases_path: str, top: int,
+                    traced: bool) -> dict[str, any]:
+    """
+    Returns the measurements of measure_pipeline run in a fresh interpreter, in a temporary
+    working directory with the data directory of the repository, in which the regions and cases
+    files of TorontoConfig are links to regions_path and cases_path.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        data_directory = os.path.join(directory, 'data')
+        os.makedirs(data_directory)
+        os.symlink(os.path.join(REPOSITORY_ROOT, 'data', 'toronto_boundaries'),
+                   os.path.join(data_directory, 'toronto_boundaries'))
+        config = TorontoConfig()
+        os.symlink(os.path.abspath(regions_path), os.path.join(directory, config.paths['regions']))
+        os.symlink(os.path.abspath(cases_path), os.path.join(directory, config.paths['cases']))
+        report_path = os.path.join(directory, 'report.json')
+
+        environment = dict(os.environ, PYTHONPATH=REPOSITORY_ROOT)
+        subprocess.run([sys.executable, '-m', 'benchmarks.memory_benchmark', '--measure',
+                        '--top', str(top), '--out', report_path]
+                       + (['--traced'] if traced else []),
+                       cwd=directory, env=environment, check=True)
+        with open(report_path) as report:
+            return json.load(report)
+
+
+def measure_rows(regions_path: str, cases_path: str, top: int) -> dict[str, any]:
+    """
+    Returns the traced measurements of the pipeline with the peak resident set sizes of an
+    untraced run.
+    """
+    measurement = run_measurement(regions_path, cases_path, top, True)
+    untraced = run_measurement(regions_path, cases_path, top, False)
+    for stage, untraced_stage in zip(measurement['stages'], untraced['stages']):
+        stage['peak_rss'] = untraced_stage['peak_rss']
+    measurement['peak_rss'] = untraced['peak_rss']
+
+    return measurement
+
+
+def budget_for(budget: tuple[int, int], rows: int, scale: float) -> float:
+    """
+    Returns the bytes allowed by a (fixed bytes, bytes per case row) budget for rows case rows.
+
+    >>> budget_for((MEGABYTE, 100), 1000, 2.0) == 2 * (MEGABYTE + 100000)
+    True
+    """
+    return (budget[0] + budget[1] * rows) * scale
+
+
+def check_budgets(measurement: dict[str, any], rows: int, scale: float) -> bool:
+    """
+    Prints the measurements of one dataset size against their budgets, and returns whether every
+    budget is met.
+    """
+    passed = True
+
+    for stage in measurement['stages']:
+        budget = budget_for(STAGE_BUDGETS[stage['stage']], rows, scale)
+        within_budget = stage['traced_peak'] <= budget
+        passed = passed and within_budget
+        print(f"  {stage['stage']}: traced peak {stage['traced_peak'] / MEGABYTE:.1f} MB "
+              f"(budget {budget / MEGABYTE:.1f} MB), retained {stage['retained'] / MEGABYTE:.1f} "
+              f"MB, peak RSS {stage['peak_rss'] / MEGABYTE:.1f} MB "
+              f"{'ok' if within_budget else 'FAIL'}")
+        for allocator in stage['top_allocators']:
+            print(f"      {allocator['bytes'] / MEGABYTE:8.2f} MB  {allocator['line']}")
+
+    budget = budget_for(PEAK_RSS_BUDGET, rows, scale)
+    within_budget = measurement['peak_rss'] <= budget
+    print(f"  peak RSS {measurement['peak_rss'] / MEGABYTE:.1f} MB (budget "
+          f"{budget / MEGABYTE:.1f} MB) {'ok' if within_budget else 'FAIL'}")
+
+    return passed and within_budget
+
+
+def run_memory_benchmark(row_counts: list[int], data_directory: str, top: int, scale: float,
+                         out: Optional[str] = None) -> bool:
+    """
+    Measures the pipeline for every number of case rows, prints the measurements against their
+    budgets multiplied by scale, saves them to out if given, and returns whether every budget is
+    met.
+    """
+    passed = True
+    results = []
+
+    for rows in row_counts:
+        paths = sd.generate_dataset(data_directory, rows)
+        print(f'[benchmarks.memory_benchmark] Measuring {rows} case rows')
+        measurement = measure_rows(paths['regions'], paths['cases'], top)
+        passed = check_budgets(measurement, rows, scale) and passed
+        results.append(dict(measurement, rows=rows))
+
+    if out is not None:
+        with open(out, 'w') as out_file:
+            json.dump({'results': results}, out_file, indent=1)
+
+    return passed
+
+
+def main() -> None:
+    """
+    Runs the memory benchmark from the command line, exiting with status 1 if any budget is
+    exceeded.
+    """
+    parser = argparse.ArgumentParser(description='Enforce the memory budget of building and '
+                                                 'drawing the Toronto model.')
+    parser.add_argument('--rows', nargs='+', default=['10k', '100k'],
+                        help='numbers of case rows, or presets among ' + ', '.join(sd.ROW_PRESETS))
+    parser.add_argument('--data', default=os.path.join(REPOSITORY_ROOT, 'data', 'synthetic'),
+                        help='directory of the synthetic datasets')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP,
+                        help='number of allocating source lines reported per stage')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplier of every budget')
+    parser.add_argument('--out', default=None, help='JSON file to save the measurements to')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--traced', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measurement = measure_pipeline(args.top, args.traced)
+        with open(args.out, 'w') as out_file:
+            json.dump(measurement, out_file)
+    elif not run_memory_benchmark([sd.parse_rows(rows) for rows in args.rows], args.data,
+                                  args.top, args.scale, args.out):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Module Name: Startup Benchmark Module
+Source Path: benchmarks/startup_benchmark.py
+
+Description:
+
+This module enforces a cold-start budget for the entry points of the project that do not draw
+anything. Each entry point is imported in a fresh interpreter with `python -X importtime`, and the
+cumulative import time reported for it is compared against its budget. The benchmark also fails if
+an entry point imports any of the plotting, PDF or shapefile libraries, which are only needed by
+the functions that draw, scrape or read shapefiles and are imported by those functions on use.
+
+Example usage from the root of the repository:
+
+    python3 -m benchmarks.startup_benchmark
+    python3 -m benchmarks.startup_benchmark --scale 2 --only modules.preprocessing
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold-start budget of each entry point in milliseconds of cumulative import time. Importing
+# NumPy takes roughly 100 ms of every budget.
+BUDGETS_MS = {
+    'main': 250,
+    'modules.preprocessing': 250,
+    'modules.data_loading': 250,
+    'modules.regression': 250,
+    'modules.snapshot': 250,
+    'modules.geocoding': 250,
+    'modules.spatial_analysis': 300,
+    'modules.visualizer': 300
+}
+
+# Top-level packages that no entry point may import when it is loaded.
+FORBIDDEN_PACKAGES = ('matplotlib', 'seaborn', 'tabula', 'requests', 'shapefile')
+
+
+def measure_import(module: str) -> tuple[float, set[str]]:
+    """
+    Returns the cumulative import time of module in milliseconds when imported by a fresh
+    interpreter, and the top-level packages imported along with it.
+    """
+    environment = dict(os.environ, PYTHONPATH=REPOSITORY_ROOT)
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                             cwd=REPOSITORY_ROOT, env=environment, capture_output=True,
+                             text=True, check=True)
+    cumulative_ms = None
+    packages = set()
+
+    # Each line is 'import time: <self us> | <cumulative us> | <indented module name>'.
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        fields = line.split('|')
+        name = fields[2].strip()
+        packages.add(name.split('.')[0])
+        if fields[2] == ' ' + module:
+            cumulative_ms = int(fields[1]) / 1000
+
+    if cumulative_ms is None:
+        raise ValueError('No import time was reported for ' + module)
+
+    return cumulative_ms, packages
+
+
+def run_startup_benchmark(repeats: int, scale: float, selected: list[str] = None) -> bool:
+    """
+    Measures every selected entry point repeats times, prints the median import time of each
+    against its budget multiplied by scale, and returns whether every entry point is within its
+    budget and imports no forbidden package.
+    """
+    passed = True
+
+    for module, budget in BUDGETS_MS.items():
+        if selected and module not in selected:
+            continue
+        measurements = [measure_import(module) for _ in range(repeats)]
+        median_ms = statistics.median(measurement[0] for measurement in measurements)
+        forbidden = sorted(set.union(*(measurement[1] for measurement in measurements))
+                           & set(FORBIDDEN_PACKAGES))
+        within_budget = median_ms <= budget * scale
+
+        status = 'ok' if within_budget and not forbidden else 'FAIL'
+        print(f'{module}: median {median_ms:.1f} ms (budget {budget * scale:.0f} ms) {status}')
+        if forbidden:
+            print('    imports ' + ', '.join(forbidden))
+        passed = passed and within_budget and not forbidden
+
+    return passed
+
+
+def main() -> None:
+    """
+    Runs the startup benchmark from the command line, exiting with status 1 if any entry point is
+    over budget or imports a forbidden package.
+    """
+    parser = argparse.ArgumentParser(description='Enforce the cold-start import time budget of '
+                                                 'the non-visual entry points.')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='number of fresh interpreters to import each entry point in')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplier of every budget, for slower machines')
+    parser.add_argument('--only', nargs='+', choices=sorted(BUDGETS_MS),
+                        help='entry points to measure (default: all)')
+    args = parser.parse_args()
+
+    if not run_startup_benchmark(args.repeats, args.scale, args.only):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
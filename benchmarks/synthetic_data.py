@@ -0,0 +1,255 @@
+"""
+Module Name: Synthetic Data Module
+Source Path: benchmarks/synthetic_data.py
+
+Description:
+
+This module generates deterministic synthetic datasets shaped like the City of Toronto data used by
+the project. It writes region files in the same layout as data/toronto_regions.csv and covid case
+files in the same column layout as the City of Toronto case export, so that the Data Loading Module
+can read them without modification. The same seed always produces byte-identical files, which makes
+the generated datasets suitable as inputs for repeatable benchmarks.
+
+The real neighbourhood names are reused (when data/toronto_regions.csv is available) so that
+synthetic models can still be joined to the neighbourhood boundary shapefile. Any further
+neighbourhoods are given generated names.
+
+Example usage from the root of the repository:
+
+    python3 -m benchmarks.synthetic_data --rows 1000000 --neighbourhoods 140 --out data/synthetic
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import argparse
+import csv
+import datetime
+import os
+
+import numpy as np
+
+REAL_REGIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 'data', 'toronto_regions.csv')
+
+REGIONS_HEADER = ('Region', 'Population', 'Median Household Income(pre-tax)')
+
+# The Data Loading Module reads the case id from column 0, the neighbourhood name from column 4
+# and the episode date from column 9, so those positions must not move.
+CASES_HEADER = ('_id', 'Assigned_ID', 'Outbreak Associated', 'Age Group', 'Neighbourhood Name',
+                'FSA', 'Source of Infection', 'Classification', 'Reported Date', 'Episode Date',
+                'Client Gender', 'Outcome')
+
+ROW_PRESETS = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+    '50m': 50_000_000
+}
+
+CHUNK_ROWS = 200_000
+
+
+class SyntheticRegion:
+    """
+    Class to represent a generated neighbourhood row of a synthetic regions file.
+
+    Instance Attributes:
+        - name: the name of the neighbourhood.
+        - population: the population of the neighbourhood.
+        - median_household_income: the median household income of the neighbourhood.
+
+    Representation Invariants:
+        - self.population > 0
+        - self.median_household_income > 0
+    """
+
+    name: str
+    population: int
+    median_household_income: int
+
+    def __init__(self, name: str, population: int, median_household_income: int) -> None:
+        self.name = name
+        self.population = population
+        self.median_household_income = median_household_income
+
+
+def real_neighbourhood_names(path: str = REAL_REGIONS_PATH) -> list[str]:
+    """
+    Returns the neighbourhood names of the real regions file, or an empty list if it is missing.
+    """
+    if not os.path.exists(path):
+        return []
+
+    with open(path) as dataset:
+        reader = csv.reader(dataset, delimiter=',')
+        next(reader)  # Skip the dataset's header.
+        next(reader)  # Skip the entry for City of Toronto.
+
+        return [row[0] for row in reader]
+
+
+def generate_regions(num_neighbourhoods: int, seed: int = 0) -> list[SyntheticRegion]:
+    """
+    Returns num_neighbourhoods deterministic synthetic neighbourhoods. Real Toronto neighbourhood
+    names are used first, followed by generated names.
+
+    >>> regions = generate_regions(3, seed=1)
+    >>> [region.population for region in regions] == \
+        [region.population for region in generate_regions(3, seed=1)]
+    True
+    >>> len(generate_regions(500))
+    500
+    """
+    rng = np.random.default_rng(seed)
+    names = real_neighbourhood_names()[:num_neighbourhoods]
+    names += ['Synthetic Neighbourhood ' + str(i + 1) for i in range(len(names),
+                                                                      num_neighbourhoods)]
+
+    populations = rng.integers(6_000, 66_000, size=num_neighbourhoods)
+    incomes = np.clip(rng.lognormal(mean=np.log(65_000), sigma=0.35, size=num_neighbourhoods),
+                      30_000, 320_000).astype(np.int64)
+
+    return [SyntheticRegion(names[i], int(populations[i]), int(incomes[i]))
+            for i in range(num_neighbourhoods)]
+
+
+def write_regions_csv(path: str, regions: list[SyntheticRegion]) -> None:
+    """
+    Writes the regions to path in the same layout as data/toronto_regions.csv.
+    """
+    with open(path, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(REGIONS_HEADER)
+        writer.writerow(('Toronto', sum(region.population for region in regions), 65829))
+        for region in regions:
+            writer.writerow((region.name, region.population, region.median_household_income))
+
+
+def case_weights(regions: list[SyntheticRegion]) -> np.ndarray:
+    """
+    Returns the probability of a synthetic case belonging to each region. Cases are distributed
+    proportionally to population, with lower income neighbourhoods receiving up to three times as
+    many cases per capita so that the regression model has a trend to fit.
+    """
+    populations = np.array([region.population for region in regions], dtype=np.float64)
+    incomes = np.array([region.median_household_income for region in regions], dtype=np.float64)
+
+    income_range = incomes.max() - incomes.min()
+    if income_range > 0:
+        scaled_incomes = (incomes - incomes.min()) / income_range
+    else:
+        scaled_incomes = np.zeros(len(regions))
+
+    weights = populations * (1 + 2 * (1 - scaled_incomes) ** 2)
+
+    return weights / weights.sum()
+
+
+def write_cases_csv(path: str, num_rows: int, regions: list[SyntheticRegion],
+                    start_date: datetime.date, end_date: datetime.date, seed: int = 0) -> None:
+    """
+    Writes num_rows deterministic synthetic covid cases to path. Episode dates are spread from two
+    months before start_date to one month after end_date so that the date filtering of the loaders
+    is exercised. Case ids are unique and increase from 1.
+
+    Rows are generated in chunks so that memory use stays constant for very large files.
+    """
+    rng = np.random.default_rng(seed)
+    weights = case_weights(regions)
+
+    first_day = start_date - datetime.timedelta(days=60)
+    num_days = (end_date - first_day).days + 31
+    date_strings = [(first_day + datetime.timedelta(days=day)).isoformat()
+                    for day in range(num_days)]
+
+    prefixes = [',Sporadic,40-49 Years,' + region.name + ',M5V,Community,CONFIRMED,'
+                for region in regions]
+
+    with open(path, 'w', newline='') as out:
+        out.write(','.join(CASES_HEADER) + '\n')
+
+        written = 0
+        while written < num_rows:
+            chunk_size = min(CHUNK_ROWS, num_rows - written)
+            region_indices = rng.choice(len(regions), size=chunk_size, p=weights).tolist()
+            days = rng.integers(0, num_days, size=chunk_size).tolist()
+
+            lines = []
+            for offset in range(chunk_size):
+                case_id = str(written + offset + 1)
+                date = date_strings[days[offset]]
+                lines.append(case_id + ',' + case_id + prefixes[region_indices[offset]]
+                             + date + ',' + date + ',FEMALE,RESOLVED\n')
+
+            out.write(''.join(lines))
+            written += chunk_size
+
+
+def generate_dataset(directory: str, num_rows: int, num_neighbourhoods: int = 140,
+                     seed: int = 0) -> dict[str, str]:
+    """
+    Writes a synthetic regions file and cases file into directory and returns their paths in the
+    same form as TorontoConfig.paths. Files that already exist for the same parameters are reused.
+    """
+    from modules.config import TorontoConfig
+
+    config = TorontoConfig()
+    os.makedirs(directory, exist_ok=True)
+
+    suffix = '_' + str(num_neighbourhoods) + '_' + str(seed)
+    paths = {
+        'regions': os.path.join(directory, 'toronto_regions' + suffix + '.csv'),
+        'cases': os.path.join(directory, 'toronto_covid_cases_' + str(num_rows) + suffix + '.csv')
+    }
+
+    regions = generate_regions(num_neighbourhoods, seed)
+    if not os.path.exists(paths['regions']):
+        write_regions_csv(paths['regions'], regions)
+    if not os.path.exists(paths['cases']):
+        write_cases_csv(paths['cases'], num_rows, regions, config.start_date, config.end_date,
+                        seed)
+
+    return paths
+
+
+def parse_rows(rows: str) -> int:
+    """
+    Returns the number of rows represented by either a preset name or an integer string.
+
+    >>> parse_rows('1m')
+    1000000
+    >>> parse_rows('2500')
+    2500
+    """
+    if rows.lower() in ROW_PRESETS:
+        return ROW_PRESETS[rows.lower()]
+    else:
+        return int(rows)
+
+
+def main() -> None:
+    """
+    Generates a synthetic dataset from command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Generate synthetic Toronto-shaped data.')
+    parser.add_argument('--rows', default='10k',
+                        help='number of case rows, or one of ' + ', '.join(ROW_PRESETS))
+    parser.add_argument('--neighbourhoods', type=int, default=140)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='data/synthetic')
+    args = parser.parse_args()
+
+    paths = generate_dataset(args.out, parse_rows(args.rows), args.neighbourhoods, args.seed)
+    print('[benchmarks.synthetic_data] Regions written to ' + paths['regions'])
+    print('[benchmarks.synthetic_data] Cases written to ' + paths['cases'])
+
+
+if __name__ == '__main__':
+    main()
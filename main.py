@@ -18,34 +18,37 @@ This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
 """
 
 import modules.preprocessing as p
-import modules.visualizer as v
-from modules.data_collection import scrape_incomes
 
 
 def obtain_data() -> None:
     """
     Obtains data from the web to be modelled.
     """
+    from modules.data_collection import scrape_incomes
+
     scrape_incomes()
 
 
 def generate_model() -> None:
     """ Generates a covid/socioeconomic economic model for Toronto and displays visuals  """
+    import modules.visualizer as v
+
     preprocessing_system = p.PreprocessingSystem()
-    preprocessing_system.init_toronto_model()
+    preprocessing_system.init_toronto_model(prefetch_geometry=True)
     visual_system = v.RegionVisual(preprocessing_system)
     visual_system.toronto_scatter_visual()
     visual_system.toronto_heatmap('Covid')
     visual_system.toronto_heatmap('Income')
 
 
-go_ahead = input('Have the required files been downloaded and put into the'
-                 ' correct directory? Y/N?')
-obtain = ''
-if go_ahead.lower() == 'y':
-    print('Running project...')
-    generate_model()
+if __name__ == '__main__':
+    go_ahead = input('Have the required files been downloaded and put into the'
+                     ' correct directory? Y/N?')
+    obtain = ''
+    if go_ahead.lower() == 'y':
+        print('Running project...')
+        generate_model()
 
-    print('Model Generated and Visualized.')
-else:
-    print('Ok, rerun this file once proper files have been downloaded')
+        print('Model Generated and Visualized.')
+    else:
+        print('Ok, rerun this file once proper files have been downloaded')
@@ -0,0 +1,304 @@
+"""
+Module Name: Array Entities Module
+Source Path: modules/array_entities.py
+
+Description:
+
+This python module contains an array-backed version of the City entity for metro areas with
+thousands of sub regions. An ArrayCity stores the population, median household income, number of
+cases, cases per capita and scaled indexes of its neighbourhoods in aligned NumPy arrays (a
+struct of arrays), indexed by the id of each neighbourhood. Its neighbourhoods are
+NeighbourhoodView objects, whose attributes read and write the city's arrays, so that the rest of
+the project can use them like any other Neighbourhood.
+
+Economic and case scaling, per capita rates and the extraction of the regression coordinates are
+single vector operations over the arrays, and give exactly the same values as the City class.
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+from typing import Callable, Iterable
+
+import numpy as np
+
+from modules.entities import City, CovidCase, Neighbourhood, SubRegion
+
+# Type and cast of each array-backed neighbourhood attribute.
+COLUMNS = {
+    'population': (np.int64, int),
+    'median_household_income': (np.int64, int),
+    'num_cases': (np.int64, int),
+    'num_cases_per_cap': (np.float64, float),
+    'scaled_economic_index': (np.float64, float),
+    'scaled_case_index': (np.float64, float)
+}
+
+
+def _column_property(column: str, cast: Callable) -> property:
+    """
+    Returns a property which reads and writes a neighbourhood's element of a column of its city.
+    """
+    def get_value(view: 'NeighbourhoodView') -> any:
+        return cast(view.super_region.arrays[column][view.neighbourhood_id])
+
+    def set_value(view: 'NeighbourhoodView', value: any) -> None:
+        view.super_region.arrays[column][view.neighbourhood_id] = value
+
+    return property(get_value, set_value)
+
+
+class NeighbourhoodView(Neighbourhood):
+    """
+    Class to represent a neighbourhood of an ArrayCity, whose attributes are stored in the arrays
+    of the city. The arrays are read through the city, since they are replaced when they grow.
+
+    Instance Attributes:
+        - neighbourhood_id: the position of the neighbourhood in the arrays of its city.
+    """
+
+    neighbourhood_id: int
+
+    population = _column_property('population', int)
+    median_household_income = _column_property('median_household_income', int)
+    num_cases_per_cap = _column_property('num_cases_per_cap', float)
+    scaled_economic_index = _column_property('scaled_economic_index', float)
+    scaled_case_index = _column_property('scaled_case_index', float)
+
+    def __init__(self, name: str, population: int, city: 'ArrayCity',
+                 median_household_income: int) -> None:
+        # The array-backed attributes set by SubRegion.__init__ need the city to be known first.
+        self.super_region = city
+        self.neighbourhood_id = city.allocate_neighbourhood_id()
+        super().__init__(name, population, city, median_household_income)
+
+    def add_covid_case(self, covid_case: CovidCase) -> bool:
+        """
+        Adds covid case to the neighbourhood if not already added, keeping the city's count of
+        its cases up to date. Returns whether the case is added.
+        """
+        added = super().add_covid_case(covid_case)
+        self.super_region.arrays['num_cases'][self.neighbourhood_id] = len(self.cases)
+        return added
+
+    def add_covid_cases(self, covid_cases: Iterable[CovidCase],
+                        take_ownership: bool = False) -> int:
+        """
+        Adds every covid case that is not already added to the neighbourhood, keeping the city's
+        count of its cases up to date. Returns the number of cases added.
+        """
+        added = super().add_covid_cases(covid_cases, take_ownership)
+        self.super_region.arrays['num_cases'][self.neighbourhood_id] = len(self.cases)
+        return added
+
+    def clear_covid_cases(self) -> None:
+        """
+        Removes every covid case from the neighbourhood.
+        """
+        super().clear_covid_cases()
+        self.super_region.arrays['num_cases'][self.neighbourhood_id] = 0
+
+
+class ArrayCity(City):
+    """
+    Class to represent a city whose neighbourhood attributes are stored in aligned NumPy arrays.
+
+    Instance Attributes:
+        - arrays: the array of each attribute in COLUMNS, indexed by neighbourhood id. Only the
+        first self.num_allocated elements are used.
+        - num_allocated: the number of neighbourhood ids allocated.
+
+    Representation Invariants:
+        - all(len(array) >= self.num_allocated for array in self.arrays.values())
+
+    >>> toronto = ArrayCity('Toronto', 300)
+    >>> toronto.add_sub_regions([NeighbourhoodView('Annex', 100, toronto, 50000),
+    ...                          NeighbourhoodView('Rosedale', 200, toronto, 150000)])
+    2
+    >>> toronto.set_case_counts(np.array([3, 2]))
+    >>> toronto.update_economic_scaling(), toronto.update_case_scaling()
+    (0.0001, 0.005)
+    >>> toronto.regression_coordinates()
+    [(0.0, 10.0), (10.0, 0.0)]
+    """
+
+    arrays: dict[str, np.ndarray]
+    num_allocated: int
+    _member_ids: list[int]
+    _member_array: np.ndarray
+
+    def __init__(self, name: str, population: int, capacity: int = 16) -> None:
+        self.arrays = {column: np.zeros(capacity, dtype=dtype)
+                       for column, (dtype, _) in COLUMNS.items()}
+        self.num_allocated = 0
+        self._member_ids = []
+        self._member_array = np.zeros(0, dtype=np.int64)
+        super().__init__(name, population)
+
+    @classmethod
+    def from_city(cls, city: City) -> 'ArrayCity':
+        """
+        Returns an ArrayCity with a NeighbourhoodView of every neighbourhood of city, with the same
+        attributes. The views share the case dictionaries of the neighbourhoods of city.
+        """
+        array_city = cls(city.name, city.population, max(len(city.neighbourhoods), 1))
+        views = []
+        for neighbourhood in city.neighbourhoods.values():
+            view = NeighbourhoodView(neighbourhood.name, neighbourhood.population, array_city,
+                                     neighbourhood.median_household_income)
+            view.cases = neighbourhood.cases
+            view.num_cases_per_cap = neighbourhood.num_cases_per_cap
+            view.scaled_economic_index = neighbourhood.scaled_economic_index
+            view.scaled_case_index = neighbourhood.scaled_case_index
+            views.append(view)
+        array_city.add_sub_regions(views)
+        array_city.arrays['num_cases'][array_city.member_ids()] = \
+            [len(view.cases) for view in views]
+
+        return array_city
+
+    def allocate_neighbourhood_id(self) -> int:
+        """
+        Returns a new neighbourhood id, doubling the length of the arrays if they are full.
+        """
+        if self.num_allocated == len(self.arrays['population']):
+            for column in COLUMNS:
+                grown = np.zeros(max(2 * self.num_allocated, 1), dtype=self.arrays[column].dtype)
+                grown[:self.num_allocated] = self.arrays[column][:self.num_allocated]
+                self.arrays[column] = grown
+
+        self.num_allocated += 1
+        return self.num_allocated - 1
+
+    def _check_view(self, subregion: SubRegion) -> None:
+        """
+        Raises a ValueError if subregion is not a NeighbourhoodView of this city.
+        """
+        if not isinstance(subregion, NeighbourhoodView) or subregion.super_region is not self:
+            raise ValueError('Only NeighbourhoodViews of the city can be added to an ArrayCity: '
+                             + subregion.name)
+
+    def add_sub_region(self, neighbourhood: NeighbourhoodView) -> bool:
+        """
+        Add subregion to subregion dictionary if subregion is not already added. Return whether the
+        subregion is added.
+        """
+        self._check_view(neighbourhood)
+        added = super().add_sub_region(neighbourhood)
+        if added:
+            self._member_ids.append(neighbourhood.neighbourhood_id)
+
+        return added
+
+    def add_sub_regions(self, subregions: Iterable[NeighbourhoodView]) -> int:
+        """
+        Add every subregion that is not already added to the subregion dictionary in one batch.
+        Return the number of subregions added.
+        """
+        subregions = list(subregions)
+        for subregion in subregions:
+            self._check_view(subregion)
+
+        num_before = len(self._sub_regions)
+        added = super().add_sub_regions(subregions)
+        self._member_ids.extend(subregion.neighbourhood_id for subregion
+                                in list(self._sub_regions.values())[num_before:])
+
+        return added
+
+    def member_ids(self) -> np.ndarray:
+        """
+        Returns the ids of the neighbourhoods of the city, in the order they were added.
+        """
+        if len(self._member_array) != len(self._member_ids):
+            self._member_array = np.array(self._member_ids, dtype=np.int64)
+
+        return self._member_array
+
+    def set_case_counts(self, counts: np.ndarray) -> None:
+        """
+        Sets the number of cases of every neighbourhood, in the order they were added, and
+        recalculates their cases per 100,000 people in one vector operation. This does not change
+        the cases stored by the neighbourhoods.
+        """
+        ids = self.member_ids()
+        self.arrays['num_cases'][ids] = counts
+        self.arrays['num_cases_per_cap'][ids] = \
+            (self.arrays['num_cases'][ids] / self.arrays['population'][ids]) * 100000
+
+    def _scale(self, values: np.ndarray) -> tuple[any, any, float, np.ndarray]:
+        """
+        Returns the maximum, minimum and multiplier of values, and the values scaled to between 0
+        and 10, in the same way as SuperRegion.update_economic_scaling.
+        """
+        if len(values) == 0:
+            return 0, 0, 0, values.astype(np.float64)
+
+        maximum, minimum = values.max().item(), values.min().item()
+        multiplier = 10 / (maximum - minimum) if maximum != minimum else 0
+
+        return maximum, minimum, multiplier, (values - minimum) * multiplier
+
+    def update_economic_scaling(self) -> float:
+        """
+        Update the economic scaling of the super region and its subregions. Returns the economic
+        scaling multiplier.
+        """
+        ids = self.member_ids()
+        self.max_household_income, self.min_household_income, self.economic_multiplier, \
+            self.arrays['scaled_economic_index'][ids] = \
+            self._scale(self.arrays['median_household_income'][ids])
+
+        return self.economic_multiplier
+
+    def update_case_scaling(self) -> float:
+        """
+        Update the case scaling of the super region and its subregions. Returns the case scaling
+        multiplier.
+        """
+        ids = self.member_ids()
+        self.max_num_cases_per_cap, self.min_num_cases_per_cap, self.case_multiplier, \
+            self.arrays['scaled_case_index'][ids] = \
+            self._scale(self.arrays['num_cases_per_cap'][ids])
+
+        return self.case_multiplier
+
+    def regression_coordinates(self, exclude_zeros: bool = False) -> list[tuple[float, float]]:
+        """
+        Returns the (scaled economic index, scaled case index) coordinate of every neighbourhood,
+        in the order they were added. If exclude_zeros is True, neighbourhoods with a scaled index
+        of zero are left out, as in the scatter plot of the visualizer.
+        """
+        ids = self.member_ids()
+        economic = self.arrays['scaled_economic_index'][ids]
+        cases = self.arrays['scaled_case_index'][ids]
+        if exclude_zeros:
+            keep = (economic != 0) & (cases != 0)
+            economic, cases = economic[keep], cases[keep]
+
+        return list(zip(economic.tolist(), cases.tolist()))
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+
+    python_ta.contracts.DEBUG_CONTRACTS = False
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+
+    doctest.testmod(verbose=True)
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'extra-imports': ['typing', 'numpy', 'modules.entities'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
@@ -28,6 +28,7 @@ class TorontoConfig:
     end_date: datetime.date
     paths: dict[str, str]
     regression: dict[str, any]
+    loading: dict[str, any]
 
     def __init__(self) -> None:
 
@@ -37,10 +38,15 @@ class TorontoConfig:
         self.paths = {
             'regions': 'data/toronto_regions.csv',
             'cases': 'data/toronto_covid_cases.csv',
-            'shapes': 'data/toronto_boundaries/Neighbourhoods.shp'
+            'shapes': 'data/toronto_boundaries/Neighbourhoods.shp',
+            'cache': 'data/cache'
         }
         self.regression = {
-            'angle_divisor': 1000
+            'angle_divisor': 1000,
+            'backend': 'vectorized'  # Angle sweep backend; 'legacy' scores each line in a loop.
+        }
+        self.loading = {
+            'workers': 1  # Worker processes parsing the covid case file; 1 parses it serially.
         }
 
 
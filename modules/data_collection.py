@@ -18,16 +18,17 @@ in the City of Toronto"
 
 This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
 """
-import tabula as tb
-import requests
 import io
 from string import digits
 import csv
 
 
-
 def scrape_incomes() -> None:
     """ Attains population, name and median household income from Toronto neighbourhood profile pdfs"""
+    # tabula starts a Java runtime and requests is only needed here, so both are imported on use.
+    import tabula as tb
+    import requests
+
     info = [('Region', 'Population', 'Median Household Income(pre-tax)'), ('Toronto', 2731571, 65829)]
     for i in range(1, 141):
         file_num = str(i)
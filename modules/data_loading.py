@@ -24,7 +24,21 @@ in the City of Toronto"
 This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
 
 """
+import bz2
 import csv
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterator, Optional, TextIO, Union
+
+import numpy as np
+
 from modules.entities import *
 
 
@@ -62,6 +76,550 @@ def string_to_datetime(date_string: str) -> datetime.date:
     return datetime.date(year, month, day)
 
 
+# Compressed Input
+
+# Magic bytes at the start of a file in each supported compression format.
+COMPRESSION_MAGIC = {
+    b'\x1f\x8b': 'gzip',
+    b'BZh': 'bz2',
+    b'\xfd7zXZ\x00': 'xz',
+    b'\x28\xb5\x2f\xfd': 'zstd'
+}
+
+
+def detect_compression(path: str) -> Optional[str]:
+    """
+    Returns the compression format of the file at path ('gzip', 'bz2', 'xz' or 'zstd'), detected
+    from its first bytes, or None if the file is not compressed.
+    """
+    with open(path, 'rb') as dataset:
+        head = dataset.read(max(len(magic) for magic in COMPRESSION_MAGIC))
+
+    for magic, compression in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+
+    return None
+
+
+def open_decompressed(path: str, compression: str) -> BinaryIO:
+    """
+    Returns a binary stream of the decompressed contents of the file at path. Reading zstd files
+    requires the zstandard package.
+    """
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    elif compression == 'bz2':
+        return bz2.open(path, 'rb')
+    elif compression == 'xz':
+        return lzma.open(path, 'rb')
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as error:
+            raise ImportError('The zstandard package is required to read ' + path) from error
+        # Files written by appending frames hold several frames, which are read as one stream.
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True,
+                                                          read_across_frames=True)
+    else:
+        raise ValueError('Unknown compression format: ' + compression)
+
+
+class ThreadedDecompressionReader(io.RawIOBase):
+    """
+    Class to represent a raw binary stream of a decompressed file, which is decompressed ahead of
+    the reader on a separate thread, so that decompression overlaps with parsing. The compression
+    libraries release the GIL while decompressing. At most queue_size blocks are decompressed
+    ahead, bounding the memory used.
+
+    Instance Attributes:
+        - block_size: the number of decompressed bytes read from the stream at a time.
+
+    Representation Invariants:
+        - self.block_size > 0
+    """
+
+    block_size: int
+    _stream: BinaryIO
+    _blocks: queue.Queue
+    _pending: memoryview
+    _finished: bool
+    _stopping: threading.Event
+    _thread: threading.Thread
+
+    def __init__(self, stream: BinaryIO, block_size: int = 1024 * 1024,
+                 queue_size: int = 8) -> None:
+        super().__init__()
+        self.block_size = block_size
+        self._stream = stream
+        self._blocks = queue.Queue(queue_size)
+        self._pending = memoryview(b'')
+        self._finished = False
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._decompress, daemon=True)
+        self._thread.start()
+
+    def _decompress(self) -> None:
+        """
+        Decompresses the stream block by block onto the queue, ending with an empty block, or with
+        the exception raised while decompressing.
+        """
+        try:
+            while True:
+                block = self._stream.read(self.block_size)
+                if not self._put(block) or not block:
+                    break
+        except Exception as error:  # Raised again in the reading thread.
+            self._put(error)
+        finally:
+            self._stream.close()
+
+    def _put(self, item: Union[bytes, Exception]) -> bool:
+        """
+        Puts item on the queue once there is room, and returns whether it was put before the reader
+        was closed.
+        """
+        while not self._stopping.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:
+        """
+        Reads decompressed bytes into buffer and returns the number of bytes read, which is 0 at
+        the end of the stream.
+        """
+        while len(self._pending) == 0:
+            if self._finished:
+                return 0
+            block = self._blocks.get()
+            if isinstance(block, Exception):
+                self._finished = True
+                raise block
+            if not block:
+                self._finished = True
+                return 0
+            self._pending = memoryview(block)
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+
+        return size
+
+    def close(self) -> None:
+        """
+        Stops the decompression thread and closes the stream.
+        """
+        if not self.closed:
+            self._stopping.set()
+            self._thread.join()
+        super().close()
+
+
+def open_dataset(path: str, mode: str = 'r') -> Union[TextIO, BinaryIO]:
+    """
+    Returns the file at path opened for reading in text (mode 'r') or binary (mode 'rb') mode.
+    Files compressed with gzip, bz2, xz or zstd are detected by their magic bytes and decompressed
+    while they are read, on a separate thread. Streams of compressed files cannot seek.
+
+    >>> with open_dataset('data/toronto_regions.csv') as dataset:
+    ...     dataset.readline().startswith('Region')
+    True
+    """
+    compression = detect_compression(path)
+    if compression is None:
+        return open(path, mode)
+
+    stream = io.BufferedReader(ThreadedDecompressionReader(open_decompressed(path, compression)))
+    if mode == 'rb':
+        return stream
+    else:
+        return io.TextIOWrapper(stream)
+
+
+def read_region_rows(path: str) -> list[list[str]]:
+    """
+    Returns the rows of the region dataset at path, without its header. The first row is the
+    super region and the rest are its subregions, so the dataset only needs to be read once to
+    create both.
+    """
+    with open_dataset(path) as dataset:
+        reader = csv.reader(dataset, delimiter=',')
+        next(reader)  # Skip the dataset's header.
+
+        return [row for row in reader]
+
+
+# Incremental Loading
+
+class CaseFileWatermark:
+    """
+    Class to represent the high-water mark of a covid case file: how much of the file has already
+    been loaded, and a checksum to detect whether that part of the file has since been rewritten.
+
+    The checksum covers every byte of the loaded prefix, read sequentially in blocks, so a
+    republished file that edits any existing row (such as a corrected date or neighbourhood) no
+    longer matches and is reloaded in full. Hashing is much cheaper than parsing the prefix, so a
+    refresh still costs little more than parsing its new rows. Republished files that only append
+    rows keep the prefix byte-identical and pass the check.
+
+    A full load also loads a last row that is not ended by a newline. Rows appended later must
+    then start with the newline ending it; otherwise the loaded row itself was extended, and the
+    file no longer matches.
+
+    Instance Attributes:
+        - offset: the byte offset just past the last row loaded.
+        - checksum: the checksum of the first offset bytes.
+        - open_row: whether the last row loaded is not ended by a newline.
+
+    Representation Invariants:
+        - self.offset >= 0
+        - not self.open_row or self.offset > 0
+    """
+
+    offset: int
+    checksum: str
+    open_row: bool
+
+    BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, offset: int, checksum: str, open_row: bool = False) -> None:
+        self.offset = offset
+        self.checksum = checksum
+        self.open_row = open_row
+
+    @classmethod
+    def hash_range(cls, digest: any, dataset: BinaryIO, start: int, end: int) -> None:
+        """
+        Updates digest, a hashlib hash, with bytes start to end of an open binary dataset, read
+        sequentially in blocks.
+        """
+        dataset.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = dataset.read(min(cls.BLOCK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+
+    @classmethod
+    def prefix_checksum(cls, dataset: BinaryIO, offset: int) -> str:
+        """
+        Returns the checksum of the first offset bytes of an open binary dataset.
+
+        >>> first = CaseFileWatermark.prefix_checksum(io.BytesIO(b'id,date\\n1,2021\\n'), 15)
+        >>> first == CaseFileWatermark.prefix_checksum(io.BytesIO(b'id,date\\n1,2022\\n'), 15)
+        False
+        """
+        digest = hashlib.sha256()
+        cls.hash_range(digest, dataset, 0, offset)
+
+        return digest.hexdigest()
+
+    def resume_point(self, path: str) -> Optional[tuple[int, any]]:
+        """
+        Returns where to resume loading the file at path, if its first self.offset bytes are
+        unchanged: the offset of the first row that has not been loaded, and the sha256 hash of
+        the bytes before it. The hash can be extended with the bytes that follow, so that the
+        checksum of the next watermark does not need the prefix to be read again.
+
+        Returns None if the loaded prefix has changed, or if the open last row loaded has since
+        been extended. Compressed files never match, since appending to them can change any of
+        their compressed bytes.
+        """
+        if os.path.getsize(path) < self.offset or detect_compression(path) is not None:
+            return None
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as dataset:
+            self.hash_range(digest, dataset, 0, self.offset)
+            following = dataset.read(2) if self.open_row else b''
+
+        if digest.hexdigest() != self.checksum:
+            return None
+
+        # Skip the newline ending an open last row, once it has been appended.
+        if following.startswith(b'\r\n'):
+            terminator = b'\r\n'
+        elif following.startswith(b'\n'):
+            terminator = b'\n'
+        elif following:
+            return None
+        else:
+            terminator = b''
+        digest.update(terminator)
+
+        return self.offset + len(terminator), digest
+
+    def matches(self, path: str) -> bool:
+        """
+        Returns whether the first self.offset bytes of the file at path are unchanged, and the
+        rows after them can be loaded incrementally.
+        """
+        return self.resume_point(path) is not None
+
+    def save(self, path: str) -> None:
+        """
+        Saves the watermark to a JSON file at path.
+        """
+        with open(path, 'w') as out:
+            json.dump({'offset': self.offset, 'checksum': self.checksum,
+                       'open_row': self.open_row}, out)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['CaseFileWatermark']:
+        """
+        Returns the watermark saved at path, or None if there is none.
+        """
+        if not os.path.exists(path):
+            return None
+
+        with open(path) as watermark_file:
+            data = json.load(watermark_file)
+
+        return cls(data['offset'], data['checksum'], data.get('open_row', False))
+
+
+# Size of the blocks in which new covid case rows are read and parsed serially.
+PARSE_BLOCK_SIZE = 1024 * 1024
+
+
+def last_row_end(buffer: bytes) -> int:
+    """
+    Returns the offset just past the last newline of buffer that ends a row, or 0 if there is
+    none, where buffer starts at the start of a row. A newline only ends a row if an even number
+    of quotes precedes it, since a quoted field may contain newlines.
+
+    >>> last_row_end(b'1,"a\\nb"\\n2,"c\\nd')
+    8
+    """
+    newline = buffer.rfind(b'\n')
+    quotes = buffer.count(b'"', 0, max(newline, 0))
+    while newline >= 0:
+        if quotes % 2 == 0:
+            return newline + 1
+        previous = buffer.rfind(b'\n', 0, newline)
+        quotes -= buffer.count(b'"', max(previous, 0), newline)
+        newline = previous
+
+    return 0
+
+
+def read_row_blocks(dataset: BinaryIO, block_size: int = PARSE_BLOCK_SIZE,
+                    final_row: bool = False) -> Iterator[bytes]:
+    """
+    Yields the rest of an open binary dataset, from the start of a row, in blocks of about
+    block_size bytes that each end at the end of a row, so that only one block is held in memory
+    at a time.
+
+    A last row that is not ended by a newline is only yielded if final_row is True and its quotes
+    are balanced. Otherwise it is left for a later load, since it may still be being written.
+
+    >>> list(read_row_blocks(io.BytesIO(b'1,a\\n2,b\\n3,c\\n4,d'), 5))
+    [b'1,a\\n', b'2,b\\n', b'3,c\\n']
+    >>> list(read_row_blocks(io.BytesIO(b'1,a\\n2,b\\n3,c\\n4,d'), 5, final_row=True))
+    [b'1,a\\n', b'2,b\\n', b'3,c\\n', b'4,d']
+    >>> list(read_row_blocks(io.BytesIO(b'1,a\\n2,"b'), 5, final_row=True))
+    [b'1,a\\n']
+    """
+    pending = b''
+    while True:
+        block = dataset.read(block_size)
+        if not block:
+            if final_row and pending and pending.count(b'"') % 2 == 0:
+                yield pending
+            return
+        pending += block
+        end = last_row_end(pending)
+        if end > 0:
+            yield pending[:end]
+            pending = pending[end:]
+
+
+def is_complete_row(row: list[str], num_fields: int) -> bool:
+    """
+    Returns whether row, read from the end of the covid case file where it was not ended by a
+    newline, is a complete row: one with the num_fields fields of the header whose case id and
+    date can be parsed. A row cut off while it was being written usually is not.
+
+    >>> row = ['1', '', '', '', 'Annex', '', '', '', '', '2021-01-15']
+    >>> is_complete_row(row, 10), is_complete_row(row[:9], 10)
+    (True, False)
+    >>> is_complete_row(row[:9] + ['2021-0'], 10)
+    False
+    """
+    if len(row) != num_fields:
+        return False
+
+    try:
+        int(row[0])
+        string_to_datetime(row[9])
+    except (IndexError, ValueError):
+        return False
+
+    return True
+
+
+# Parallel Loading
+
+# Size of the blocks read when searching for a row boundary.
+BOUNDARY_BLOCK_SIZE = 65536
+
+# Largest byte range of the covid case file parsed by one task, bounding the memory of a worker.
+PARSE_RANGE_SIZE = 32 * 1024 * 1024
+
+
+def count_quotes(path: str, start: int, end: int) -> int:
+    """
+    Returns the number of double quote characters in bytes start to end of the file at path.
+    """
+    with open(path, 'rb') as dataset:
+        dataset.seek(start)
+        count = 0
+        position = start
+        while position < end:
+            block = dataset.read(min(PARSE_RANGE_SIZE, end - position))
+            if not block:
+                break
+            count += block.count(b'"')
+            position += len(block)
+
+    return count
+
+
+def find_row_start(path: str, position: int, quote_parity: int) -> int:
+    """
+    Returns the offset of the first row of the file at path starting at or after position, given
+    the parity of the number of double quotes before position.
+
+    A newline only ends a row if an even number of quotes precedes it, since a quoted field (in
+    which quotes are escaped by doubling them) may contain newlines. Returns the size of the file
+    if no row starts after position.
+    """
+    if position == 0:
+        return 0
+
+    with open(path, 'rb') as dataset:
+        # Start at the byte before position, in case a row ends exactly at position.
+        dataset.seek(position - 1)
+        base = position - 1
+        parity = quote_parity
+        if dataset.read(1) == b'"':
+            parity ^= 1
+        dataset.seek(position - 1)
+
+        while True:
+            block = dataset.read(BOUNDARY_BLOCK_SIZE)
+            if not block:
+                return base
+            index = 0
+            while True:
+                newline = block.find(b'\n', index)
+                parity ^= block.count(b'"', index, len(block) if newline < 0 else newline) & 1
+                if newline < 0:
+                    break
+                if parity == 0:
+                    return base + newline + 1
+                index = newline + 1
+            base += len(block)
+
+
+def find_last_row_end(path: str, start: int) -> int:
+    """
+    Returns the offset just past the last newline at or after start in the file at path, or start
+    if there is none, so that a partially written last row is left for the next load.
+    """
+    with open(path, 'rb') as dataset:
+        end = dataset.seek(0, os.SEEK_END)
+        while end > start:
+            block_start = max(end - BOUNDARY_BLOCK_SIZE, start)
+            dataset.seek(block_start)
+            newline = dataset.read(end - block_start).rfind(b'\n')
+            if newline >= 0:
+                return block_start + newline + 1
+            end = block_start
+
+    return start
+
+
+def split_rows(path: str, start: int, end: int, num_ranges: int,
+               executor: Optional[ProcessPoolExecutor] = None) -> list[tuple[int, int]]:
+    """
+    Returns at most num_ranges consecutive byte ranges covering start to end of the file at path,
+    each starting at the beginning of a row. start must be the beginning of a row.
+
+    The quotes of roughly equal ranges are counted first (in parallel, if an executor is given) to
+    find the quote parity at each nominal boundary, and every boundary is then moved forward to the
+    first newline outside of a quoted field.
+    """
+    nominal = [start + (end - start) * i // num_ranges for i in range(num_ranges + 1)]
+    spans = list(zip(nominal[:-1], nominal[1:]))
+    if executor is None:
+        counts = [count_quotes(path, span_start, span_end) for span_start, span_end in spans]
+    else:
+        counts = list(executor.map(count_quotes, [path] * len(spans), *zip(*spans)))
+
+    boundaries = [start]
+    parity = 0
+    for position, count in zip(nominal[1:-1], counts):
+        parity ^= count & 1
+        boundaries.append(max(min(find_row_start(path, position, parity), end), boundaries[-1]))
+    boundaries.append(end)
+
+    return [(range_start, range_end) for range_start, range_end in zip(boundaries[:-1],
+                                                                        boundaries[1:])
+            if range_start < range_end]
+
+
+def parse_case_range(path: str, start: int, end: int, names: list[str], start_ordinal: int,
+                     end_ordinal: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Parses the rows in bytes start to end of the covid case file at path, which must start and end
+    at row boundaries. The header is skipped if start is 0.
+
+    Returns the case id, the index in names of the neighbourhood and the date ordinal of every case
+    of a neighbourhood in names dated between start_ordinal and end_ordinal (inclusive), in file
+    order, and the number of rows read.
+    """
+    indexes = {name: index for index, name in enumerate(names)}
+    ordinals = {}
+    case_ids = []
+    neighbourhoods = []
+    dates = []
+
+    with open(path, 'rb') as dataset:
+        dataset.seek(start)
+        reader = csv.reader(io.StringIO(dataset.read(end - start).decode()), delimiter=',')
+    if start == 0:
+        next(reader, None)  # Skip the dataset's header.
+
+    num_rows = 0
+    for row in reader:
+        num_rows += 1
+        index = indexes.get(row[4])
+        if index is None:
+            continue
+        ordinal = ordinals.get(row[9])
+        if ordinal is None:
+            ordinal = ordinals[row[9]] = string_to_datetime(row[9]).toordinal()
+        if start_ordinal <= ordinal <= end_ordinal:
+            case_ids.append(int(row[0]))
+            neighbourhoods.append(index)
+            dates.append(ordinal)
+
+    return (np.array(case_ids, dtype=np.int64), np.array(neighbourhoods, dtype=np.int32),
+            np.array(dates, dtype=np.int32), num_rows)
+
+
 # Data Loading System Classes
 
 class DataLoadingSystem:
@@ -108,39 +666,40 @@ class DataLoadingToronto(DataLoadingSystem):
         Method to load data for the City of Toronto super region from a file.
         """
         print('[modules.data_loading] Opening Toronto Region Dataset')
-        with open(path) as dataset:
-            reader = csv.reader(dataset, delimiter=',')
-            next(reader)  # Skip the dataset's header.
-
-            rows = [row for row in reader]
+        return self.super_region_from_rows(read_region_rows(path))
 
-            city_row = rows[0]
-            name = city_row[0]
-            population = remove_commas_number_string(city_row[1])
-
-            city = City(name, population)
+    def super_region_from_rows(self, rows: list[list[str]]) -> City:
+        """
+        Method to create the City of Toronto super region from the rows of the region dataset, as
+        returned by read_region_rows.
+        """
+        city_row = rows[0]
+        name = city_row[0]
+        population = remove_commas_number_string(city_row[1])
 
-        return city
+        return City(name, population)
 
     def load_sub_regions(self, path: str, city: City) -> dict[str, Neighbourhood]:
         """
         Method to load data for all neighbourhoods in the City of Toronto from a file.
         """
-        print('[modules.data_loading] Extracting individual subregion data .')
-        with open(path) as dataset:
-            reader = csv.reader(dataset, delimiter=',')
-            next(reader)  # Skip the dataset's header.
-            next(reader)  # Skip the entry for City of Toronto.
+        return self.sub_regions_from_rows(read_region_rows(path), city)
 
-            neighbourhoods = {}
+    def sub_regions_from_rows(self, rows: list[list[str]], city: City) -> dict[str, Neighbourhood]:
+        """
+        Method to create all neighbourhoods in the City of Toronto from the rows of the region
+        dataset, as returned by read_region_rows.
+        """
+        print('[modules.data_loading] Extracting individual subregion data .')
+        neighbourhoods = {}
 
-            for row in reader:
-                name = row[0]
-                population = remove_commas_number_string(row[1])
-                median_household_income = remove_commas_number_string(row[2])
-                neighbourhoods[name] = Neighbourhood(name, population, city,
-                                                     median_household_income)
-                print('[modules.data_loading] Neighbourhood Added:' + name)
+        for row in rows[1:]:  # Skip the entry for City of Toronto.
+            name = row[0]
+            population = remove_commas_number_string(row[1])
+            median_household_income = remove_commas_number_string(row[2])
+            neighbourhoods[name] = Neighbourhood(name, population, city,
+                                                 median_household_income)
+            print('[modules.data_loading] Neighbourhood Added:' + name)
 
         return neighbourhoods
 
@@ -149,7 +708,7 @@ class DataLoadingToronto(DataLoadingSystem):
         Method to load all covid cases for a specified neighbourhood.
         """
         print('[modules.data_loading] Opening covid case files')
-        with open(path) as dataset:
+        with open_dataset(path) as dataset:
             reader = csv.reader(dataset, delimiter=',')
             next(reader)  # Skip the dataset's header.
 
@@ -165,6 +724,189 @@ class DataLoadingToronto(DataLoadingSystem):
 
         return cases
 
+    def case_from_row(self, row: list[str], city: City) -> Optional[CovidCase]:
+        """
+        Returns the CovidCase of a row of the covid case file, or None if the case is outside the
+        date range of the loader or belongs to a neighbourhood that is not in city.
+        """
+        if row[4] not in city.neighbourhoods:
+            return None
+
+        date = string_to_datetime(row[9])
+        if not self.start_date <= date <= self.end_date:
+            return None
+
+        return CovidCase(int(row[0]), date, city, city.neighbourhoods[row[4]])
+
+    def load_case_arrays(self, path: str, city: City, start: int = 0, end: Optional[int] = None,
+                         workers: Optional[int] = None) \
+            -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        """
+        Method to parse bytes start to end (by default, to the end of the file) of the covid case
+        file in parallel, without creating a CovidCase object per case. start and end must be row
+        boundaries.
+
+        The bytes are split into row-aligned ranges that are parsed by a pool of worker processes
+        (by default, one per core). Returns the case id, the index of the neighbourhood in
+        city.neighbourhoods and the date ordinal of every case within the loader's date range, in
+        file order, and the number of rows read. The file must not be compressed.
+        """
+        if detect_compression(path) is not None:
+            raise ValueError('Compressed case files cannot be parsed in parallel: ' + path)
+        workers = workers if workers is not None else (os.cpu_count() or 1)
+        end = os.path.getsize(path) if end is None else end
+        names = list(city.neighbourhoods)
+        num_ranges = max(workers, -(-(end - start) // PARSE_RANGE_SIZE))
+
+        if end <= start:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32),
+                    np.zeros(0, dtype=np.int32), 0)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            ranges = split_rows(path, start, end, num_ranges, executor)
+            results = list(executor.map(parse_case_range, [path] * len(ranges),
+                                        [range_start for range_start, _ in ranges],
+                                        [range_end for _, range_end in ranges],
+                                        [names] * len(ranges),
+                                        [self.start_date.toordinal()] * len(ranges),
+                                        [self.end_date.toordinal()] * len(ranges)))
+
+        return (np.concatenate([result[0] for result in results]),
+                np.concatenate([result[1] for result in results]),
+                np.concatenate([result[2] for result in results]),
+                sum(result[3] for result in results))
+
+    def load_new_covid_cases(self, path: str, city: City,
+                             watermark: Optional[CaseFileWatermark] = None,
+                             workers: int = 1) \
+            -> tuple[dict[str, dict[int, CovidCase]], CaseFileWatermark, bool]:
+        """
+        Method to load the covid cases of every neighbourhood of city added to the file since
+        watermark, in a single pass over only the new rows. If workers is greater than 1, the new
+        rows are parsed in parallel by that many worker processes with load_case_arrays.
+
+        A compressed case file is always loaded in full and parsed serially, since its rows cannot
+        be reached by byte offset without decompressing everything before them.
+
+        A last row not ended by a newline is loaded by a full load, as long as its quotes are
+        balanced. An incremental load leaves it for the next call instead, since a later append
+        may complete it.
+
+        Returns the new cases of each neighbourhood by neighbourhood name, the watermark to use
+        for the next call and whether the whole file was loaded. The whole file is loaded when no
+        watermark is given, or when the part of the file covered by the watermark has been
+        rewritten; in that case the cases loaded previously should be discarded.
+        """
+        # The hash of the loaded prefix is extended with the new rows, so the prefix is only read
+        # once per call.
+        resume_point = None if watermark is None else watermark.resume_point(path)
+        full_reload = resume_point is None
+        if full_reload:
+            offset, digest = 0, hashlib.sha256()
+        else:
+            offset, digest = resume_point
+        open_row = not full_reload and watermark.open_row and offset == watermark.offset
+
+        compressed = detect_compression(path) is not None
+
+        parallel = workers > 1 and not compressed
+
+        print('[modules.data_loading] Opening covid case file from byte ' + str(offset))
+        if parallel:
+            end = find_last_row_end(path, offset)
+            if full_reload:
+                end = self.final_row_end(path, end)
+            complete = end - offset
+            cases, num_rows = self.load_cases_in_parallel(path, city, offset, offset + complete,
+                                                          workers)
+            with open(path, 'rb') as dataset:
+                CaseFileWatermark.hash_range(digest, dataset, offset, offset + complete)
+                if complete > 0:
+                    dataset.seek(offset + complete - 1)
+                    open_row = dataset.read(1) != b'\n'
+        else:
+            # The rows are parsed a block at a time as they are read (and decompressed, on a
+            # separate thread), so only a block of the file is held in memory at once.
+            complete = 0
+            header = []
+            cases = {name: {} for name in city.neighbourhoods}
+            num_rows = 0
+            with open_dataset(path, 'rb') as dataset:
+                if offset > 0:
+                    dataset.seek(offset)
+                for block in read_row_blocks(dataset, final_row=full_reload):
+                    rows = csv.reader(io.StringIO(block.decode()), delimiter=',')
+                    if offset == 0 and complete == 0:
+                        header = next(rows, [])  # Skip the dataset's header.
+                    if not block.endswith(b'\n'):
+                        # The last row is not ended by a newline, so it may have been cut off.
+                        rows = list(rows)
+                        if not all(is_complete_row(row, len(header)) for row in rows):
+                            break
+                    digest.update(block)
+                    open_row = not block.endswith(b'\n')
+                    complete += len(block)
+
+                    for row in rows:
+                        num_rows += 1
+                        case = self.case_from_row(row, city)
+                        if case is not None:
+                            cases[case.sub_region.name][case.case_id] = case
+
+        # The offset and checksum of a compressed file are of its decompressed contents.
+        new_watermark = CaseFileWatermark(offset + complete, digest.hexdigest(), open_row)
+
+        print('[modules.data_loading] Read ' + str(num_rows) + ' new covid case rows')
+        return cases, new_watermark, full_reload
+
+    def final_row_end(self, path: str, row_end: int) -> int:
+        """
+        Returns the offset just past the last row of the uncompressed covid case file at path to
+        load in full, where row_end is the offset just past its last newline. This is the size of
+        the file if the bytes after row_end form complete rows with balanced quotes (and are not
+        the header), and row_end otherwise.
+        """
+        with open(path, 'rb') as dataset:
+            header = next(csv.reader(io.StringIO(dataset.readline().decode())), [])
+            dataset.seek(row_end)
+            tail = dataset.read()
+
+        if row_end == 0 or not tail or tail.count(b'"') % 2 == 1:
+            return row_end
+
+        rows = csv.reader(io.StringIO(tail.decode()), delimiter=',')
+        if all(is_complete_row(row, len(header)) for row in rows):
+            return row_end + len(tail)
+        return row_end
+
+    def load_cases_in_parallel(self, path: str, city: City, start: int, end: int,
+                               workers: int) -> tuple[dict[str, dict[int, CovidCase]], int]:
+        """
+        Method to load the covid cases in bytes start to end of the covid case file with
+        load_case_arrays. Returns the cases of each neighbourhood by neighbourhood name and the
+        number of rows read.
+
+        Only the parsing is parallel: the workers return flat arrays, from which a CovidCase is
+        created per case in this process, since the neighbourhoods hold CovidCase objects. This
+        construction is the serial part of the load, and bounds its speed-up.
+        """
+        case_ids, indexes, ordinals, num_rows = self.load_case_arrays(path, city, start, end,
+                                                                      workers)
+        neighbourhoods = list(city.neighbourhoods.values())
+        cases = {name: {} for name in city.neighbourhoods}
+        neighbourhood_cases = [cases[neighbourhood.name] for neighbourhood in neighbourhoods]
+        dates = {}
+
+        for case_id, index, ordinal in zip(case_ids.tolist(), indexes.tolist(),
+                                           ordinals.tolist()):
+            date = dates.get(ordinal)
+            if date is None:
+                date = dates[ordinal] = datetime.date.fromordinal(ordinal)
+            neighbourhood_cases[index][case_id] = CovidCase(case_id, date, city,
+                                                            neighbourhoods[index])
+
+        return cases, num_rows
+
 
 if __name__ == '__main__':
     import python_ta.contracts
@@ -179,8 +921,15 @@ if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
-        'extra-imports': ['csv', 'modules.entities'],
-        'allowed-io': ['load_super_region', 'load_covid_cases', 'load_sub_region'],
+        'extra-imports': ['bz2', 'csv', 'gzip', 'hashlib', 'io', 'json', 'lzma', 'os', 'queue',
+                          'threading', 'concurrent.futures', 'typing', 'numpy', 'zstandard',
+                          'modules.entities'],
+        'allowed-io': ['detect_compression', 'open_decompressed', 'open_dataset',
+                       'read_region_rows', 'load_super_region', 'sub_regions_from_rows',
+                       'load_covid_cases', 'load_sub_region',
+                       'load_new_covid_cases', 'count_quotes', 'find_row_start',
+                       'find_last_row_end', 'parse_case_range', 'CaseFileWatermark.matches',
+                       'CaseFileWatermark.save', 'CaseFileWatermark.load'],
         'max-line-length': 100,
         'disable': ['R1705', 'C0200']
     })
@@ -21,7 +21,7 @@ This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
 
 from __future__ import annotations
 import datetime
-from typing import Optional
+from typing import Iterable, Optional
 from modules.regression import ExponentialRegressionModel
 
 # Region entities
@@ -87,6 +87,57 @@ class SubRegion(Region):
             self.num_cases_per_cap = (len(self.cases) / self.population) * 100000  # Per 100,000
             return True
 
+    def add_covid_cases(self, covid_cases: Iterable[CovidCase],
+                        take_ownership: bool = False) -> int:
+        """
+        Adds every covid case that is not already added to the sub region, recalculating the
+        number of cases per capita once for the whole batch. Returns the number of cases added.
+        Where the batch contains a case id more than once, the first case with that id is used,
+        as with repeated calls of add_covid_case.
+
+        If covid_cases is a dictionary mapping case ids to cases (as returned by the data loading
+        system) and the sub region has no cases yet, take_ownership=True makes the dictionary the
+        sub region's case dictionary without copying it. The caller must not modify it afterwards.
+
+        >>> toronto = City('Toronto', 200000)
+        >>> annex = Neighbourhood('Annex', 100000, toronto, 50000)
+        >>> day = datetime.date(2021, 1, 1)
+        >>> annex.add_covid_cases([CovidCase(i, day, toronto, annex) for i in [1, 2, 2]])
+        2
+        >>> annex.add_covid_cases([CovidCase(i, day, toronto, annex) for i in [2, 3]])
+        1
+        >>> annex.num_cases_per_cap
+        3.0
+        """
+        if isinstance(covid_cases, dict):
+            new_cases = covid_cases
+        else:
+            new_cases = {}
+            for covid_case in covid_cases:
+                new_cases.setdefault(covid_case.case_id, covid_case)
+
+        if take_ownership and not self.cases and isinstance(covid_cases, dict):
+            self.cases = covid_cases
+            added = len(covid_cases)
+        else:
+            new_ids = new_cases.keys() - self.cases.keys()
+            if len(new_ids) == len(new_cases):
+                self.cases.update(new_cases)
+            else:
+                self.cases.update({case_id: covid_case for case_id, covid_case in new_cases.items()
+                                   if case_id in new_ids})
+            added = len(new_ids)
+
+        self.num_cases_per_cap = (len(self.cases) / self.population) * 100000  # Per 100,000
+        return added
+
+    def clear_covid_cases(self) -> None:
+        """
+        Removes every covid case from the sub region.
+        """
+        self.cases = {}
+        self.num_cases_per_cap = 0
+
 
 class SuperRegion(Region):
     """
@@ -138,6 +189,25 @@ class SuperRegion(Region):
             self._sub_regions[subregion.name] = subregion
             return True
 
+    def add_sub_regions(self, subregions: Iterable[SubRegion]) -> int:
+        """
+        Add every subregion that is not already added to the subregion dictionary in one batch.
+        Where the batch contains a name more than once, the first subregion with that name is
+        used. Return the number of subregions added.
+        """
+        new_sub_regions = {}
+        for subregion in subregions:
+            new_sub_regions.setdefault(subregion.name, subregion)
+        new_names = new_sub_regions.keys() - self._sub_regions.keys()
+
+        if len(new_names) == len(new_sub_regions):
+            self._sub_regions.update(new_sub_regions)
+        else:
+            self._sub_regions.update({name: subregion for name, subregion in new_sub_regions.items()
+                                      if name in new_names})
+
+        return len(new_names)
+
     def update_economic_scaling(self) -> float:
         """
         Update the economic scaling of the super region and its subregions. Returns the economic scaling multiplier.
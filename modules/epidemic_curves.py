@@ -0,0 +1,218 @@
+"""
+Module Name: Epidemic Curves Module
+Source Path: modules/epidemic_curves.py
+
+Description:
+
+The Epidemic Curves Module turns the covid case dates of every neighbourhood of a super region into
+time series. The cases are binned into a daily incidence matrix, with one row per neighbourhood and
+one column per day, by a single bincount over the flat case arrays. Rolling sums and averages,
+incidence per 100,000 people, week-over-week growth and doubling times are then computed for every
+neighbourhood at once from cumulative sums along the rows of the matrix, without a Python loop over
+the cases or the neighbourhoods.
+
+The results are arrays of shape (neighbourhoods, days), in the order of the neighbourhoods of the
+super region, so that they can be drawn by the visualizer or used as the response of the batched
+regression models. Days at the start of the series that are not preceded by a full window have a
+value of NaN.
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import datetime
+
+import numpy as np
+
+from modules.entities import City
+from modules.snapshot import CaseArrays
+
+# The length in days of the rolling windows, and the number of people incidence is given per.
+DEFAULT_WINDOW = 7
+PER_CAPITA = 100000
+
+
+class EpidemicCurves:
+    """
+    Class to represent the daily covid case incidence of every neighbourhood of a super region.
+
+    Instance Attributes:
+        - names: the name of each neighbourhood.
+        - populations: the population of each neighbourhood.
+        - start_date: the date of the first day of the series.
+        - incidence: an integer array of shape (neighbourhoods, days) of the number of cases of
+        each neighbourhood dated on each day.
+
+    Representation Invariants:
+        - self.incidence.shape[0] == len(self.names) == len(self.populations)
+        - (self.incidence >= 0).all()
+
+    >>> curves = EpidemicCurves(['Annex'], np.array([1000]), datetime.date(2021, 1, 1),
+    ...                         np.array([[1, 1, 2, 2, 4, 4]]))
+    >>> curves.rolling_sums(2).tolist()
+    [[nan, 2.0, 3.0, 4.0, 6.0, 8.0]]
+    >>> curves.growth(2).tolist()
+    [[nan, nan, nan, 1.0, 1.0, 1.0]]
+    >>> curves.doubling_times(2).tolist()
+    [[nan, nan, nan, 2.0, 2.0, 2.0]]
+    """
+
+    names: list[str]
+    populations: np.ndarray
+    start_date: datetime.date
+    incidence: np.ndarray
+
+    def __init__(self, names: list[str], populations: np.ndarray, start_date: datetime.date,
+                 incidence: np.ndarray) -> None:
+        self.names = names
+        self.populations = populations
+        self.start_date = start_date
+        self.incidence = incidence
+
+    @classmethod
+    def from_case_arrays(cls, case_arrays: CaseArrays, populations: np.ndarray,
+                         start_date: datetime.date, end_date: datetime.date) -> 'EpidemicCurves':
+        """
+        Returns the daily incidence of the cases in case_arrays dated between start_date and
+        end_date, inclusive. populations holds the population of each sub region of case_arrays.
+
+        >>> case_arrays = CaseArrays(['Annex', 'Rosedale'], np.array([0, 2, 3]),
+        ...                          np.array([1, 2, 3]), np.array([738155, 738157, 738155]))
+        >>> EpidemicCurves.from_case_arrays(case_arrays, np.array([100, 200]),
+        ...                                 datetime.date(2021, 12, 31),
+        ...                                 datetime.date(2022, 1, 2)).incidence.tolist()
+        [[1, 0, 1], [1, 0, 0]]
+        """
+        num_days = max(end_date.toordinal() - start_date.toordinal() + 1, 0)
+        num_regions = len(case_arrays.names)
+
+        regions = np.repeat(np.arange(num_regions), np.diff(case_arrays.pointers))
+        days = case_arrays.dates.astype(np.int64) - start_date.toordinal()
+        in_range = (days >= 0) & (days < num_days)
+        bins = regions[in_range] * num_days + days[in_range]
+        incidence = np.bincount(bins, minlength=num_regions * num_days)
+
+        return cls(list(case_arrays.names), np.asarray(populations), start_date,
+                   incidence.reshape(num_regions, num_days))
+
+    @classmethod
+    def from_city(cls, city: City, start_date: datetime.date,
+                  end_date: datetime.date) -> 'EpidemicCurves':
+        """
+        Returns the daily incidence of the cases of every neighbourhood of city dated between
+        start_date and end_date, inclusive.
+        """
+        populations = np.array([neighbourhood.population
+                                for neighbourhood in city.neighbourhoods.values()])
+
+        return cls.from_case_arrays(CaseArrays.from_city(city), populations, start_date,
+                                    end_date)
+
+    def num_days(self) -> int:
+        """
+        Returns the number of days of the series.
+        """
+        return self.incidence.shape[1]
+
+    def dates(self) -> list[datetime.date]:
+        """
+        Returns the date of every day of the series.
+        """
+        return [self.start_date + datetime.timedelta(days=day) for day in range(self.num_days())]
+
+    def cumulative_cases(self) -> np.ndarray:
+        """
+        Returns the number of cases of each neighbourhood up to and including each day.
+        """
+        return np.cumsum(self.incidence, axis=1)
+
+    def rolling_sums(self, window: int = DEFAULT_WINDOW) -> np.ndarray:
+        """
+        Returns the number of cases of each neighbourhood in the window days up to and including
+        each day, computed as the difference of two cumulative sums.
+        """
+        cumulative = np.zeros((self.incidence.shape[0], self.num_days() + 1))
+        cumulative[:, 1:] = self.cumulative_cases()
+
+        sums = np.full(self.incidence.shape, np.nan)
+        if window <= self.num_days():
+            sums[:, window - 1:] = cumulative[:, window:] - cumulative[:, :-window]
+        return sums
+
+    def rolling_averages(self, window: int = DEFAULT_WINDOW) -> np.ndarray:
+        """
+        Returns the average daily number of cases of each neighbourhood in the window days up to
+        and including each day.
+        """
+        return self.rolling_sums(window) / window
+
+    def incidence_per_capita(self, window: int = DEFAULT_WINDOW) -> np.ndarray:
+        """
+        Returns the number of cases per 100,000 people of each neighbourhood in the window days up
+        to and including each day.
+        """
+        return self.rolling_sums(window) / self.populations[:, np.newaxis] * PER_CAPITA
+
+    def growth(self, window: int = DEFAULT_WINDOW) -> np.ndarray:
+        """
+        Returns the growth of the rolling sum of cases of each neighbourhood over the previous
+        window, as a fraction of the previous rolling sum (so week-over-week growth with the
+        default window). The growth is NaN where the previous rolling sum is zero.
+        """
+        sums = self.rolling_sums(window)
+        previous = np.full(sums.shape, np.nan)
+        if window < self.num_days():
+            previous[:, window:] = sums[:, :-window]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(previous > 0, sums / previous - 1, np.nan)
+
+    def doubling_times(self, window: int = DEFAULT_WINDOW) -> np.ndarray:
+        """
+        Returns the number of days it would take the rolling sum of cases of each neighbourhood to
+        double at the growth rate of the previous window, assuming exponential growth. The doubling
+        time is infinite where the cases are not growing, and NaN where the growth is undefined.
+        """
+        growth = self.growth(window)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            times = window * np.log(2) / np.log1p(growth)
+        return np.where(growth > 0, times, np.where(np.isnan(growth), np.nan, np.inf))
+
+    def cases_per_capita_between(self, start_date: datetime.date,
+                                 end_date: datetime.date) -> np.ndarray:
+        """
+        Returns the number of cases per 100,000 people of each neighbourhood dated between
+        start_date and end_date, inclusive, in the same way as Neighbourhood.num_cases_per_cap.
+        """
+        start = min(max(start_date.toordinal() - self.start_date.toordinal(), 0), self.num_days())
+        end = min(max(end_date.toordinal() - self.start_date.toordinal() + 1, start),
+                  self.num_days())
+
+        counts = self.incidence[:, start:end].sum(axis=1)
+        return (counts / self.populations) * PER_CAPITA
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+
+    python_ta.contracts.DEBUG_CONTRACTS = False
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+
+    doctest.testmod(verbose=True)
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'extra-imports': ['datetime', 'numpy', 'modules.entities', 'modules.snapshot'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
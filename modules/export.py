@@ -0,0 +1,258 @@
+"""
+Module Name: Export Module
+Source Path: modules/export.py
+
+Description:
+
+The Export Module writes a static bundle of the Toronto model for web dashboards. The bundle holds
+the neighbourhood polygons once, as simplified GeoJSON, and a small layer file for every variable
+and every time window, mapping each neighbourhood id (its neighbourhood number) to its value. A
+front end can then switch between variables or time windows by fetching a layer of a few kilobytes
+instead of the whole geometry.
+
+Every file except the manifest is gzip-compressed ahead of time and named after a hash of its
+contents, so that it can be served with a long cache lifetime: a file only changes name when its
+contents change. The manifest, manifest.json, lists the files of the bundle and should be served
+with a short cache lifetime. Compression is deterministic, so exporting the same model twice writes
+byte-identical files.
+
+Example usage from the root of the repository:
+
+    python3 -m modules.export --out data/export --monthly
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from modules.config import TorontoConfig
+from modules.geometry import load_boundaries
+from modules.level_of_detail import LevelOfDetailGeometry, load_level_of_detail
+from modules.preprocessing import PreprocessingSystem
+
+BUNDLE_VERSION = 1
+
+# Neighbourhood attributes exported as layers.
+LAYER_VARIABLES = ('num_cases_per_cap', 'median_household_income', 'scaled_economic_index',
+                   'scaled_case_index', 'population')
+
+# Number of decimal places kept in coordinates (about 0.1 m) and layer values.
+COORDINATE_DECIMALS = 6
+VALUE_DECIMALS = 4
+
+# Number of hexadecimal digits of the content hash in file names.
+HASH_LENGTH = 12
+
+
+def signed_area(ring: np.ndarray) -> float:
+    """
+    Returns the signed area of a closed ring, which is positive if the ring is counter-clockwise.
+
+    >>> signed_area(np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0], [0.0, 0.0]]))
+    1.0
+    """
+    return float(np.dot(ring[:-1, 0], ring[1:, 1]) - np.dot(ring[1:, 0], ring[:-1, 1])) / 2
+
+
+def geojson_geometry(rings: list[np.ndarray]) -> dict[str, any]:
+    """
+    Returns the GeoJSON geometry of a neighbourhood from its shapefile rings. In a shapefile, outer
+    rings are clockwise and each hole follows its outer ring. GeoJSON requires the opposite
+    orientation, so every ring is reversed.
+    """
+    polygons = []
+    for ring in rings:
+        coordinates = np.round(ring[::-1], COORDINATE_DECIMALS).tolist()
+        if signed_area(ring) <= 0 or not polygons:
+            polygons.append([coordinates])
+        else:
+            polygons[-1].append(coordinates)
+
+    if len(polygons) == 1:
+        return {'type': 'Polygon', 'coordinates': polygons[0]}
+    else:
+        return {'type': 'MultiPolygon', 'coordinates': polygons}
+
+
+def geojson_features(geometry: LevelOfDetailGeometry, level: int,
+                     codes: dict[str, int]) -> dict[str, any]:
+    """
+    Returns the GeoJSON feature collection of every neighbourhood at a level of detail. The id of
+    each feature is the neighbourhood's number.
+    """
+    return {'type': 'FeatureCollection',
+            'features': [{'type': 'Feature', 'id': codes[name],
+                          'properties': {'name': name, 'code': codes[name]},
+                          'geometry': geojson_geometry(rings)}
+                         for name, rings in zip(geometry.names, geometry.levels[level])]}
+
+
+def monthly_windows(start: datetime.date, end: datetime.date) \
+        -> list[tuple[datetime.date, datetime.date]]:
+    """
+    Returns the (inclusive) calendar month windows covering start to end, clipped to them.
+
+    >>> windows = monthly_windows(datetime.date(2020, 9, 15), datetime.date(2020, 11, 1))
+    >>> [(start.isoformat(), end.isoformat()) for start, end in windows[:2]]
+    [('2020-09-15', '2020-09-30'), ('2020-10-01', '2020-10-31')]
+    >>> windows[-1] == (datetime.date(2020, 11, 1), datetime.date(2020, 11, 1))
+    True
+    """
+    windows = []
+    month_start = start
+    while month_start <= end:
+        next_month = (month_start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        windows.append((month_start, min(next_month - datetime.timedelta(days=1), end)))
+        month_start = next_month
+
+    return windows
+
+
+class BundleWriter:
+    """
+    Class to write the gzip-compressed, content-hashed files of an export bundle.
+
+    Instance Attributes:
+        - directory: the directory the bundle is written to.
+        - written: the file names written so far.
+    """
+
+    directory: str
+    written: list[str]
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.written = []
+        os.makedirs(directory, exist_ok=True)
+
+    def write_json(self, stem: str, value: any) -> str:
+        """
+        Writes value as compact JSON to a gzip-compressed file named after stem and the hash of the
+        JSON, and returns the file name.
+        """
+        content = json.dumps(value, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        name = f'{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}.json.gz'
+        path = os.path.join(self.directory, name)
+
+        if not os.path.exists(path):
+            # A fixed mtime and no file name in the header keep the compressed bytes deterministic.
+            with open(path, 'wb') as out, gzip.GzipFile('', 'wb', 9, out, mtime=0) as compressed:
+                compressed.write(content)
+
+        self.written.append(name)
+        return name
+
+
+def layer_values(codes: list[int], values: list[float]) -> dict[str, float]:
+    """
+    Returns the layer mapping each neighbourhood id to its rounded value.
+
+    >>> layer_values([1, 2], [0.123456, 7])
+    {'1': 0.1235, '2': 7}
+    """
+    return {str(code): round(value, VALUE_DECIMALS) for code, value in zip(codes, values)}
+
+
+def export_bundle(system: PreprocessingSystem, directory: str,
+                  windows: Optional[list[tuple[datetime.date, datetime.date]]] = None,
+                  tolerance: float = 0.0001) -> dict[str, any]:
+    """
+    Writes the export bundle of the Toronto model of system to directory and returns its manifest.
+
+    The geometry is simplified at the coarsest level of detail with a tolerance of at most
+    tolerance degrees. A layer is written for every variable in LAYER_VARIABLES and, for every
+    (inclusive) window in windows, a layer of the cases per 100,000 people and of the scaled case
+    index of the cases within the window.
+    """
+    config = TorontoConfig()
+    toronto = system.regions['Toronto']
+    neighbourhoods = list(toronto.neighbourhoods.values())
+
+    print('[modules.export] Exporting geometry')
+    boundaries = load_boundaries(config.paths['shapes'])
+    all_codes = dict(zip(boundaries.names, boundaries.codes))
+    codes = [all_codes[neighbourhood.name] for neighbourhood in neighbourhoods]
+    geometry = load_level_of_detail(config.paths['shapes'], config.paths['cache'])
+    level = geometry.level_for_resolution(2 * tolerance)
+
+    writer = BundleWriter(directory)
+    manifest = {
+        'version': BUNDLE_VERSION,
+        'region': toronto.name,
+        'neighbourhoods': [{'id': code, 'name': neighbourhood.name}
+                           for code, neighbourhood in zip(codes, neighbourhoods)],
+        'geometry': {'file': writer.write_json('geometry', geojson_features(geometry, level,
+                                                                            all_codes)),
+                     'tolerance': geometry.tolerances[level]},
+        'layers': {},
+        'windows': []
+    }
+
+    print('[modules.export] Exporting layers')
+    for variable in LAYER_VARIABLES:
+        values = [getattr(neighbourhood, variable) for neighbourhood in neighbourhoods]
+        manifest['layers'][variable] = writer.write_json(variable, layer_values(codes, values))
+
+    if windows:
+        cases_per_cap, scaled_case_indexes = system.toronto_window_case_rates(windows)
+        for (start, end), window_cases, window_indexes in zip(windows, cases_per_cap,
+                                                              scaled_case_indexes):
+            stem = f'{start.isoformat()}_{end.isoformat()}'
+            manifest['windows'].append({
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'layers': {
+                    'num_cases_per_cap': writer.write_json(
+                        'num_cases_per_cap.' + stem, layer_values(codes, window_cases.tolist())),
+                    'scaled_case_index': writer.write_json(
+                        'scaled_case_index.' + stem, layer_values(codes, window_indexes.tolist()))
+                }})
+
+    with open(os.path.join(directory, 'manifest.json'), 'w') as out:
+        json.dump(manifest, out, indent=1, sort_keys=True)
+    print(f'[modules.export] Wrote {len(writer.written)} files to {directory}')
+
+    return manifest
+
+
+def main() -> None:
+    """
+    Exports the bundle from the command line.
+    """
+    parser = argparse.ArgumentParser(description='Export the Toronto model as a static bundle.')
+    parser.add_argument('--out', default='data/export', help='directory to write the bundle to')
+    parser.add_argument('--snapshot', default=None,
+                        help='model snapshot to load instead of loading the datasets')
+    parser.add_argument('--monthly', action='store_true',
+                        help='export a layer of the cases within every calendar month')
+    parser.add_argument('--tolerance', type=float, default=0.0001,
+                        help='largest simplification tolerance of the geometry in degrees')
+    args = parser.parse_args()
+
+    system = PreprocessingSystem()
+    if args.snapshot is not None:
+        system.load_snapshot(args.snapshot)
+    else:
+        system.init_toronto_model()
+
+    config = TorontoConfig()
+    windows = monthly_windows(config.start_date, config.end_date) if args.monthly else None
+    export_bundle(system, args.out, windows, args.tolerance)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+"""
+Module Name: Geocoding Module
+Source Path: modules/geocoding.py
+
+Description:
+
+The Geocoding Module assigns longitude/latitude points (such as covid cases with coordinates,
+testing sites or vaccination clinics) to the neighbourhoods of the Neighbourhood Boundaries
+shapefile, so that point data can be joined to the model.
+
+Assignment uses a uniform grid spatial index over the super region. Every grid cell that no
+neighbourhood boundary passes through lies entirely inside one neighbourhood (or entirely outside
+all of them), so the cell is labelled once when the index is built and points in it are assigned
+with a single array lookup. Only points in the cells crossed by a boundary are tested exactly,
+and only against the neighbourhoods whose edges cross their cell. The even-odd test of a point
+only needs the edges of the neighbourhood whose y ranges overlap the point's grid row, so the
+edges are also indexed by row, and every point is tested against the few edges of its row at
+once with the other boundary points of the batch, instead of against every edge of the
+neighbourhood.
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import datetime
+from typing import Optional
+
+import numpy as np
+
+from modules.entities import City, CovidCase
+from modules.geometry import NeighbourhoodBoundaries, load_boundaries, rasterize_boundaries
+
+# Label of the grid cells crossed by at least one neighbourhood boundary.
+BOUNDARY_CELL = -2
+
+
+class SpatialGridIndex:
+    """
+    Class to represent a uniform grid spatial index over a set of neighbourhood boundaries.
+
+    Instance Attributes:
+        - boundaries: the neighbourhood boundaries being indexed.
+        - origin: the (x, y) coordinate of the lower left corner of the grid.
+        - cell_size: the (width, height) of every grid cell.
+        - shape: the (rows, columns) of the grid.
+        - cell_labels: the neighbourhood index of every cell that no boundary crosses, -1 for
+        cells outside every neighbourhood and BOUNDARY_CELL for cells crossed by a boundary.
+        - candidate_pointers: for the k-th boundary cell, the neighbourhoods whose edges cross it
+        are candidate_indices[candidate_pointers[k]:candidate_pointers[k + 1]].
+        - candidate_indices: the concatenated candidate neighbourhoods of every boundary cell.
+        - boundary_rows: the position k in candidate_pointers of each boundary cell, by flat cell
+        index, or -1 for cells that are not boundary cells.
+        - edges: the concatenated (x1, y1, x2, y2) edges of every neighbourhood.
+        - band_pointers: the edges of neighbourhood i whose y range overlaps grid row r are
+        edges[band_edges[band_pointers[b]:band_pointers[b + 1]]], where b = i * rows + r.
+        - band_edges: the concatenated edge indices of every (neighbourhood, row) band.
+
+    Representation Invariants:
+        - self.cell_labels.shape == (self.shape[0] * self.shape[1],)
+        - self.cell_size[0] > 0 and self.cell_size[1] > 0
+    """
+
+    boundaries: NeighbourhoodBoundaries
+    origin: tuple[float, float]
+    cell_size: tuple[float, float]
+    shape: tuple[int, int]
+    cell_labels: np.ndarray
+    candidate_pointers: np.ndarray
+    candidate_indices: np.ndarray
+    boundary_rows: np.ndarray
+    edges: np.ndarray
+    band_pointers: np.ndarray
+    band_edges: np.ndarray
+
+    def __init__(self, boundaries: NeighbourhoodBoundaries, columns: int = 1024) -> None:
+        self.boundaries = boundaries
+        xmin, ymin, xmax, ymax = boundaries.bbox
+        cell_width = (xmax - xmin) / columns
+        rows = max(int(np.ceil((ymax - ymin) / cell_width)), 1)
+
+        self.origin = (xmin, ymin)
+        self.cell_size = (cell_width, cell_width)
+        self.shape = (rows, columns)
+
+        covered_cells = []
+        self.cell_labels = rasterize_boundaries(boundaries, self.origin, self.cell_size,
+                                                self.shape, covered_cells).ravel()
+        self._index_boundary_cells(covered_cells)
+
+    def _index_boundary_cells(self, covered_cells: list[np.ndarray]) -> None:
+        """
+        Marks every cell crossed by the bounding box of a boundary edge as a boundary cell and
+        records the candidate neighbourhoods of each boundary cell: those whose edges cross it and
+        those containing its centre (covered_cells, as returned by rasterize_boundaries). A
+        neighbourhood containing any point of a cell must be one or the other.
+
+        The edges of every neighbourhood are also indexed by the grid rows their y ranges overlap,
+        since only those edges can cross a horizontal ray from a point in the row.
+        """
+        rows, columns = self.shape
+        cells = []
+        owners = []
+        all_edges = []
+        band_keys = []
+        band_edges = []
+        num_edges = 0
+
+        for index in range(len(self.boundaries)):
+            edges = self.boundaries.edges(index)
+            column_lo, row_lo = self.cell_coordinates(np.minimum(edges[:, 0], edges[:, 2]),
+                                                      np.minimum(edges[:, 1], edges[:, 3]))
+            column_hi, row_hi = self.cell_coordinates(np.maximum(edges[:, 0], edges[:, 2]),
+                                                      np.maximum(edges[:, 1], edges[:, 3]))
+            widths = column_hi - column_lo + 1
+            heights = row_hi - row_lo + 1
+            counts = widths * heights
+
+            # Expand every edge into each cell of its bounding box.
+            edge_of_cell = np.repeat(np.arange(len(edges)), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            cell_columns = column_lo[edge_of_cell] + offsets % widths[edge_of_cell]
+            cell_rows = row_lo[edge_of_cell] + offsets // widths[edge_of_cell]
+
+            cells.append(np.unique(cell_rows * columns + cell_columns))
+
+            edge_of_row, edge_rows = expand_ranges(row_lo, heights)
+            band_keys.append(index * rows + edge_rows)
+            band_edges.append(num_edges + edge_of_row)
+            all_edges.append(edges)
+            num_edges += len(edges)
+
+        is_boundary = np.zeros(rows * columns, dtype=bool)
+        is_boundary[np.concatenate(cells)] = True
+
+        for index in range(len(self.boundaries)):
+            centre_cells = covered_cells[index][is_boundary[covered_cells[index]]]
+            cells[index] = np.union1d(cells[index], centre_cells)
+            owners.append(np.full(len(cells[index]), index, dtype=np.int32))
+
+        cells = np.concatenate(cells)
+        owners = np.concatenate(owners)
+        order = np.argsort(cells, kind='stable')
+        cells, owners = cells[order], owners[order]
+
+        boundary_cells, starts = np.unique(cells, return_index=True)
+        self.candidate_pointers = np.append(starts, len(cells))
+        self.candidate_indices = owners
+        self.cell_labels[boundary_cells] = BOUNDARY_CELL
+        self.boundary_rows = np.full(rows * columns, -1, dtype=np.int64)
+        self.boundary_rows[boundary_cells] = np.arange(len(boundary_cells))
+
+        band_keys = np.concatenate(band_keys)
+        order = np.argsort(band_keys, kind='stable')
+        self.edges = np.concatenate(all_edges)
+        self.band_edges = np.concatenate(band_edges)[order]
+        self.band_pointers = np.searchsorted(band_keys[order],
+                                             np.arange(len(self.boundaries) * rows + 1))
+
+    def cell_coordinates(self, xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the column and row of the cell containing each point, clipped to the grid.
+        """
+        columns = np.clip(((xs - self.origin[0]) / self.cell_size[0]).astype(np.int64),
+                          0, self.shape[1] - 1)
+        rows = np.clip(((ys - self.origin[1]) / self.cell_size[1]).astype(np.int64),
+                       0, self.shape[0] - 1)
+        return columns, rows
+
+    def assign(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Returns the index of the neighbourhood containing each point, or -1 for points outside
+        every neighbourhood.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        xmin, ymin, xmax, ymax = self.boundaries.bbox
+        in_bbox = (xs >= xmin) & (xs <= xmax) & (ys >= ymin) & (ys <= ymax)
+
+        columns, rows = self.cell_coordinates(xs, ys)
+        cells = rows * self.shape[1] + columns
+        labels = np.where(in_bbox, self.cell_labels[cells], -1)
+
+        boundary_points = np.flatnonzero(labels == BOUNDARY_CELL)
+        labels[boundary_points] = -1
+        if len(boundary_points) == 0:
+            return labels
+
+        # Pair every boundary point with each candidate neighbourhood of its cell.
+        boundary_rows = self.boundary_rows[cells[boundary_points]]
+        starts = self.candidate_pointers[boundary_rows]
+        counts = self.candidate_pointers[boundary_rows + 1] - starts
+        pair_of_candidate, candidate_offsets = expand_ranges(starts, counts)
+        pair_points = boundary_points[pair_of_candidate]
+        pair_polygons = self.candidate_indices[candidate_offsets]
+
+        crossings = self._count_crossings(xs, ys, pair_points,
+                                          pair_polygons * self.shape[0] + rows[pair_points])
+
+        # A point on the shared edge of two neighbourhoods is assigned to the later one.
+        inside = crossings % 2 == 1
+        np.maximum.at(labels, pair_points[inside], pair_polygons[inside])
+
+        return labels
+
+    def _count_crossings(self, xs: np.ndarray, ys: np.ndarray, pair_points: np.ndarray,
+                         pair_bands: np.ndarray, chunk_size: int = 2 ** 22) -> np.ndarray:
+        """
+        Returns the number of edges of band pair_bands[k] crossed by a horizontal ray to the right
+        of point pair_points[k], for every pair k, using the same crossing rule as
+        points_in_polygon. The band of a point's row holds every edge of its neighbourhood that
+        the ray can cross, so its parity gives whether the point is inside the neighbourhood.
+
+        The pairs of every point and edge of its band are tested at once, in chunks of at most
+        about chunk_size point-edge pairs to bound memory use.
+        """
+        starts = self.band_pointers[pair_bands]
+        counts = self.band_pointers[pair_bands + 1] - starts
+        ends = np.cumsum(counts)
+        crossings = np.zeros(len(pair_points), dtype=np.int64)
+        if len(ends) == 0:
+            return crossings
+
+        chunk_starts = np.searchsorted(ends, np.arange(0, ends[-1], chunk_size), side='right')
+        chunk_bounds = np.unique(np.append(chunk_starts, [0, len(pair_points)]))
+
+        for lo, hi in zip(chunk_bounds[:-1], chunk_bounds[1:]):
+            pair_of_test, edge_positions = expand_ranges(starts[lo:hi], counts[lo:hi])
+            x1, y1, x2, y2 = self.edges[self.band_edges[edge_positions]].T
+            px = xs[pair_points[lo:hi]][pair_of_test]
+            py = ys[pair_points[lo:hi]][pair_of_test]
+
+            crosses = (y1 > py) != (y2 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crossing_xs = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            crossings[lo:hi] = np.bincount(pair_of_test[crosses & (px < crossing_xs)],
+                                           minlength=hi - lo)
+
+        return crossings
+
+
+def expand_ranges(starts: np.ndarray, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns, for every element of the ranges starts[k] to starts[k] + counts[k] concatenated,
+    the range k it belongs to and its value.
+
+    >>> owners, values = expand_ranges(np.array([5, 0, 2]), np.array([2, 0, 3]))
+    >>> owners.tolist(), values.tolist()
+    ([0, 0, 2, 2, 2], [5, 6, 2, 3, 4])
+    """
+    owners = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    return owners, starts[owners] + offsets
+
+
+class NeighbourhoodGeocoder:
+    """
+    Class to assign longitude/latitude points to neighbourhoods in batches.
+
+    Instance Attributes:
+        - boundaries: the neighbourhood boundaries points are assigned to.
+        - index: the spatial index over the boundaries.
+
+    >>> from modules.config import TorontoConfig
+    >>> geocoder = NeighbourhoodGeocoder(TorontoConfig().paths['shapes'])  # doctest: +ELLIPSIS
+    [modules.geometry] ...
+    >>> geocoder.assign_names([-79.4075], [43.6785])
+    ['Casa Loma']
+    >>> geocoder.assign_names([-80.0], [43.0])
+    [None]
+    """
+
+    boundaries: NeighbourhoodBoundaries
+    index: SpatialGridIndex
+
+    def __init__(self, shapes_path: str, columns: int = 1024) -> None:
+        self.boundaries = load_boundaries(shapes_path)
+        print('[modules.geocoding] Building spatial index')
+        self.index = SpatialGridIndex(self.boundaries, columns)
+
+    def assign(self, longitudes: np.ndarray, latitudes: np.ndarray) -> np.ndarray:
+        """
+        Returns the index in self.boundaries of the neighbourhood containing each point, or -1 for
+        points outside every neighbourhood.
+        """
+        return self.index.assign(longitudes, latitudes)
+
+    def assign_names(self, longitudes: np.ndarray, latitudes: np.ndarray) -> list[Optional[str]]:
+        """
+        Returns the name of the neighbourhood containing each point, or None for points outside
+        every neighbourhood.
+        """
+        return [self.boundaries.names[label] if label >= 0 else None
+                for label in self.assign(longitudes, latitudes).tolist()]
+
+    def count_points(self, longitudes: np.ndarray, latitudes: np.ndarray) -> dict[str, int]:
+        """
+        Returns the number of points inside each neighbourhood, by neighbourhood name.
+        """
+        labels = self.assign(longitudes, latitudes)
+        counts = np.bincount(labels[labels >= 0], minlength=len(self.boundaries))
+
+        return {name: int(count) for name, count in zip(self.boundaries.names, counts)}
+
+    def add_point_cases(self, city: City, case_ids: list[int], dates: list[datetime.date],
+                        longitudes: np.ndarray, latitudes: np.ndarray) -> int:
+        """
+        Adds a CovidCase to the neighbourhood of city containing each point and returns the number
+        of cases added. Points outside every neighbourhood, or in a neighbourhood missing from
+        city, are skipped.
+        """
+        labels = self.assign(longitudes, latitudes).tolist()
+        cases = {name: [] for name in city.neighbourhoods}
+
+        for case_id, date, label in zip(case_ids, dates, labels):
+            if label >= 0 and self.boundaries.names[label] in cases:
+                neighbourhood = city.neighbourhoods[self.boundaries.names[label]]
+                cases[neighbourhood.name].append(CovidCase(case_id, date, city, neighbourhood))
+
+        return sum(city.neighbourhoods[name].add_covid_cases(neighbourhood_cases)
+                   for name, neighbourhood_cases in cases.items() if neighbourhood_cases)
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+
+    python_ta.contracts.DEBUG_CONTRACTS = False
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+
+    doctest.testmod(verbose=True)
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'extra-imports': ['datetime', 'numpy', 'modules.entities', 'modules.geometry'],
+        'allowed-io': ['NeighbourhoodGeocoder.__init__'],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
@@ -0,0 +1,314 @@
+"""
+Module Name: Geometry Module
+Source Path: modules/geometry.py
+
+Description:
+
+The Geometry Module loads the neighbourhood boundary polygons from the Neighbourhood Boundaries
+shapefile into NumPy arrays, so that the modules which work with the geography of a super region
+(geocoding, spatial analysis and visualization) share one representation of the boundaries. The
+neighbourhood names read from the shapefile are converted to the names used by the other datasets.
+
+The module also contains a scanline rasterizer that labels the cells of a regular grid with the
+neighbourhood containing each cell centre.
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+from typing import Optional
+
+import numpy as np
+
+# Index of the AREA_SHORT_CODE and AREA_DESC fields in a Neighbourhoods.shp record.
+CODE_FIELD = 4
+NAME_FIELD = 7
+
+# Length of one degree of latitude in kilometres.
+KM_PER_DEGREE = 111.32
+
+
+def neighbourhood_name_filtration(name_result: str) -> str:
+    """
+    Returns neighbourhood names which match up with other datasets.
+
+    Preconditions:
+        - len(name_result) > 0
+
+    >>> neighbourhood_name_filtration('Danforth East York')
+    'Danforth-East York'
+    >>> neighbourhood_name_filtration('Casa Loma')
+    'Casa Loma'
+    """
+    if name_result == 'North St.James Town':
+        name_result = 'North St. James Town'
+    if name_result == 'Danforth East York':
+        name_result = 'Danforth-East York'
+    if name_result == 'Briar Hill-Belgravia':
+        name_result = 'Briar Hill - Belgravia'
+    if name_result == 'Cabbagetown-South St.James Town':
+        name_result = 'Cabbagetown-South St. James Town'
+    return name_result
+
+
+def shape_record_name(record_name: str) -> str:
+    """
+    Returns the dataset name of a neighbourhood from its shapefile name, which ends with the
+    neighbourhood's number in brackets.
+
+    >>> shape_record_name('Casa Loma (96)')
+    'Casa Loma'
+    >>> shape_record_name('North St.James Town (74)')
+    'North St. James Town'
+    """
+    name_list = record_name.split()
+    name_result = ' '.join(name_list[:-1]).strip()
+
+    return neighbourhood_name_filtration(name_result)
+
+
+class NeighbourhoodBoundaries:
+    """
+    Class to represent the boundary polygons of every neighbourhood in a super region.
+
+    Instance Attributes:
+        - path: the path of the shapefile the boundaries were loaded from.
+        - names: the dataset name of each neighbourhood, in shapefile order.
+        - codes: the neighbourhood number of each neighbourhood, in shapefile order.
+        - polygons: the vertices of each neighbourhood as an array of shape (k, 2) of longitude
+        and latitude.
+        - parts: the index in polygons[i] at which each ring of neighbourhood i starts.
+        - bboxes: an array of shape (n, 4) of each neighbourhood's (xmin, ymin, xmax, ymax).
+        - bbox: the (xmin, ymin, xmax, ymax) bounding box of the whole super region.
+
+    Representation Invariants:
+        - len(self.names) == len(self.codes) == len(self.polygons) == len(self.parts)
+        - self.bboxes.shape == (len(self.names), 4)
+    """
+
+    path: str
+    names: list[str]
+    codes: list[int]
+    polygons: list[np.ndarray]
+    parts: list[list[int]]
+    bboxes: np.ndarray
+    bbox: tuple[float, float, float, float]
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.names = []
+        self.codes = []
+        self.polygons = []
+        self.parts = []
+
+        import shapefile as shp
+
+        print('[modules.geometry] Extracting Shape files')
+        reader = shp.Reader(path)
+        for shape_record in reader.iterShapeRecords():
+            self.names.append(shape_record_name(shape_record.record[NAME_FIELD]))
+            self.codes.append(int(shape_record.record[CODE_FIELD]))
+            self.polygons.append(np.array(shape_record.shape.points, dtype=np.float64))
+            self.parts.append(list(shape_record.shape.parts))
+        reader.close()
+
+        self._compute_bboxes()
+
+    @classmethod
+    def from_arrays(cls, path: str, names: list[str], codes: list[int],
+                    polygons: list[np.ndarray],
+                    parts: list[list[int]]) -> 'NeighbourhoodBoundaries':
+        """
+        Returns the boundaries with the given names, codes, polygons and ring starts (as described
+        in the class docstring) without reading a shapefile. The polygon arrays are used as given,
+        without copying them.
+        """
+        boundaries = cls.__new__(cls)
+        boundaries.path = path
+        boundaries.names = names
+        boundaries.codes = codes
+        boundaries.polygons = polygons
+        boundaries.parts = parts
+        boundaries._compute_bboxes()
+
+        return boundaries
+
+    def _compute_bboxes(self) -> None:
+        """
+        Computes the bounding box of every neighbourhood and of the whole super region.
+        """
+        self.bboxes = np.array([[polygon[:, 0].min(), polygon[:, 1].min(),
+                                 polygon[:, 0].max(), polygon[:, 1].max()]
+                                for polygon in self.polygons])
+        self.bbox = (float(self.bboxes[:, 0].min()), float(self.bboxes[:, 1].min()),
+                     float(self.bboxes[:, 2].max()), float(self.bboxes[:, 3].max()))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def index_of(self, name: str) -> int:
+        """
+        Returns the position of the neighbourhood with the given dataset name.
+        """
+        return self.names.index(name)
+
+    def rings(self, index: int) -> list[np.ndarray]:
+        """
+        Returns the vertices of each ring of the neighbourhood at index.
+        """
+        bounds = self.parts[index] + [len(self.polygons[index])]
+        return [self.polygons[index][bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+    def areas_km2(self) -> np.ndarray:
+        """
+        Returns the area of every neighbourhood in square kilometres. Longitudes are scaled by the
+        cosine of each neighbourhood's mean latitude before applying the shoelace formula, which is
+        accurate to well under a percent at the scale of a city.
+        """
+        areas = np.zeros(len(self))
+        for index in range(len(self)):
+            scale = KM_PER_DEGREE * np.cos(np.radians(self.polygons[index][:, 1].mean()))
+            for ring in self.rings(index):
+                xs = ring[:, 0] * scale
+                ys = ring[:, 1] * KM_PER_DEGREE
+                areas[index] += (np.dot(xs[:-1], ys[1:]) - np.dot(xs[1:], ys[:-1])) / 2
+
+        return np.abs(areas)
+
+    def edges(self, index: int) -> np.ndarray:
+        """
+        Returns the edges of the neighbourhood at index as an array of shape (e, 4) of
+        (x1, y1, x2, y2). Rings are closed, so consecutive vertices of a ring form its edges.
+        """
+        return np.concatenate([np.hstack((ring[:-1], ring[1:])) for ring in self.rings(index)])
+
+
+_boundaries_cache = {}
+
+
+def load_boundaries(path: str) -> NeighbourhoodBoundaries:
+    """
+    Returns the NeighbourhoodBoundaries of the shapefile at path. The shapefile is only read the
+    first time each path is requested.
+    """
+    if path not in _boundaries_cache:
+        _boundaries_cache[path] = NeighbourhoodBoundaries(path)
+
+    return _boundaries_cache[path]
+
+
+def rasterize_boundaries(boundaries: NeighbourhoodBoundaries, origin: tuple[float, float],
+                         cell_size: tuple[float, float], shape: tuple[int, int],
+                         covered_cells: Optional[list[np.ndarray]] = None) -> np.ndarray:
+    """
+    Returns an integer array of the given (rows, columns) shape in which every cell holds the
+    index of the neighbourhood containing the cell's centre, or -1 if no neighbourhood contains it.
+    Row 0 is the row of cells at the minimum y coordinate origin[1]. Where neighbourhoods overlap,
+    the cell holds the last of them.
+
+    If covered_cells is given, the flat indices of the cells whose centre lies inside each
+    neighbourhood are appended to it, in neighbourhood order.
+
+    Each neighbourhood is filled with a vectorized scanline pass: the crossings of every cell row
+    centre with every edge are computed in one array operation and the cells between consecutive
+    pairs of crossings are marked as inside (the even-odd rule).
+    """
+    rows, columns = shape
+    labels = np.full(shape, -1, dtype=np.int32)
+    centre_ys = origin[1] + (np.arange(rows) + 0.5) * cell_size[1]
+    centre_x0 = origin[0] + 0.5 * cell_size[0]
+
+    for index in range(len(boundaries)):
+        xmin, ymin, xmax, ymax = boundaries.bboxes[index]
+        row_start = max(int(np.ceil((ymin - origin[1]) / cell_size[1] - 0.5)), 0)
+        row_end = min(int(np.floor((ymax - origin[1]) / cell_size[1] - 0.5)) + 1, rows)
+        column_start = max(int(np.ceil((xmin - centre_x0) / cell_size[0])), 0)
+        column_end = min(int(np.floor((xmax - centre_x0) / cell_size[0])) + 1, columns)
+        if row_start >= row_end or column_start >= column_end:
+            if covered_cells is not None:
+                covered_cells.append(np.zeros(0, dtype=np.int64))
+            continue
+
+        edges = boundaries.edges(index)
+        ys = centre_ys[row_start:row_end, np.newaxis]
+        crosses = (edges[:, 1] > ys) != (edges[:, 3] > ys)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_xs = edges[:, 0] + (ys - edges[:, 1]) * (edges[:, 2] - edges[:, 0]) \
+                / (edges[:, 3] - edges[:, 1])
+        crossing_xs = np.sort(np.where(crosses, crossing_xs, np.inf), axis=1)
+
+        # Convert each crossing into the first column whose centre lies to its right, then mark
+        # the column span between pairs of crossings with a +1/-1 difference array.
+        crossing_columns = np.clip(np.ceil((crossing_xs - centre_x0) / cell_size[0]),
+                                   column_start, column_end).astype(np.int64) - column_start
+        width = column_end - column_start
+        difference = np.zeros((row_end - row_start, width + 1), dtype=np.int32)
+        row_indices = np.broadcast_to(np.arange(row_end - row_start)[:, np.newaxis],
+                                      crossing_columns.shape)
+        valid = np.isfinite(crossing_xs)
+        signs = np.where(np.arange(crossing_xs.shape[1]) % 2 == 0, 1, -1)
+        np.add.at(difference, (row_indices[valid], crossing_columns[valid]),
+                  np.broadcast_to(signs, crossing_xs.shape)[valid])
+
+        inside = np.cumsum(difference[:, :width], axis=1) > 0
+        window = labels[row_start:row_end, column_start:column_end]
+        window[inside] = index
+
+        if covered_cells is not None:
+            inside_rows, inside_columns = np.nonzero(inside)
+            covered_cells.append((inside_rows + row_start) * columns + inside_columns
+                                 + column_start)
+
+    return labels
+
+
+def points_in_polygon(xs: np.ndarray, ys: np.ndarray, edges: np.ndarray,
+                      chunk_size: int = 2 ** 22) -> np.ndarray:
+    """
+    Returns a boolean array of whether each point lies inside the polygon with the given edges,
+    using the even-odd crossing rule. The points are tested against every edge at once in chunks
+    of at most chunk_size point-edge pairs to bound memory use.
+
+    >>> square = np.array([[0.0, 0.0, 1.0, 0.0], [1.0, 0.0, 1.0, 1.0],
+    ...                    [1.0, 1.0, 0.0, 1.0], [0.0, 1.0, 0.0, 0.0]])
+    >>> points_in_polygon(np.array([0.5, 1.5]), np.array([0.5, 0.5]), square).tolist()
+    [True, False]
+    """
+    inside = np.zeros(len(xs), dtype=bool)
+    step = max(chunk_size // max(len(edges), 1), 1)
+    x1, y1, x2, y2 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+
+    for start in range(0, len(xs), step):
+        px = xs[start:start + step, np.newaxis]
+        py = ys[start:start + step, np.newaxis]
+        crosses = (y1 > py) != (y2 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_xs = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        inside[start:start + step] = np.count_nonzero(crosses & (px < crossing_xs), axis=1) % 2 == 1
+
+    return inside
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+
+    python_ta.contracts.DEBUG_CONTRACTS = False
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+
+    doctest.testmod(verbose=True)
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'extra-imports': ['typing', 'numpy', 'shapefile'],
+        'allowed-io': ['NeighbourhoodBoundaries.__init__'],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
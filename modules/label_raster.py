@@ -0,0 +1,187 @@
+"""
+Module Name: Label Raster Module
+Source Path: modules/label_raster.py
+
+Description:
+
+The Label Raster Module precomputes, once per output resolution, an integer raster of the
+neighbourhood boundaries in which every pixel holds the index of the neighbourhood it lies in (in
+shapefile order), OUTSIDE_LABEL if it lies in no neighbourhood, or BORDER_LABEL if it lies on the
+edge of a neighbourhood. A map of any variable is then drawn by building a palette with one colour
+per neighbourhood and looking up the colour of every pixel at once with palette[labels], so that a
+new variable or time frame costs a single gather instead of filling every polygon again.
+
+The rasters are cached in memory and on disk as .npy files, keyed by the contents of the shapefile
+and the resolution, and are memory-mapped when loaded from the disk cache. The names and bounding
+box of the neighbourhoods are cached beside them, so that a cached raster is used without reading
+the shapefile again.
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import hashlib
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from modules.geometry import NeighbourhoodBoundaries, load_boundaries, rasterize_boundaries
+
+LABEL_RASTER_CACHE_VERSION = 1
+
+# The labels of pixels outside every neighbourhood and on the edge of a neighbourhood. Both are
+# negative, so they index the last two entries of a palette.
+OUTSIDE_LABEL = -1
+BORDER_LABEL = -2
+
+# Colours of the outside and border pixels, as RGBA bytes.
+OUTSIDE_COLOUR = (0, 0, 0, 0)
+BORDER_COLOUR = (0, 0, 0, 255)
+
+
+class LabelRaster:
+    """
+    Class to represent the neighbourhood boundaries rasterized at one resolution.
+
+    Instance Attributes:
+        - names: the dataset name of each neighbourhood, in shapefile order.
+        - labels: an integer array of shape (rows, columns) holding the index in names of the
+        neighbourhood containing each pixel, OUTSIDE_LABEL or BORDER_LABEL. Row 0 is the row of
+        pixels at the minimum latitude.
+        - bbox: the (xmin, ymin, xmax, ymax) area covered by the raster.
+
+    Representation Invariants:
+        - self.labels.ndim == 2
+        - self.labels.size == 0 or BORDER_LABEL <= self.labels.min()
+        - self.labels.size == 0 or self.labels.max() < len(self.names)
+    """
+
+    names: list[str]
+    labels: np.ndarray
+    bbox: tuple[float, float, float, float]
+
+    def __init__(self, names: list[str], labels: np.ndarray,
+                 bbox: tuple[float, float, float, float]) -> None:
+        self.names = names
+        self.labels = labels
+        self.bbox = bbox
+
+    @classmethod
+    def build(cls, boundaries: NeighbourhoodBoundaries, shape: tuple[int, int]) -> 'LabelRaster':
+        """
+        Returns the boundaries rasterized into shape (rows, columns) pixels covering their bounding
+        box.
+        """
+        xmin, ymin, xmax, ymax = boundaries.bbox
+        rows, columns = shape
+        labels = rasterize_boundaries(boundaries, (xmin, ymin),
+                                      ((xmax - xmin) / columns, (ymax - ymin) / rows), shape)
+
+        return cls(list(boundaries.names), mark_borders(labels), boundaries.bbox)
+
+    def extent(self) -> tuple[float, float, float, float]:
+        """
+        Returns the (left, right, bottom, top) extent of the raster, as used by imshow.
+        """
+        return self.bbox[0], self.bbox[2], self.bbox[1], self.bbox[3]
+
+    def render(self, colours: np.ndarray) -> np.ndarray:
+        """
+        Returns an image of shape (rows, columns, 4) of RGBA bytes in which every pixel has the
+        colour of its neighbourhood, where colours[i] is the RGBA colour of neighbourhood i.
+
+        >>> labels = np.array([[0, BORDER_LABEL], [1, OUTSIDE_LABEL]])
+        >>> raster = LabelRaster(['Annex', 'Rosedale'], labels, (0.0, 0.0, 2.0, 2.0))
+        >>> raster.render(np.array([[255, 0, 0, 255], [0, 0, 255, 255]]))[:, :, 0].tolist()
+        [[255, 0], [0, 0]]
+        """
+        palette = np.vstack((np.asarray(colours, dtype=np.uint8).reshape(-1, 4),
+                             BORDER_COLOUR, OUTSIDE_COLOUR)).astype(np.uint8)
+        return palette[self.labels]
+
+
+def mark_borders(labels: np.ndarray) -> np.ndarray:
+    """
+    Returns a copy of labels in which every pixel of a neighbourhood next to a pixel with a
+    different label (horizontally or vertically) holds BORDER_LABEL. Pixels beyond the edges of
+    the raster count as outside every neighbourhood.
+
+    >>> labels = np.array([[0, 0, 0, 1], [0, 0, 0, 1], [0, 0, 0, 1], [0, 0, -1, -1]])
+    >>> mark_borders(labels).tolist()
+    [[-2, -2, -2, -2], [-2, 0, -2, -2], [-2, 0, -2, -2], [-2, -2, -1, -1]]
+    """
+    padded = np.pad(labels, 1, constant_values=OUTSIDE_LABEL)
+    differs = (padded[1:-1, 2:] != labels) | (padded[1:-1, :-2] != labels) \
+        | (padded[2:, 1:-1] != labels) | (padded[:-2, 1:-1] != labels)
+
+    marked = labels.copy()
+    marked[differs & (labels >= 0)] = BORDER_LABEL
+    return marked
+
+
+_label_raster_cache = {}
+
+
+def load_label_raster(shapes_path: str, shape: tuple[int, int],
+                      cache_directory: Optional[str] = None) -> LabelRaster:
+    """
+    Returns the label raster of the shapefile at shapes_path at shape (rows, columns). Results are
+    cached in memory and, if cache_directory is given, on disk under a key derived from the
+    shapefile's contents and the shape, so each raster is only computed once. Rasters read from
+    the disk cache are memory-mapped.
+    """
+    with open(shapes_path, 'rb') as shapes_file:
+        digest = hashlib.sha256(shapes_file.read())
+    key = digest.hexdigest()[:16] + '_' + str(shape[0]) + 'x' + str(shape[1])
+
+    if key in _label_raster_cache:
+        return _label_raster_cache[key]
+
+    cache_path = None
+    if cache_directory is not None:
+        cache_path = os.path.join(cache_directory, 'label_raster_v'
+                                  + str(LABEL_RASTER_CACHE_VERSION) + '_' + key)
+
+    if cache_path is not None and os.path.exists(cache_path + '.npy'):
+        with open(cache_path + '.json') as metadata_file:
+            metadata = json.load(metadata_file)
+        raster = LabelRaster(metadata['names'], np.load(cache_path + '.npy', mmap_mode='r'),
+                             tuple(metadata['bbox']))
+    else:
+        print('[modules.label_raster] Rasterizing neighbourhood boundaries')
+        raster = LabelRaster.build(load_boundaries(shapes_path), shape)
+        if cache_path is not None:
+            os.makedirs(cache_directory, exist_ok=True)
+            with open(cache_path + '.json', 'w') as metadata_file:
+                json.dump({'names': raster.names, 'bbox': list(raster.bbox)}, metadata_file)
+            np.save(cache_path + '.npy', raster.labels)
+
+    _label_raster_cache[key] = raster
+    return raster
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+
+    python_ta.contracts.DEBUG_CONTRACTS = False
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+
+    doctest.testmod(verbose=True)
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'extra-imports': ['hashlib', 'json', 'os', 'typing', 'numpy', 'modules.geometry'],
+        'allowed-io': ['load_label_raster'],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
@@ -0,0 +1,357 @@
+"""
+Module Name: Level of Detail Module
+Source Path: modules/level_of_detail.py
+
+Description:
+
+The Level of Detail Module precomputes simplified versions of the neighbourhood boundary polygons
+at several tolerances, so that maps only draw as many vertices as their output resolution can
+show. The level used for a render is picked from the size and DPI of the output: the coarsest
+level whose tolerance is below half a pixel looks the same as the full resolution boundaries.
+
+Simplification preserves the borders shared by neighbouring polygons. Every ring is split into
+arcs at the vertices where the set of neighbourhoods sharing its edges changes, each distinct arc
+is simplified once with the Douglas-Peucker algorithm (measuring distances with vectorized NumPy
+operations), and the simplified arcs are reassembled into rings. Two neighbourhoods therefore
+always draw identical simplified versions of their common border, without gaps or overlaps.
+
+The simplified sets are cached in memory and on disk, keyed by the contents of the shapefile and
+the tolerances used.
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import hashlib
+import os
+from typing import Optional
+
+import numpy as np
+
+from modules.geometry import NeighbourhoodBoundaries, load_boundaries
+
+LEVEL_OF_DETAIL_CACHE_VERSION = 1
+
+# Tolerances in degrees of longitude/latitude. The first level is the original geometry.
+DEFAULT_TOLERANCES = (0.0, 0.00002, 0.0001, 0.0005, 0.002)
+
+
+def douglas_peucker(points: np.ndarray, tolerance: float, force_split: bool = False) -> np.ndarray:
+    """
+    Returns a boolean mask of the points of an open polyline kept by the Douglas-Peucker algorithm
+    with the given tolerance. The first and last points are always kept. If force_split is True,
+    the point farthest from the line through the endpoints is kept regardless of the tolerance.
+
+    >>> line = np.array([[0.0, 0.0], [1.0, 0.1], [2.0, -0.1], [3.0, 5.0], [4.0, 6.0]])
+    >>> douglas_peucker(line, 0.5).tolist()
+    [True, False, True, True, True]
+    >>> douglas_peucker(line, 10.0).tolist()
+    [True, False, False, False, True]
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1, force_split)]
+
+    while stack:
+        start, end, force = stack.pop()
+        if end - start < 2:
+            continue
+
+        direction = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(direction[0], direction[1])
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0]) / length
+
+        farthest = int(np.argmax(distances))
+        if force or distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split, False))
+            stack.append((split, end, False))
+
+    return keep
+
+
+class _Topology:
+    """
+    Private class holding the shared-vertex structure of a set of boundaries: a global id for
+    every distinct vertex and the neighbourhoods owning each vertex id.
+
+    Instance Attributes:
+        - ring_ids: the vertex ids of every ring, by neighbourhood and then ring.
+        - owners: the set of neighbourhoods whose boundary contains each vertex id.
+    """
+
+    ring_ids: list[list[np.ndarray]]
+    owners: list[frozenset]
+
+    def __init__(self, boundaries: NeighbourhoodBoundaries) -> None:
+        vertices = np.concatenate(boundaries.polygons)
+        _, vertex_ids = np.unique(np.round(vertices, 7), axis=0, return_inverse=True)
+        vertex_ids = vertex_ids.ravel()
+
+        owners = [set() for _ in range(int(vertex_ids.max()) + 1)]
+        self.ring_ids = []
+        position = 0
+        for index in range(len(boundaries)):
+            polygon_ids = vertex_ids[position:position + len(boundaries.polygons[index])]
+            position += len(boundaries.polygons[index])
+            for vertex_id in np.unique(polygon_ids).tolist():
+                owners[vertex_id].add(index)
+
+            bounds = boundaries.parts[index] + [len(polygon_ids)]
+            self.ring_ids.append([polygon_ids[bounds[i]:bounds[i + 1]]
+                                  for i in range(len(bounds) - 1)])
+
+        self.owners = [frozenset(vertex_owners) for vertex_owners in owners]
+
+    def arcs(self, ids: np.ndarray) -> list[tuple[int, int]]:
+        """
+        Returns the (start, end) vertex positions of the arcs of a closed ring, splitting at every
+        vertex where the set of neighbourhoods sharing the ring's edges changes. A ring without such
+        a vertex is returned as the single arc (0, len(ids) - 1).
+        """
+        ids = ids.tolist()
+        edge_owners = [self.owners[ids[k]] & self.owners[ids[k + 1]] for k in range(len(ids) - 1)]
+        nodes = [k for k in range(len(edge_owners)) if edge_owners[k] != edge_owners[k - 1]
+                 or len(self.owners[ids[k]]) >= 3]
+
+        if not nodes:
+            return [(0, len(ids) - 1)]
+
+        arcs = [(nodes[i], nodes[i + 1]) for i in range(len(nodes) - 1)]
+        arcs.append((nodes[-1], nodes[0] + len(ids) - 1))  # The arc wrapping past the ring's end.
+        return arcs
+
+
+def _canonical(ids: list[int]) -> tuple[tuple[int, ...], bool]:
+    """
+    Returns a key shared by an arc and its reverse, and whether ids is the reverse of the key.
+
+    >>> _canonical([5, 2, 1])
+    ((1, 2, 5), True)
+    """
+    forward = tuple(ids)
+    backward = forward[::-1]
+    if backward < forward:
+        return backward, True
+    else:
+        return forward, False
+
+
+def simplify_boundaries(boundaries: NeighbourhoodBoundaries, tolerance: float,
+                        topology: Optional[_Topology] = None) -> list[list[np.ndarray]]:
+    """
+    Returns the rings of every neighbourhood simplified with the given tolerance, preserving the
+    borders shared between neighbourhoods. Every distinct arc is simplified exactly once.
+    """
+    if topology is None:
+        topology = _Topology(boundaries)
+
+    simplified_arcs = {}
+    simplified = []
+
+    for index in range(len(boundaries)):
+        rings = []
+        for ring, ids in zip(boundaries.rings(index), topology.ring_ids[index]):
+            arcs = topology.arcs(ids)
+            # Rings of one or two arcs could collapse to a line, so their farthest points are kept.
+            force_split = len(arcs) < 3
+            wrapped = np.concatenate((ring, ring[1:]))
+            wrapped_ids = np.concatenate((ids, ids[1:])).tolist()
+            kept = []
+
+            for start, end in arcs:
+                key, reversed_arc = _canonical(wrapped_ids[start:end + 1])
+                if key not in simplified_arcs:
+                    points = wrapped[start:end + 1]
+                    if reversed_arc:
+                        points = points[::-1]
+                    simplified_arcs[key] = points[douglas_peucker(points, tolerance, force_split)]
+
+                points = simplified_arcs[key]
+                kept.append(points[::-1][:-1] if reversed_arc else points[:-1])
+
+            kept.append(kept[0][:1])  # Close the ring.
+            rings.append(np.concatenate(kept))
+
+        simplified.append(rings)
+
+    return simplified
+
+
+class LevelOfDetailGeometry:
+    """
+    Class to represent the neighbourhood boundaries simplified at several tolerances.
+
+    Instance Attributes:
+        - names: the dataset name of each neighbourhood.
+        - tolerances: the simplification tolerance of each level, from finest to coarsest.
+        - levels: the rings of every neighbourhood at each level, so that levels[l][i][r] is an
+        array of shape (k, 2) of the vertices of ring r of neighbourhood i at level l.
+        - bbox: the (xmin, ymin, xmax, ymax) bounding box of the finest level.
+
+    Representation Invariants:
+        - len(self.levels) == len(self.tolerances)
+        - all(len(level) == len(self.names) for level in self.levels)
+    """
+
+    names: list[str]
+    tolerances: list[float]
+    levels: list[list[list[np.ndarray]]]
+    bbox: tuple[float, float, float, float]
+
+    def __init__(self, names: list[str], tolerances: list[float],
+                 levels: list[list[list[np.ndarray]]]) -> None:
+        self.names = names
+        self.tolerances = tolerances
+        self.levels = levels
+
+        rings = [ring for rings in levels[0] for ring in rings] if levels else []
+        if rings:
+            vertices = np.concatenate(rings)
+            self.bbox = (float(vertices[:, 0].min()), float(vertices[:, 1].min()),
+                         float(vertices[:, 0].max()), float(vertices[:, 1].max()))
+        else:
+            self.bbox = (0.0, 0.0, 0.0, 0.0)
+
+    @classmethod
+    def build(cls, boundaries: NeighbourhoodBoundaries,
+              tolerances: tuple[float, ...] = DEFAULT_TOLERANCES) -> 'LevelOfDetailGeometry':
+        """
+        Returns the simplified boundaries at each tolerance. A tolerance of 0 keeps the original
+        geometry.
+        """
+        topology = _Topology(boundaries)
+        levels = []
+        for tolerance in tolerances:
+            if tolerance == 0:
+                levels.append([boundaries.rings(index) for index in range(len(boundaries))])
+            else:
+                levels.append(simplify_boundaries(boundaries, tolerance, topology))
+
+        return cls(list(boundaries.names), list(tolerances), levels)
+
+    def vertex_count(self, level: int) -> int:
+        """
+        Returns the total number of vertices of every ring at level.
+        """
+        return sum(len(ring) for rings in self.levels[level] for ring in rings)
+
+    def level_for_resolution(self, units_per_pixel: float) -> int:
+        """
+        Returns the coarsest level whose tolerance is at most half of a pixel.
+
+        >>> geometry = LevelOfDetailGeometry([], [0.0, 0.001, 0.01], [[], [], []])
+        >>> geometry.level_for_resolution(0.005)
+        1
+        >>> geometry.level_for_resolution(0.0001)
+        0
+        """
+        level = 0
+        for candidate, tolerance in enumerate(self.tolerances):
+            if tolerance <= units_per_pixel / 2:
+                level = candidate
+
+        return level
+
+    def level_for_output(self, width_inches: float, dpi: float) -> int:
+        """
+        Returns the level to draw a map of the whole super region into an output width_inches wide
+        at the given dpi.
+        """
+        return self.level_for_resolution((self.bbox[2] - self.bbox[0]) / (width_inches * dpi))
+
+    def save(self, path: str) -> None:
+        """
+        Saves every level to a NumPy archive at path.
+        """
+        arrays = {'names': np.array(self.names), 'tolerances': np.array(self.tolerances)}
+        for level, polygons in enumerate(self.levels):
+            rings = [ring for polygon in polygons for ring in polygon]
+            arrays['vertices_' + str(level)] = np.concatenate(rings)
+            arrays['ring_lengths_' + str(level)] = np.array([len(ring) for ring in rings])
+            arrays['ring_counts_' + str(level)] = np.array([len(polygon) for polygon in polygons])
+
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> 'LevelOfDetailGeometry':
+        """
+        Returns the levels saved at path by LevelOfDetailGeometry.save.
+        """
+        with np.load(path) as archive:
+            tolerances = archive['tolerances'].tolist()
+            levels = []
+            for level in range(len(tolerances)):
+                rings = np.split(archive['vertices_' + str(level)],
+                                 np.cumsum(archive['ring_lengths_' + str(level)])[:-1])
+                bounds = np.concatenate(([0], np.cumsum(archive['ring_counts_' + str(level)])))
+                levels.append([rings[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)])
+
+            return cls(archive['names'].tolist(), tolerances, levels)
+
+
+_level_of_detail_cache = {}
+
+
+def load_level_of_detail(shapes_path: str, cache_directory: Optional[str] = None,
+                         tolerances: tuple[float, ...] = DEFAULT_TOLERANCES) \
+        -> LevelOfDetailGeometry:
+    """
+    Returns the level of detail geometry of the shapefile at shapes_path. Results are cached in
+    memory and, if cache_directory is given, on disk under a key derived from the shapefile's
+    contents and the tolerances, so each set of simplified geometries is only computed once.
+    """
+    with open(shapes_path, 'rb') as shapes_file:
+        digest = hashlib.sha256(shapes_file.read())
+    digest.update(repr(tuple(tolerances)).encode())
+    key = digest.hexdigest()[:16]
+
+    if key in _level_of_detail_cache:
+        return _level_of_detail_cache[key]
+
+    cache_path = None
+    if cache_directory is not None:
+        cache_path = os.path.join(cache_directory, 'level_of_detail_v'
+                                  + str(LEVEL_OF_DETAIL_CACHE_VERSION) + '_' + key + '.npz')
+
+    if cache_path is not None and os.path.exists(cache_path):
+        geometry = LevelOfDetailGeometry.load(cache_path)
+    else:
+        print('[modules.level_of_detail] Simplifying neighbourhood boundaries')
+        geometry = LevelOfDetailGeometry.build(load_boundaries(shapes_path), tolerances)
+        if cache_path is not None:
+            os.makedirs(cache_directory, exist_ok=True)
+            geometry.save(cache_path)
+
+    _level_of_detail_cache[key] = geometry
+    return geometry
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+
+    python_ta.contracts.DEBUG_CONTRACTS = False
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+
+    doctest.testmod(verbose=True)
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'extra-imports': ['hashlib', 'os', 'typing', 'numpy', 'modules.geometry'],
+        'allowed-io': ['load_level_of_detail'],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
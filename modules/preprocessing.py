@@ -10,10 +10,20 @@ but only has the city of Toronto implemented. This class also is in charge of ca
 module onto a certain region.
 """
 
+import datetime
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
 from modules import data_loading as dl
+from modules import snapshot
 from modules.config import TorontoConfig
 from modules.entities import *
-from modules.regression import ExponentialRegressionModel
+from modules.epidemic_curves import EpidemicCurves
+from modules.regression import BatchedRegressionModel, ExponentialRegressionModel, \
+    fit_regression
 
 
 class PreprocessingSystem:
@@ -22,38 +32,119 @@ class PreprocessingSystem:
 
     Instance Attributes:
         - regions: a dictionary mapping the name of a region to an instance of a Region.
+        - case_watermarks: a dictionary mapping the name of a region to the high-water mark of its
+        covid case file.
+        - case_arrays: a dictionary mapping the name of a region restored from a snapshot to the
+        flat arrays of its covid cases, until the region is refreshed.
 
     """
     regions: dict[str: SuperRegion]
+    case_watermarks: dict[str, dl.CaseFileWatermark]
+    case_arrays: dict[str, snapshot.CaseArrays]
 
     def __init__(self) -> None:
         self.regions = {}
+        self.case_watermarks = {}
+        self.case_arrays = {}
 
-    def init_toronto_model(self) -> None:
+    def init_toronto_model(self, prefetch_geometry: bool = False) -> None:
         """
         Initialise classes for toronto model.
+
+        The region dataset is read once, and its rows are shared by the super region and the
+        neighbourhoods. If prefetch_geometry is True, the neighbourhood boundaries drawn by the
+        heatmaps are loaded on a background thread while the covid cases are loaded, so that the
+        first figure does not wait for the shapefile. Parsing the cases needs the neighbourhoods
+        and holds the GIL, so it runs on this thread (or in worker processes, if
+        config.loading['workers'] is greater than 1).
         """
 
         config = TorontoConfig()
         print('[modules.preprocessing] Generating Toronto Model')
         data_loading_system = dl.DataLoadingToronto(config.start_date, config.end_date)
-        self.regions['Toronto'] = data_loading_system.load_super_region(config.paths['regions'])
 
-        neighbourhoods = data_loading_system.load_sub_regions(config.paths['regions'],
-                                                              self.regions['Toronto'])
+        executor = None
+        geometry = None
+        if prefetch_geometry:
+            from modules.level_of_detail import load_level_of_detail
+
+            executor = ThreadPoolExecutor(max_workers=1)
+            geometry = executor.submit(load_level_of_detail, config.paths['shapes'],
+                                       config.paths['cache'])
+
+        try:
+            rows = dl.read_region_rows(config.paths['regions'])
+            self.regions['Toronto'] = data_loading_system.super_region_from_rows(rows)
+            neighbourhoods = data_loading_system.sub_regions_from_rows(rows,
+                                                                       self.regions['Toronto'])
+            self.regions['Toronto'].add_sub_regions(neighbourhoods.values())
+
+            self.case_watermarks.pop('Toronto', None)
+            self.refresh_toronto_model()
 
-        for neighbourhood in neighbourhoods.values():
-            self.regions['Toronto'].add_sub_region(neighbourhood)
-            neighbourhood_cases = data_loading_system.load_covid_cases(config.paths['cases'],
-                                                                       neighbourhood)
-            for case in neighbourhood_cases.values():
-                neighbourhood.add_covid_case(case)
+            if geometry is not None:
+                geometry.result()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def refresh_toronto_model(self, watermark_path: Optional[str] = None) -> bool:
+        """
+        Loads the covid cases appended to the Toronto case file since the model was last loaded or
+        refreshed, then updates the scaling and regression model. Only the new rows of the file
+        are read. If the previously loaded part of the file has been rewritten, every case is
+        reloaded instead. Returns whether every case was reloaded.
+
+        If watermark_path is given, the high-water mark of the case file is also read from and
+        saved to that file, so that a restored model can resume from where it was saved.
+        """
+        config = TorontoConfig()
+        toronto = self.regions['Toronto']
+        data_loading_system = dl.DataLoadingToronto(config.start_date, config.end_date)
 
-        self.regions['Toronto'].update_economic_scaling()
-        self.regions['Toronto'].update_case_scaling()
+        watermark = self.case_watermarks.get('Toronto')
+        if watermark is None and watermark_path is not None:
+            watermark = dl.CaseFileWatermark.load(watermark_path)
+
+        new_cases, watermark, full_reload = data_loading_system.load_new_covid_cases(
+            config.paths['cases'], toronto, watermark, config.loading['workers'])
+        self.case_watermarks['Toronto'] = watermark
+        self.case_arrays.pop('Toronto', None)
+        if watermark_path is not None:
+            watermark.save(watermark_path)
+
+        for name, neighbourhood_cases in new_cases.items():
+            neighbourhood = toronto.neighbourhoods[name]
+            if full_reload:
+                neighbourhood.clear_covid_cases()
+            neighbourhood.add_covid_cases(neighbourhood_cases, take_ownership=True)
+
+        toronto.update_economic_scaling()
+        toronto.update_case_scaling()
 
         self.toronto_model_regression()
 
+        return full_reload
+
+    def save_snapshot(self, path: str) -> None:
+        """
+        Saves every region of the model, including its scaling and regression model, to a snapshot
+        file at path.
+        """
+        print('[modules.preprocessing] Saving model snapshot')
+        snapshot.save_snapshot(path, self.regions, self.case_watermarks)
+
+    def load_snapshot(self, path: str, load_cases: bool = False) -> None:
+        """
+        Replaces the regions of the model with those saved in the snapshot file at path, without
+        loading, scaling or fitting them again. The covid cases of each region are available as
+        memory-mapped arrays in self.case_arrays. The neighbourhoods only hold CovidCase objects if
+        load_cases is True, which is needed before refreshing the model incrementally.
+        """
+        print('[modules.preprocessing] Loading model snapshot')
+        self.regions, self.case_watermarks, self.case_arrays = snapshot.load_snapshot(
+            path, load_cases)
+
     def toronto_model_regression(self) -> None:
         """
         Generates exponential regression model for toronto data.
@@ -64,8 +155,105 @@ class PreprocessingSystem:
         coordinates = [(neighbourhood.scaled_economic_index, neighbourhood.scaled_case_index)
                        for neighbourhood in self.regions['Toronto'].neighbourhoods.values()]
 
-        self.regions['Toronto'].regression_model = ExponentialRegressionModel(coordinates,
-                                                                              config.regression['angle_divisor'])
+        self.regions['Toronto'].regression_model = fit_regression(
+            ExponentialRegressionModel, coordinates, config.regression['angle_divisor'],
+            os.path.join(config.paths['cache'], 'regressions.json'),
+            config.regression['backend'])
+
+    def toronto_batched_regression(self, windows: list[tuple[datetime.date, datetime.date]],
+                                   covariates: tuple[str, ...] = (),
+                                   form: str = 'exponential') -> BatchedRegressionModel:
+        """
+        Returns one regression model per time window, all fitted in a single batched solve. Each
+        model fits the scaled case index of the cases within its (inclusive) window against the
+        scaled economic index and the given covariates of every neighbourhood.
+
+        A covariate is either the name of a neighbourhood attribute (such as
+        'median_household_income') or 'population_density', the population per square kilometre
+        of the neighbourhood's boundary polygon.
+        """
+        neighbourhoods = list(self.regions['Toronto'].neighbourhoods.values())
+        features = [[neighbourhood.scaled_economic_index for neighbourhood in neighbourhoods]]
+
+        for covariate in covariates:
+            if covariate == 'population_density':
+                from modules.geometry import load_boundaries
+
+                boundaries = load_boundaries(TorontoConfig().paths['shapes'])
+                areas = dict(zip(boundaries.names, boundaries.areas_km2()))
+                features.append([neighbourhood.population / areas[neighbourhood.name]
+                                 for neighbourhood in neighbourhoods])
+            else:
+                features.append([getattr(neighbourhood, covariate)
+                                 for neighbourhood in neighbourhoods])
+
+        scaled_case_indexes = self.toronto_window_case_rates(windows)[1]
+
+        design = np.broadcast_to(np.array(features).T, (len(windows),) + (len(neighbourhoods),
+                                                                          len(features)))
+
+        return BatchedRegressionModel(design, scaled_case_indexes, form)
+
+    def toronto_window_case_rates(self, windows: list[tuple[datetime.date, datetime.date]]) \
+            -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the cases per 100,000 people and the scaled case index of every Toronto
+        neighbourhood for the cases within each (inclusive) window, as two arrays of shape
+        (windows, neighbourhoods) in the order of the neighbourhoods.
+
+        The cases are counted from the case arrays of a model restored from a snapshot, and from
+        the neighbourhoods' cases otherwise.
+        """
+        neighbourhoods = list(self.regions['Toronto'].neighbourhoods.values())
+        populations = np.array([neighbourhood.population for neighbourhood in neighbourhoods])
+        case_arrays = self.case_arrays.get('Toronto')
+
+        if case_arrays is None:
+            case_dates = [np.sort(np.array([case.date.toordinal()
+                                            for case in neighbourhood.cases.values()],
+                                           dtype=np.int64))
+                          for neighbourhood in neighbourhoods]
+
+        cases_per_cap = np.zeros((len(windows), len(neighbourhoods)))
+        scaled_case_indexes = np.zeros((len(windows), len(neighbourhoods)))
+
+        for window, (start, end) in enumerate(windows):
+            if case_arrays is not None:
+                counts = case_arrays.count_between(start, end)
+            else:
+                counts = np.array([np.searchsorted(dates, end.toordinal(), 'right')
+                                   - np.searchsorted(dates, start.toordinal(), 'left')
+                                   for dates in case_dates])
+            window_cases_per_cap = counts / populations * 100000  # Per 100,000
+            case_range = window_cases_per_cap.max() - window_cases_per_cap.min()
+            cases_per_cap[window] = window_cases_per_cap
+            if case_range > 0:
+                scaled_case_indexes[window] = (window_cases_per_cap - window_cases_per_cap.min()) \
+                    * 10 / case_range
+
+        return cases_per_cap, scaled_case_indexes
+
+    def toronto_epidemic_curves(self, start_date: Optional[datetime.date] = None,
+                                end_date: Optional[datetime.date] = None) -> EpidemicCurves:
+        """
+        Returns the daily case incidence of every Toronto neighbourhood between start_date and
+        end_date, inclusive, which default to the dates of the model's configuration.
+
+        The cases are binned from the case arrays of a model restored from a snapshot, and from
+        the neighbourhoods' cases otherwise.
+        """
+        config = TorontoConfig()
+        start_date = config.start_date if start_date is None else start_date
+        end_date = config.end_date if end_date is None else end_date
+        toronto = self.regions['Toronto']
+        case_arrays = self.case_arrays.get('Toronto')
+
+        if case_arrays is None:
+            return EpidemicCurves.from_city(toronto, start_date, end_date)
+
+        populations = np.array([toronto.neighbourhoods[name].population
+                                for name in case_arrays.names])
+        return EpidemicCurves.from_case_arrays(case_arrays, populations, start_date, end_date)
 
 
 if __name__ == '__main__':
@@ -81,7 +269,10 @@ if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
-        'extra-imports': ['modules.regression', 'modules.data_loading', 'modules.entities', 'modules.config'],
+        'extra-imports': ['datetime', 'os', 'concurrent.futures', 'typing', 'numpy',
+                          'modules.geometry', 'modules.regression', 'modules.data_loading',
+                          'modules.entities', 'modules.config', 'modules.snapshot',
+                          'modules.level_of_detail', 'modules.epidemic_curves'],
         'allowed-io': [],
         'max-line-length': 100,
         'disable': ['R1705', 'C0200']
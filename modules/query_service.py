@@ -0,0 +1,444 @@
+"""
+Module Name: Query Service Module
+Source Path: modules/query_service.py
+
+Description:
+
+The Query Service Module runs a local, offline HTTP service over a PreprocessingSystem that is
+loaded once, so that dashboards can ask for the statistics of a neighbourhood, the aggregates of
+the city, the regression fit or a rendered map without running the whole project.
+
+The service is a minimal HTTP/1.1 server on asyncio streams which keeps connections alive between
+requests. Every response is serialized once and kept in a least recently used cache of response
+bytes. The cache is tagged with a generation number which is increased whenever the model is
+reloaded, so responses of an older model are never served. Maps are rendered with the non-
+interactive Agg backend on a single background thread, since matplotlib is not thread safe.
+
+Endpoints (all GET unless noted):
+
+    /neighbourhoods                 statistics of every neighbourhood
+    /neighbourhoods/<name>          statistics of one neighbourhood (name URL-encoded)
+    /city                           aggregates of the city
+    /regression                     coefficients of the regression model (404 if none is fitted)
+    /maps/<Covid|Income>.png        the heat map of a variable
+    POST /reload                    reloads the model and invalidates the cache
+
+Example usage from the root of the repository:
+
+    python3 -m modules.query_service --port 8080
+    python3 -m modules.query_service --snapshot data/cache/model.snapshot
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import argparse
+import asyncio
+import io
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from urllib.parse import unquote
+
+from modules.entities import City, Neighbourhood
+from modules.preprocessing import PreprocessingSystem
+
+# Largest request head (request line and headers) accepted, in bytes.
+MAX_HEAD_SIZE = 16384
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           500: 'Internal Server Error'}
+
+MAP_VARIABLES = ('Covid', 'Income')
+
+# Connection header and blank line ending the head of a response.
+KEEP_ALIVE = b'Connection: keep-alive\r\n\r\n'
+CLOSE = b'Connection: close\r\n\r\n'
+
+
+class Response:
+    """
+    Class to represent a serialized HTTP response.
+
+    Instance Attributes:
+        - status: the HTTP status code of the response.
+        - head: the status line and headers of the response, without the Connection header and
+        the blank line that ends the head.
+        - body: the body of the response.
+    """
+
+    status: int
+    head: bytes
+    body: bytes
+
+    def __init__(self, status: int, content_type: str, body: bytes) -> None:
+        self.status = status
+        self.head = (f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                     f'Content-Type: {content_type}\r\n'
+                     f'Content-Length: {len(body)}\r\n').encode('ascii')
+        self.body = body
+
+    @classmethod
+    def json(cls, value: any, status: int = 200) -> 'Response':
+        """
+        Returns a response with value serialized as JSON.
+        """
+        return cls(status, 'application/json',
+                   json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def error(cls, status: int, message: str) -> 'Response':
+        """
+        Returns a JSON error response.
+        """
+        return cls.json({'error': message}, status)
+
+    def serialize(self, keep_alive: bool) -> bytes:
+        """
+        Returns the bytes of the response to write to a connection.
+        """
+        return self.head + (KEEP_ALIVE if keep_alive else CLOSE) + self.body
+
+
+class ResponseCache:
+    """
+    Class to represent a least recently used cache of responses by request path, for one
+    generation of the model at a time.
+
+    Instance Attributes:
+        - capacity: the largest number of responses kept.
+        - generation: the generation of the model the cached responses belong to.
+        - hits: the number of lookups that found a response.
+        - misses: the number of lookups that found no response.
+
+    Representation Invariants:
+        - self.capacity >= 1
+        - len(self._responses) <= self.capacity
+    """
+
+    capacity: int
+    generation: int
+    hits: int
+    misses: int
+    _responses: OrderedDict[str, Response]
+
+    def __init__(self, capacity: int = 512) -> None:
+        self.capacity = capacity
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._responses = OrderedDict()
+
+    def get(self, path: str) -> Optional[Response]:
+        """
+        Returns the cached response of path, or None if there is none.
+        """
+        response = self._responses.get(path)
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._responses.move_to_end(path)
+
+        return response
+
+    def put(self, path: str, generation: int, response: Response) -> None:
+        """
+        Caches the response of path, computed from the given generation of the model. Responses of
+        an earlier generation (computed while the model was reloaded) are not cached.
+        """
+        if generation != self.generation:
+            return
+
+        self._responses[path] = response
+        self._responses.move_to_end(path)
+        if len(self._responses) > self.capacity:
+            self._responses.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """
+        Removes every cached response and starts a new generation.
+        """
+        self._responses.clear()
+        self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+
+def neighbourhood_statistics(neighbourhood: Neighbourhood) -> dict[str, any]:
+    """
+    Returns the statistics of a neighbourhood served by the query service.
+    """
+    return {'name': neighbourhood.name,
+            'population': neighbourhood.population,
+            'median_household_income': neighbourhood.median_household_income,
+            'num_cases_per_cap': neighbourhood.num_cases_per_cap,
+            'scaled_economic_index': neighbourhood.scaled_economic_index,
+            'scaled_case_index': neighbourhood.scaled_case_index}
+
+
+def city_statistics(city: City) -> dict[str, any]:
+    """
+    Returns the aggregates of a city served by the query service. The city's cases per capita is
+    the population-weighted mean of its neighbourhoods' cases per capita.
+    """
+    neighbourhoods = city.neighbourhoods.values()
+    neighbourhood_population = sum(neighbourhood.population for neighbourhood in neighbourhoods)
+    if neighbourhood_population > 0:
+        num_cases_per_cap = sum(neighbourhood.num_cases_per_cap * neighbourhood.population
+                                for neighbourhood in neighbourhoods) / neighbourhood_population
+    else:
+        num_cases_per_cap = 0
+
+    return {'name': city.name,
+            'population': city.population,
+            'num_neighbourhoods': len(city.neighbourhoods),
+            'num_cases_per_cap': num_cases_per_cap,
+            'max_household_income': city.max_household_income,
+            'min_household_income': city.min_household_income,
+            'economic_multiplier': city.economic_multiplier,
+            'max_num_cases_per_cap': city.max_num_cases_per_cap,
+            'min_num_cases_per_cap': city.min_num_cases_per_cap,
+            'case_multiplier': city.case_multiplier}
+
+
+def regression_statistics(city: City) -> Optional[dict[str, any]]:
+    """
+    Returns the coefficients of the city's regression model served by the query service, or None
+    if the city has no regression model.
+    """
+    model = city.regression_model
+    if model is None:
+        return None
+
+    return {'form': 'exponential', 'a': model.a, 'b': model.b, 'gradient': model.gradient,
+            'y_intercept': model.y_intercept, 'residual_sum_squares': model.r_squared,
+            'angle_divisor': model.angle_divisor, 'num_points': len(model.coordinates)}
+
+
+def render_map(system: PreprocessingSystem, variable: str) -> bytes:
+    """
+    Returns the heat map of variable for the Toronto model of system as PNG bytes.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from modules.visualizer import RegionVisual
+
+    figure = RegionVisual(system).draw_toronto_heatmap(variable)
+    output = io.BytesIO()
+    figure.savefig(output, format='png')
+    plt.close(figure)
+
+    return output.getvalue()
+
+
+class QueryService:
+    """
+    Class to represent the query service over a Toronto model.
+
+    Instance Attributes:
+        - system: the preprocessing system holding the loaded model.
+        - cache: the cache of serialized responses.
+        - load_model: the function returning a newly loaded preprocessing system, used by /reload.
+    """
+
+    system: PreprocessingSystem
+    cache: ResponseCache
+    load_model: Callable[[], PreprocessingSystem]
+    _render_executor: ThreadPoolExecutor
+    _reload_lock: asyncio.Lock
+
+    def __init__(self, load_model: Callable[[], PreprocessingSystem],
+                 cache_capacity: int = 512) -> None:
+        self.load_model = load_model
+        self.system = load_model()
+        self.cache = ResponseCache(cache_capacity)
+        self._render_executor = ThreadPoolExecutor(max_workers=1)
+        self._reload_lock = asyncio.Lock()
+
+    def compute(self, path: str) -> Response:
+        """
+        Returns the response of a GET request for path, which is not a map.
+        """
+        toronto = self.system.regions['Toronto']
+        if path == '/neighbourhoods':
+            return Response.json([neighbourhood_statistics(neighbourhood)
+                                  for neighbourhood in toronto.neighbourhoods.values()])
+        elif path.startswith('/neighbourhoods/'):
+            name = unquote(path[len('/neighbourhoods/'):])
+            if name not in toronto.neighbourhoods:
+                return Response.error(404, 'Unknown neighbourhood: ' + name)
+            return Response.json(neighbourhood_statistics(toronto.neighbourhoods[name]))
+        elif path == '/city':
+            return Response.json(city_statistics(toronto))
+        elif path == '/regression':
+            statistics = regression_statistics(toronto)
+            if statistics is None:
+                return Response.error(404, 'No regression model has been fitted')
+            return Response.json(statistics)
+        else:
+            return Response.error(404, 'Unknown path: ' + path)
+
+    async def get(self, path: str) -> Response:
+        """
+        Returns the response of a GET request for path, from the cache if possible.
+        """
+        response = self.cache.get(path)
+        if response is not None:
+            return response
+
+        generation = self.cache.generation
+        if path.startswith('/maps/') and path.endswith('.png'):
+            variable = path[len('/maps/'):-len('.png')]
+            if variable not in MAP_VARIABLES:
+                return Response.error(404, 'Unknown map variable: ' + variable)
+            body = await asyncio.get_running_loop().run_in_executor(
+                self._render_executor, render_map, self.system, variable)
+            response = Response(200, 'image/png', body)
+        else:
+            response = self.compute(path)
+
+        if response.status == 200:
+            self.cache.put(path, generation, response)
+
+        return response
+
+    async def reload(self) -> Response:
+        """
+        Loads the model again in a background thread, replaces the served model with it and
+        invalidates the cache.
+        """
+        async with self._reload_lock:
+            system = await asyncio.get_running_loop().run_in_executor(None, self.load_model)
+            self.system = system
+            self.cache.invalidate()
+
+        return Response.json({'generation': self.cache.generation})
+
+    async def respond(self, method: str, path: str) -> Response:
+        """
+        Returns the response of a request.
+        """
+        path = path.split('?', 1)[0]
+        if path == '/reload' and method != 'POST':
+            return Response.error(405, 'Use POST to reload the model')
+        elif path != '/reload' and method not in ('GET', 'HEAD'):
+            return Response.error(405, 'Unsupported method: ' + method)
+
+        try:
+            if path == '/reload':
+                return await self.reload()
+            return await self.get(path)
+        except Exception as error:  # Report the failure instead of dropping the connection.
+            return Response.error(500, repr(error))
+
+    async def handle_connection(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter) -> None:
+        """
+        Serves the requests of one connection until the client closes it or asks to close it.
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(Response.error(400, 'Request head too large').serialize(False))
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                request_line = lines[0].split()
+                if len(request_line) != 3:
+                    writer.write(Response.error(400, 'Malformed request line').serialize(False))
+                    break
+                method, path, version = request_line
+
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                content_length = int(headers.get('content-length', '0') or '0')
+                if content_length > 0:
+                    await reader.readexactly(content_length)
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' and (version == 'HTTP/1.1'
+                                                        or connection == 'keep-alive')
+
+                response = await self.respond(method, path)
+                if method == 'HEAD':
+                    writer.write(response.head + (KEEP_ALIVE if keep_alive else CLOSE))
+                else:
+                    writer.write(response.serialize(keep_alive))
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        """
+        Serves requests on host and port until cancelled.
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port,
+                                            limit=MAX_HEAD_SIZE)
+        print(f'[modules.query_service] Serving on http://{host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+
+def model_loader(snapshot_path: Optional[str] = None) -> Callable[[], PreprocessingSystem]:
+    """
+    Returns a function which loads the Toronto model, from the snapshot file at snapshot_path if
+    given and from the datasets otherwise.
+    """
+    def load_model() -> PreprocessingSystem:
+        system = PreprocessingSystem()
+        if snapshot_path is not None:
+            system.load_snapshot(snapshot_path)
+        else:
+            system.init_toronto_model()
+        return system
+
+    return load_model
+
+
+def main() -> None:
+    """
+    Runs the query service from the command line.
+    """
+    parser = argparse.ArgumentParser(description='Serve the Toronto model over local HTTP.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('--snapshot', default=None,
+                        help='model snapshot to load instead of loading the datasets')
+    parser.add_argument('--cache-size', type=int, default=512,
+                        help='largest number of cached responses')
+    args = parser.parse_args()
+
+    async def run() -> None:
+        service = QueryService(model_loader(args.snapshot), args.cache_size)
+        await service.serve(args.host, args.port)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print('[modules.query_service] Stopped')
+
+
+if __name__ == '__main__':
+    main()
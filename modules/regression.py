@@ -18,6 +18,24 @@ ln(a).
 Please note, the linear and exponential regression methods in this class were written from scratch
 using only an abstract understanding of residual-squared regression. No external code was used.
 
+The angle sweep of the linear and exponential models can also run on a 'vectorized' backend, which
+scores every candidate line against every coordinate with broadcast NumPy operations and returns
+exactly the same fit as the original 'legacy' loop, including its tie-breaking.
+
+A BatchedRegressionModel fits many linear or exponential models with any number of covariates at
+once. The models are stacked into a design tensor of shape (models, observations, features) and
+every least-squares fit is solved in a single vectorized operation on its normal equations.
+
+The TheilSenRegressionModel and RepeatedMedianRegressionModel (and their exponential versions) are
+robust to neighbourhoods with extreme incomes or case rates: their gradient is a median of the
+slopes between pairs of coordinates rather than the minimizer of the squared residuals. The
+Theil-Sen median is selected in O(n log^2 n) time without enumerating the O(n^2) pairs, so it
+scales to block-level data.
+
+Fits are memoized by fit_regression in a RegressionCache, keyed by a fingerprint of the model class,
+the coordinates and the angle divisor, so that repeating a fit (within a run or, with a cache file,
+across runs) costs a hash of the coordinates.
+
 
 ===============================
 
@@ -29,7 +47,27 @@ in the City of Toronto"
 This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
 
 """
+import hashlib
+import json
 import math
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+# The ways estimate_fit can sweep the candidate lines: scoring each line with a Python loop
+# ('legacy'), or scoring every line with broadcast NumPy operations ('vectorized'). Both return
+# exactly the same fit.
+ANGLE_SWEEP_BACKENDS = ('legacy', 'vectorized')
+
+# The largest number of residuals the vectorized sweep holds in memory at once, small enough for
+# each chunk to stay in cache.
+ANGLE_SWEEP_CHUNK_SIZE = 1 << 16
+
+# The candidate gradients of the vectorized sweep by angle divisor.
+_candidate_gradients = {}
 
 
 class LinearRegressionModel:
@@ -45,10 +83,12 @@ class LinearRegressionModel:
         - gradient: the gradient m of the best fitting linear function such that y = mx + c.
         - y_intercept: the y-intercept c of the best fitting linear function such that y = mx + c.
         - r_squared: the residual-squared value for the best fitting linear function.
+        - backend: how the candidate lines are swept, one of ANGLE_SWEEP_BACKENDS.
 
     Representation Invariants:
         - self.angle_divisor >= 1
         - 0 < self.angle < math.pi / 2
+        - self.backend in ANGLE_SWEEP_BACKENDS
 
     >>> example_coords = [(0.0,1.0), (1.0,2.0), (2.0,3.0), (3.0,4.0)]
     >>> model = LinearRegressionModel(example_coords, 100)
@@ -65,19 +105,59 @@ class LinearRegressionModel:
     gradient: float
     y_intercept: float
     r_squared: float
+    backend: str
+
+    def __init__(self, coordinates: list[tuple[float, float]], angle_divisor: int,
+                 backend: str = 'legacy') -> None:
+        if backend not in ANGLE_SWEEP_BACKENDS:
+            raise ValueError('Unknown angle sweep backend: ' + backend)
 
-    def __init__(self, coordinates: list[tuple[float, float]], angle_divisor: int) -> None:
         self.coordinates = coordinates
         self.angle_divisor = angle_divisor
         self.angle = math.pi / angle_divisor
+        self.backend = backend
         self.gradient, self.y_intercept, self.r_squared = self.estimate_fit(coordinates)
 
+    @classmethod
+    def from_coefficients(cls, coordinates: list[tuple[float, float]], angle_divisor: int,
+                          gradient: float, y_intercept: float, r_squared: float,
+                          backend: str = 'legacy') -> 'LinearRegressionModel':
+        """
+        Returns a model of the coordinates with a previously estimated fit, without estimating
+        the fit again.
+
+        >>> example_coords = [(0.0,1.0), (1.0,2.0), (2.0,3.0), (3.0,4.0)]
+        >>> model = LinearRegressionModel(example_coords, 100)
+        >>> restored = LinearRegressionModel.from_coefficients(
+        ...     example_coords, 100, model.gradient, model.y_intercept, model.r_squared)
+        >>> restored.gradient == model.gradient and restored.angle == model.angle
+        True
+        """
+        model = cls.__new__(cls)
+        model.coordinates = coordinates
+        model.angle_divisor = angle_divisor
+        model.angle = math.pi / angle_divisor
+        model.backend = backend
+        model.gradient, model.y_intercept, model.r_squared = gradient, y_intercept, r_squared
+
+        return model
+
     def estimate_fit(self, coordinates: list[tuple[float, float]]) -> tuple[float, float, float]:
         """
         Returns the constant coefficient m, the constant c and the residual-squared value
         for a fitted linear function of the coordinates such that y = mx + c.
         """
+        if self.backend == 'vectorized':
+            return self.estimate_fit_vectorized(coordinates)
+        else:
+            return self.estimate_fit_legacy(coordinates)
 
+    def estimate_fit_legacy(self, coordinates: list[tuple[float, float]]) \
+            -> tuple[float, float, float]:
+        """
+        Returns the fit of estimate_fit, scoring each candidate line in turn with
+        sum_residuals_squared.
+        """
         iterations = self.angle_divisor
         mean_coord = self.calculate_mean_coordinate(coordinates)
         r_squared_so_far = {}
@@ -102,6 +182,92 @@ class LinearRegressionModel:
 
         return (coefficient_m, constant_c, min_r_squared)
 
+    def estimate_fit_vectorized(self, coordinates: list[tuple[float, float]]) \
+            -> tuple[float, float, float]:
+        """
+        Returns the same fit as the legacy sweep of estimate_fit, scoring every candidate line
+        against every coordinate with broadcast NumPy operations, in chunks of at most
+        ANGLE_SWEEP_CHUNK_SIZE residuals.
+
+        The legacy sweep squares residuals with the ** operator (the C library's pow, which can
+        differ from r * r in the last bit) and sums them in order, so the vectorized sums can
+        differ from it by a few units in the last place. Every candidate whose vectorized sum is
+        within the error bound of the smallest is therefore scored again with
+        sum_residuals_squared, and ties are broken as in the legacy sweep: the last candidate, in
+        the order +0, -0, +1, -1, ... of angle multipliers, with the smallest sum wins.
+
+        >>> example_coords = [(0.0, 1.0), (1.0, 2.5), (2.0, 2.9), (3.0, 4.2), (4.0, 4.8)]
+        >>> legacy = LinearRegressionModel(example_coords, 1000)
+        >>> vectorized = LinearRegressionModel(example_coords, 1000, 'vectorized')
+        >>> vectorized.gradient == legacy.gradient and vectorized.y_intercept == legacy.y_intercept
+        True
+        >>> vectorized.r_squared == legacy.r_squared
+        True
+        >>> tie = LinearRegressionModel([(0.0, 0.0), (1.0, 0.0)], 4, 'vectorized')
+        >>> math.copysign(1, tie.gradient)  # -0.0 is scored after +0.0 and ties with it.
+        -1.0
+        """
+        mean_coord = self.calculate_mean_coordinate(coordinates)
+
+        gradients = self.candidate_gradients()
+        intercepts = mean_coord[1] - gradients * mean_coord[0]
+
+        xs = np.array([coord[0] for coord in coordinates], dtype=np.float64)
+        ys = np.array([coord[1] for coord in coordinates], dtype=np.float64)
+        sums = np.empty(len(gradients))
+        chunk_size = max(ANGLE_SWEEP_CHUNK_SIZE // len(xs), 1)
+
+        for start in range(0, len(gradients), chunk_size):
+            end = start + chunk_size
+            residuals = gradients[start:end, np.newaxis] * xs
+            residuals += intercepts[start:end, np.newaxis]
+            residuals -= ys
+            residuals *= residuals
+            sums[start:end] = residuals.sum(axis=1)
+
+        if np.isnan(sums).any():
+            # The legacy choice of minimum depends on where the NaN sums are, so sweep as before.
+            return self.estimate_fit_legacy(coordinates)
+
+        # Each square is within one unit in the last place of the legacy square, and summing n
+        # terms in any order is within (n - 1) units of roundoff of the exact sum.
+        relative_error = (4 * len(xs) + 16) * np.finfo(np.float64).eps
+        absolute_error = (4 * len(xs) + 16) * np.finfo(np.float64).smallest_subnormal
+        smallest = sums.min()
+        candidates = np.flatnonzero(sums * (1 - relative_error) - absolute_error
+                                    <= smallest * (1 + relative_error) + absolute_error)
+
+        best = None
+        for candidate in candidates.tolist():
+            coefficient_m = float(gradients[candidate])
+            constant_c = self.calculate_y_intercept(coefficient_m, mean_coord)
+            r_squared = self.sum_residuals_squared(coordinates, coefficient_m, constant_c)
+            if best is None or r_squared <= best[2]:
+                best = (coefficient_m, constant_c, r_squared)
+
+        return best
+
+    def candidate_gradients(self) -> np.ndarray:
+        """
+        Returns the gradient of every candidate line of the sweep, in the order +0, -0, +1, -1,
+        ... of angle multipliers, computed exactly as in the legacy sweep. The gradients of each
+        angle divisor are only computed once.
+
+        >>> model = LinearRegressionModel([(0.0, 0.0), (1.0, 1.0)], 3)
+        >>> model.candidate_gradients().round(3).tolist()
+        [0.0, -0.0, 1.732, -1.732, -1.732, 1.732]
+        """
+        if self.angle_divisor not in _candidate_gradients:
+            gradients = np.empty(2 * self.angle_divisor)
+            gradients[0::2] = [math.tan(angle_multiplier * self.angle)
+                               for angle_multiplier in range(self.angle_divisor)]
+            gradients[1::2] = [math.tan(angle_multiplier * self.angle * -1)
+                               for angle_multiplier in range(self.angle_divisor)]
+            gradients.flags.writeable = False
+            _candidate_gradients[self.angle_divisor] = gradients
+
+        return _candidate_gradients[self.angle_divisor]
+
     def sum_residuals_squared(self, coordinates: list[tuple[float, float]], coefficient_m: float,
                               constant_c: float) -> float:
         """
@@ -159,8 +325,9 @@ class ExponentialRegressionModel(LinearRegressionModel):
     b: float
     log_coordinates: list[tuple[float, float]]
 
-    def __init__(self, coordinates: list[tuple[float, float]], angle_divisor: int):
-        super().__init__(coordinates, angle_divisor)
+    def __init__(self, coordinates: list[tuple[float, float]], angle_divisor: int,
+                 backend: str = 'legacy'):
+        super().__init__(coordinates, angle_divisor, backend)
 
         self.log_coordinates = self.calculate_log_coordinates(coordinates)
 
@@ -169,6 +336,22 @@ class ExponentialRegressionModel(LinearRegressionModel):
         self.a = math.e ** self.y_intercept
         self.b = math.e ** self.gradient
 
+    @classmethod
+    def from_coefficients(cls, coordinates: list[tuple[float, float]], angle_divisor: int,
+                          gradient: float, y_intercept: float, r_squared: float,
+                          backend: str = 'legacy') -> 'ExponentialRegressionModel':
+        """
+        Returns a model of the coordinates with a previously estimated fit of ln(y) against x,
+        without estimating the fit again.
+        """
+        model = super().from_coefficients(coordinates, angle_divisor, gradient, y_intercept,
+                                          r_squared, backend)
+        model.log_coordinates = model.calculate_log_coordinates(coordinates)
+        model.a = math.e ** model.y_intercept
+        model.b = math.e ** model.gradient
+
+        return model
+
     def calculate_log_coordinates(self, coordinates: list[tuple[float, float]]) \
             -> list[tuple[float, float]]:
         """
@@ -179,6 +362,669 @@ class ExponentialRegressionModel(LinearRegressionModel):
         return [(coord[0], math.log(coord[1])) for coord in coordinates if coord[1] > 0]
 
 
+# Robust Regression
+
+# Number of slopes, per point, below which the slopes in the search interval of theil_sen_slope are
+# enumerated, and the smallest number of slopes it enumerates or samples at a time.
+ENUMERATION_FACTOR = 8
+MIN_SAMPLE_SIZE = 1024
+
+# Number of pairwise slopes held in memory at once by repeated_median_slope.
+SLOPE_BLOCK_SIZE = 1 << 21
+
+
+def _inversion_ranges(values: np.ndarray, strict: bool = False) \
+        -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds every inversion of values, a pair of positions p < q with values[q] <= values[p] (or
+    values[q] < values[p] if strict), by a bottom-up merge sort, where the values are integers
+    between 0 and len(values) - 1.
+
+    At every level of the merge sort, the inversions whose later position q is in a right block
+    pair q with a contiguous range of the positions of the left block, in the sorted order of that
+    block. Returns the sorted order of the blocks of every level (level i at i * len(values)), and
+    the later position, start and length of every range of every level, with the starts offset
+    into the concatenated orders.
+
+    >>> int(_inversion_ranges(np.array([2, 0, 1, 1]))[3].sum())
+    4
+    >>> int(_inversion_ranges(np.array([2, 0, 1, 1]), strict=True)[3].sum())
+    3
+    """
+    num_values = len(values)
+    positions = np.arange(num_values)
+    order, order_positions = positions, positions
+    orders, rights, starts, lengths = [], [], [], []
+    width = 1
+
+    while width < num_values:
+        # Merge pairs of blocks of width elements sorted by value into blocks of 2 * width. On equal
+        # values the right block goes first (or the left if strict), so the number of elements of
+        # the left block ahead of a right element is the number of smaller (or not larger) ones.
+        blocks = positions // width
+        is_left = blocks % 2 == 0
+        keys = (positions // (2 * width)) * (2 * num_values) + 2 * values \
+            + (~is_left if strict else is_left)
+        # The order is sorted within pairs of blocks, so a stable sort only merges them.
+        merged = order[np.argsort(keys[order], kind='stable')]
+        merged_positions = np.empty(num_values, dtype=np.int64)
+        merged_positions[merged] = positions
+
+        right = positions[~is_left]
+        left_starts = (blocks[right] - 1) * width
+        num_left_ahead = merged_positions[right] - left_starts \
+            - (order_positions[right] - left_starts - width)
+
+        starts.append(left_starts + num_left_ahead + len(orders) * num_values)
+        orders.append(order)
+        rights.append(right)
+        lengths.append(width - num_left_ahead)
+        order, order_positions = merged, merged_positions
+        width *= 2
+
+    if not orders:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty
+
+    return np.concatenate(orders), np.concatenate(rights), np.concatenate(starts), \
+        np.concatenate(lengths)
+
+
+def _expand_ranges(starts: np.ndarray, lengths: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the index of the range of every element of the concatenated ranges, and the element.
+    """
+    range_indexes = np.repeat(np.arange(len(starts)), lengths)
+    range_offsets = np.cumsum(lengths) - lengths
+    elements = starts[range_indexes] + np.arange(len(range_indexes)) - range_offsets[range_indexes]
+
+    return range_indexes, elements
+
+
+def _pair_count(counts: np.ndarray) -> int:
+    """
+    Returns the number of pairs within groups of the given sizes.
+
+    >>> _pair_count(np.array([1, 2, 3]))
+    4
+    """
+    return int((counts * (counts - 1) // 2).sum())
+
+
+class _SlopeSelector:
+    """
+    Class to select order statistics of the slopes of the pairs of points with different
+    x-coordinates, without enumerating the pairs.
+
+    The number of pairs whose slope is at most t is the number of inversions of y - t * x in the
+    order of x, which a merge sort counts in O(n log^2 n) time. A selection keeps an interval
+    (low, high] holding the wanted slope, samples pair slopes uniformly from it (an inversion
+    between the orders at low and high is a pair whose slope is in the interval) and narrows it to
+    pivots around the expected position of the wanted slope among the sample. Once the interval
+    holds O(n) slopes, they are enumerated.
+
+    Instance Attributes:
+        - x: the x-coordinates of the points, in increasing order.
+        - y: the y-coordinates of the points, in increasing order for equal x-coordinates.
+        - num_pairs: the number of pairs of points with different x-coordinates.
+        - num_duplicates: the number of pairs of identical points.
+    """
+
+    x: np.ndarray
+    y: np.ndarray
+    num_pairs: int
+    num_duplicates: int
+    _rng: np.random.Generator
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, seed: int) -> None:
+        order = np.lexsort((y, x))
+        self.x, self.y = x[order], y[order]
+        self._rng = np.random.default_rng(seed)
+
+        _, x_counts = np.unique(self.x, return_counts=True)
+        _, point_counts = np.unique(np.stack((self.x, self.y), axis=1), axis=0,
+                                    return_counts=True)
+        self.num_pairs = len(x) * (len(x) - 1) // 2 - _pair_count(x_counts)
+        self.num_duplicates = _pair_count(point_counts)
+
+    def ranks(self, slope: float) -> np.ndarray:
+        """
+        Returns the dense rank of y - slope * x for every point, where the points of equal value
+        share a rank. Infinite slopes rank the points by the limit of this order.
+        """
+        if math.isinf(slope):
+            order = np.lexsort((self.y, -self.x if slope > 0 else self.x))
+            changes = (self.x[order][1:] != self.x[order][:-1]) \
+                | (self.y[order][1:] != self.y[order][:-1])
+        else:
+            values = self.y - slope * self.x
+            order = np.argsort(values, kind='stable')
+            changes = values[order][1:] != values[order][:-1]
+
+        ranks = np.empty(len(self.x), dtype=np.int64)
+        ranks[order] = np.concatenate(([0], np.cumsum(changes)))
+
+        return ranks
+
+    def count_at_most(self, slope: float) -> int:
+        """
+        Returns the number of pairs whose slope is at most slope.
+        """
+        return int(_inversion_ranges(self.ranks(slope))[3].sum()) - self.num_duplicates
+
+    def count_below(self, slope: float) -> int:
+        """
+        Returns the number of pairs whose slope is less than slope.
+        """
+        return int(_inversion_ranges(self.ranks(slope), strict=True)[3].sum())
+
+    def select(self, lower_rank: int, upper_rank: int, low: float = -math.inf,
+               num_at_most_low: int = 0, high: float = math.inf) -> tuple[float, float]:
+        """
+        Returns the slopes of the given (0-based) ranks, where upper_rank is lower_rank or
+        lower_rank + 1, given that they are in the interval (low, high] and num_at_most_low is the
+        number of pairs whose slope is at most low.
+        """
+        x, y = self.x, self.y
+        enumeration_limit = max(ENUMERATION_FACTOR * len(x), MIN_SAMPLE_SIZE)
+        sample_size = max(len(x), MIN_SAMPLE_SIZE)
+
+        while True:
+            # The pairs with a slope in (low, high] are the inversions of the order at high within
+            # the order at low, where points tied at low are ordered by decreasing x.
+            low_order = np.lexsort((-x, self.ranks(low)))
+            orders, rights, starts, lengths = _inversion_ranges(self.ranks(high)[low_order])
+            num_inside = int(lengths.sum()) - self.num_duplicates
+
+            if num_inside <= enumeration_limit:
+                range_indexes, elements = _expand_ranges(starts, lengths)
+            else:
+                draws = self._rng.integers(0, num_inside + self.num_duplicates, sample_size)
+                range_ends = np.cumsum(lengths)
+                range_indexes = np.searchsorted(range_ends, draws, side='right')
+                elements = starts[range_indexes] + draws - (range_ends - lengths)[range_indexes]
+
+            first, second = low_order[orders[elements]], low_order[rights[range_indexes]]
+            distinct = x[first] != x[second]
+            slopes = np.sort((y[second] - y[first])[distinct] / (x[second] - x[first])[distinct])
+            if num_inside <= enumeration_limit:
+                return (float(slopes[lower_rank - num_at_most_low]),
+                        float(slopes[upper_rank - num_at_most_low]))
+
+            # Pivots a few standard deviations either side of the expected positions of the
+            # wanted slopes in the sample, halfway between sampled slopes so that they are
+            # unlikely to be the slope of any pair.
+            margin = 2 * math.sqrt(len(slopes)) + 1
+            lower_index = math.floor((lower_rank - num_at_most_low) / num_inside * len(slopes)
+                                     - margin)
+            upper_index = math.ceil((upper_rank + 1 - num_at_most_low) / num_inside * len(slopes)
+                                    + margin)
+            pivots = [(slopes[index] + slopes[index + 1]) / 2
+                      for index in (lower_index, upper_index - 1) if 0 <= index < len(slopes) - 1]
+
+            narrowed = False
+            for pivot in sorted(set(pivots)):
+                if not low < pivot < high:
+                    continue
+                num_at_most_pivot = self.count_at_most(pivot)
+                if num_at_most_pivot <= lower_rank:
+                    low, num_at_most_low = pivot, num_at_most_pivot
+                elif num_at_most_pivot > upper_rank:
+                    high = pivot
+                    # With many pairs of equal slope, the interval cannot be narrowed below them.
+                    num_below_high = self.count_below(high)
+                    if num_below_high <= lower_rank:
+                        return float(high), float(high)
+                    elif num_below_high <= upper_rank:
+                        return self.select(lower_rank, lower_rank, low, num_at_most_low,
+                                           high)[0], float(high)
+                else:
+                    # The pivot falls between the two ranks, so they are selected separately.
+                    return (self.select(lower_rank, lower_rank, low, num_at_most_low, pivot)[0],
+                            self.select(upper_rank, upper_rank, pivot, num_at_most_pivot,
+                                        high)[0])
+                narrowed = True
+
+            if not narrowed:
+                # Too few slopes were sampled, as most were pairs of identical points.
+                sample_size *= 2
+
+
+def theil_sen_slope(x: np.ndarray, y: np.ndarray, seed: int = 0) -> float:
+    """
+    Returns the Theil-Sen slope of the points (x, y): the median slope of every pair of points
+    with different x-coordinates, or 0.0 if there is no such pair.
+
+    There are O(n^2) pairs, so instead of enumerating them the median is selected by a randomized
+    search over the slopes which counts them in O(n log^2 n) time (see _SlopeSelector). The seed
+    only changes the running time, not the result.
+
+    >>> rng = np.random.default_rng(1)
+    >>> x, y = rng.uniform(0, 10, 500), rng.standard_cauchy(500)
+    >>> theil_sen_slope(x, y) == median_pairwise_slope(x, y)
+    True
+    >>> x, y = rng.integers(0, 5, 300).astype(float), rng.integers(0, 5, 300).astype(float)
+    >>> theil_sen_slope(x, y) == median_pairwise_slope(x, y)
+    True
+    """
+    selector = _SlopeSelector(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64),
+                              seed)
+    if selector.num_pairs == 0:
+        return 0.0
+
+    # The median is the mean of the two middle slopes, which are equal for an odd number of pairs.
+    lower, upper = selector.select((selector.num_pairs - 1) // 2, selector.num_pairs // 2)
+
+    return (lower + upper) / 2
+
+
+def median_pairwise_slope(x: np.ndarray, y: np.ndarray) -> float:
+    """
+    Returns the Theil-Sen slope of the points (x, y) by enumerating the slope of every pair of
+    points, in O(n^2) time and memory. This is the reference for theil_sen_slope.
+
+    >>> median_pairwise_slope(np.arange(5.0), np.array([1.0, 2.0, 3.0, 4.0, 40.0]))
+    1.0
+    """
+    first, second = np.triu_indices(len(x), 1)
+    distinct = x[first] != x[second]
+    first, second = first[distinct], second[distinct]
+    if len(first) == 0:
+        return 0.0
+
+    return float(np.median((y[second] - y[first]) / (x[second] - x[first])))
+
+
+def repeated_median_slope(x: np.ndarray, y: np.ndarray) -> float:
+    """
+    Returns Siegel's repeated median slope of the points (x, y): the median over every point of
+    the median slope between that point and every point with a different x-coordinate, or 0.0 if
+    there is no such pair. The slopes are computed in blocks of rows of at most SLOPE_BLOCK_SIZE
+    slopes, in O(n^2 log n) time and O(n) memory per row.
+
+    >>> repeated_median_slope(np.arange(5.0), np.array([1.0, 2.0, 3.0, 4.0, 40.0]))
+    1.0
+    """
+    num_points = len(x)
+    point_medians = np.full(num_points, np.nan)
+    rows_per_block = max(SLOPE_BLOCK_SIZE // max(num_points, 1), 1)
+
+    for start in range(0, num_points, rows_per_block):
+        rows = slice(start, start + rows_per_block)
+        x_differences = x[np.newaxis, :] - x[rows, np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = (y[np.newaxis, :] - y[rows, np.newaxis]) / x_differences
+        same_x = x_differences == 0
+        slopes[same_x] = np.inf
+        slopes.sort(axis=1)
+
+        num_valid = num_points - same_x.sum(axis=1)
+        has_valid = num_valid > 0
+        lower = np.take_along_axis(slopes, np.maximum((num_valid - 1) // 2, 0)[:, np.newaxis], 1)
+        upper = np.take_along_axis(slopes, (num_valid // 2)[:, np.newaxis] - (~has_valid), 1)
+        point_medians[rows] = np.where(has_valid, (lower[:, 0] + upper[:, 0]) / 2, np.nan)
+
+    point_medians = point_medians[~np.isnan(point_medians)]
+    if len(point_medians) == 0:
+        return 0.0
+
+    return float(np.median(point_medians))
+
+
+class TheilSenRegressionModel(LinearRegressionModel):
+    """
+    Class representing a linear regression model fitted with the Theil-Sen estimator, which is
+    robust to outliers: up to about 29% of the coordinates can be arbitrarily far from the line
+    without moving it far. The gradient is the median slope of the pairs of coordinates and the
+    y-intercept is the median of y - gradient * x. The angle divisor is not used by the fit.
+
+    >>> example_coords = [(0.0,1.0), (1.0,2.0), (2.0,3.0), (3.0,4.0), (4.0,40.0)]
+    >>> model = TheilSenRegressionModel(example_coords, 100)
+    >>> (model.gradient, model.y_intercept)
+    (1.0, 1.0)
+    """
+
+    def estimate_fit(self, coordinates: list[tuple[float, float]]) -> tuple[float, float, float]:
+        """
+        Returns the constant coefficient m, the constant c and the residual-squared value
+        for a fitted linear function of the coordinates such that y = mx + c.
+        """
+        x, y = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2).T
+        coefficient_m = self.estimate_slope(x, y)
+        constant_c = float(np.median(y - coefficient_m * x))
+
+        return (coefficient_m, constant_c,
+                self.sum_residuals_squared(coordinates, coefficient_m, constant_c))
+
+    def estimate_slope(self, x: np.ndarray, y: np.ndarray) -> float:
+        """
+        Returns the robust gradient estimate of the points (x, y).
+        """
+        return theil_sen_slope(x, y)
+
+
+class RepeatedMedianRegressionModel(TheilSenRegressionModel):
+    """
+    Class representing a linear regression model fitted with Siegel's repeated median estimator,
+    which is robust to up to half of the coordinates being outliers, at the cost of O(n^2 log n)
+    time.
+
+    >>> example_coords = [(0.0,1.0), (1.0,2.0), (2.0,3.0), (3.0,4.0), (4.0,40.0)]
+    >>> model = RepeatedMedianRegressionModel(example_coords, 100)
+    >>> (model.gradient, model.y_intercept)
+    (1.0, 1.0)
+    """
+
+    def estimate_slope(self, x: np.ndarray, y: np.ndarray) -> float:
+        """
+        Returns the robust gradient estimate of the points (x, y).
+        """
+        return repeated_median_slope(x, y)
+
+
+class ExponentialTheilSenRegressionModel(TheilSenRegressionModel, ExponentialRegressionModel):
+    """
+    Class representing an exponential regression model whose fit of ln(y) against x uses the
+    Theil-Sen estimator.
+    """
+
+
+class ExponentialRepeatedMedianRegressionModel(RepeatedMedianRegressionModel,
+                                               ExponentialRegressionModel):
+    """
+    Class representing an exponential regression model whose fit of ln(y) against x uses the
+    repeated median estimator.
+    """
+
+
+class BatchedRegressionModel:
+    """
+    Class representing a batch of least-squares regression models fitted in one vectorized solve.
+
+    Each model m fits targets[m] against the features design[m] with an intercept, using only the
+    observations where mask[m] is True. A linear model has the form
+    y = c_0 + c_1 * x_1 + ... + c_f * x_f, and an exponential model has the form
+    y = a * b_1^x_1 * ... * b_f^x_f, which is fitted as a linear model of ln(y) like the
+    ExponentialRegressionModel. Observations with a non-positive y are excluded from exponential
+    models in order to avoid a logarithm domain error.
+
+    Instance Attributes:
+        - form: either 'linear' or 'exponential'.
+        - mask: a boolean array of shape (models, observations) of the observations used.
+        - coefficients: an array of shape (models, features + 1) of the intercept c_0 followed by
+        the coefficient of each feature, in the (logarithmic, for exponential models) linear space.
+        - residuals: an array of shape (models, observations) of the residuals in the linear space,
+        which is NaN for unused observations.
+        - residual_sum_squares: the sum of the squared residuals of each model, the value stored as
+        r_squared by LinearRegressionModel.
+        - r_squared: the coefficient of determination of each model.
+
+    Representation Invariants:
+        - self.form in {'linear', 'exponential'}
+        - self.coefficients.shape[0] == self.mask.shape[0]
+
+    >>> xs = np.array([[[0.0], [1.0], [2.0], [3.0]], [[0.0], [1.0], [2.0], [3.0]]])
+    >>> ys = np.array([[1.0, 2.0, 3.0, 4.0], [1.0, 3.0, 5.0, 7.0]])
+    >>> models = BatchedRegressionModel(xs, ys)
+    >>> np.allclose(models.coefficients, [[1.0, 1.0], [1.0, 2.0]])
+    True
+    >>> np.allclose(models.r_squared, 1.0)
+    True
+    >>> exponential = BatchedRegressionModel(xs[:1], 2.0 * 3.0 ** xs[:1, :, 0], 'exponential')
+    >>> np.allclose(exponential.a, 2.0) and np.allclose(exponential.b, 3.0)
+    True
+    """
+
+    form: str
+    mask: np.ndarray
+    coefficients: np.ndarray
+    residuals: np.ndarray
+    residual_sum_squares: np.ndarray
+    r_squared: np.ndarray
+
+    def __init__(self, design: np.ndarray, targets: np.ndarray, form: str = 'linear',
+                 mask: Optional[np.ndarray] = None) -> None:
+        design = np.asarray(design, dtype=np.float64)
+        targets = np.asarray(targets, dtype=np.float64)
+        self.form = form
+
+        self.mask = np.isfinite(targets) & np.all(np.isfinite(design), axis=2)
+        if mask is not None:
+            self.mask &= mask
+        if form == 'exponential':
+            self.mask &= targets > 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                targets = np.log(targets)
+        elif form != 'linear':
+            raise ValueError('Unknown regression form: ' + form)
+
+        weights = self.mask.astype(np.float64)
+        targets = np.where(self.mask, targets, 0.0)
+        features = np.concatenate((np.ones(design.shape[:2] + (1,)),
+                                   np.where(self.mask[:, :, np.newaxis], design, 0.0)), axis=2)
+
+        self.coefficients = self.solve(features, targets, weights)
+
+        fitted = np.einsum('mnf,mf->mn', features, self.coefficients)
+        self.residuals = np.where(self.mask, targets - fitted, np.nan)
+        self.residual_sum_squares = np.nansum(self.residuals ** 2, axis=1)
+
+        counts = weights.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = targets.sum(axis=1) / counts
+            total_sum_squares = np.sum(weights * (targets - means[:, np.newaxis]) ** 2, axis=1)
+            self.r_squared = 1 - self.residual_sum_squares / total_sum_squares
+
+    @staticmethod
+    def solve(features: np.ndarray, targets: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        Returns the least-squares coefficients of every model from its weighted normal equations.
+        Batches containing a singular system are solved with the pseudo-inverse instead, which
+        returns the minimum norm solution for the singular models.
+        """
+        gram = np.einsum('mnf,mn,mng->mfg', features, weights, features)
+        moments = np.einsum('mnf,mn,mn->mf', features, weights, targets)
+
+        try:
+            return np.linalg.solve(gram, moments[:, :, np.newaxis])[:, :, 0]
+        except np.linalg.LinAlgError:
+            return np.einsum('mfg,mg->mf', np.linalg.pinv(gram), moments)
+
+    @property
+    def a(self) -> np.ndarray:
+        """
+        Returns the constant a of each exponential model.
+        """
+        return np.exp(self.coefficients[:, 0])
+
+    @property
+    def b(self) -> np.ndarray:
+        """
+        Returns the bases b_1, ..., b_f of each exponential model, as an array of shape
+        (models, features).
+        """
+        return np.exp(self.coefficients[:, 1:])
+
+    def predict(self, design: np.ndarray) -> np.ndarray:
+        """
+        Returns the predicted y of every model at the observations of design, an array of shape
+        (models, observations, features).
+        """
+        linear = self.coefficients[:, np.newaxis, 0] \
+            + np.einsum('mnf,mf->mn', design, self.coefficients[:, 1:])
+        if self.form == 'exponential':
+            return np.exp(linear)
+        else:
+            return linear
+
+
+def stack_designs(designs: list[np.ndarray], targets: list[np.ndarray]) \
+        -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the design tensor, target matrix and mask of a list of models with different numbers
+    of observations, padding the shorter models with masked observations. designs[m] is an array of
+    shape (observations_m, features) and targets[m] has shape (observations_m,).
+
+    >>> design, target, mask = stack_designs([np.ones((2, 1)), np.ones((3, 1))],
+    ...                                      [np.ones(2), np.ones(3)])
+    >>> design.shape, mask.sum(axis=1).tolist()
+    ((2, 3, 1), [2, 3])
+    """
+    observations = max(len(model_targets) for model_targets in targets)
+    features = designs[0].shape[1]
+    design = np.zeros((len(designs), observations, features))
+    target = np.zeros((len(designs), observations))
+    mask = np.zeros((len(designs), observations), dtype=bool)
+
+    for model, (model_design, model_targets) in enumerate(zip(designs, targets)):
+        design[model, :len(model_targets)] = model_design
+        target[model, :len(model_targets)] = model_targets
+        mask[model, :len(model_targets)] = True
+
+    return design, target, mask
+
+
+# Memoized Fits
+
+REGRESSION_CACHE_VERSION = 1
+
+
+def regression_fingerprint(model_class: type, coordinates: list[tuple[float, float]],
+                           angle_divisor: int) -> str:
+    """
+    Returns the fingerprint of fitting model_class to the coordinates with angle_divisor. The
+    fingerprint depends on the order of the coordinates, since the order of summation can change
+    the last bits of the fit.
+
+    >>> coordinates = [(0.0, 1.0), (1.0, 2.0)]
+    >>> first = regression_fingerprint(LinearRegressionModel, coordinates, 100)
+    >>> first == regression_fingerprint(LinearRegressionModel, list(coordinates), 100)
+    True
+    >>> first == regression_fingerprint(ExponentialRegressionModel, coordinates, 100)
+    False
+    """
+    digest = hashlib.sha256(f'{REGRESSION_CACHE_VERSION}:{model_class.__qualname__}:'
+                            f'{angle_divisor}:{len(coordinates)}:'.encode())
+    digest.update(np.asarray(coordinates, dtype=np.float64).tobytes())
+
+    return digest.hexdigest()
+
+
+class RegressionCache:
+    """
+    Class to represent a least recently used cache of the coefficients of fitted regression
+    models by fingerprint, optionally persisted to a JSON file.
+
+    Instance Attributes:
+        - capacity: the largest number of fits kept.
+        - path: the JSON file the cache is loaded from and saved to, or None to keep it in memory.
+        - hits: the number of fits found in the cache.
+        - misses: the number of fits that had to be estimated.
+
+    Representation Invariants:
+        - self.capacity >= 1
+        - len(self._fits) <= self.capacity
+
+    >>> cache = RegressionCache()
+    >>> example_coords = [(0.0,1.0), (1.0,2.0), (2.0,3.0), (3.0,4.0)]
+    >>> model = cache.fit(LinearRegressionModel, example_coords, 100)
+    >>> cached = cache.fit(LinearRegressionModel, example_coords, 100)
+    >>> cached.gradient == model.gradient and (cache.hits, cache.misses) == (1, 1)
+    True
+    """
+
+    capacity: int
+    path: Optional[str]
+    hits: int
+    misses: int
+    _fits: OrderedDict[str, tuple[float, float, float]]
+
+    def __init__(self, capacity: int = 256, path: Optional[str] = None) -> None:
+        self.capacity = capacity
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._fits = OrderedDict()
+
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as cache_file:
+                    data = json.load(cache_file)
+                if data.get('version') == REGRESSION_CACHE_VERSION:
+                    for fingerprint, fit in data['fits'][-capacity:]:
+                        self._fits[fingerprint] = tuple(fit)
+            except (OSError, KeyError, TypeError, ValueError, AttributeError):
+                # An unreadable or corrupt cache file (json.JSONDecodeError is a ValueError) is
+                # treated as an empty cache, and is overwritten by the next save.
+                print('[modules.regression] Ignoring unreadable regression cache ' + path)
+                self._fits.clear()
+
+    def fit(self, model_class: type, coordinates: list[tuple[float, float]],
+            angle_divisor: int, backend: str = 'legacy') -> LinearRegressionModel:
+        """
+        Returns a model_class model of the coordinates, restored from the cache if the same fit
+        was estimated before and estimated (and cached) with the given angle sweep backend
+        otherwise. Every backend estimates the same fit, so fits are cached independently of it.
+        """
+        fingerprint = regression_fingerprint(model_class, coordinates, angle_divisor)
+        fit = self._fits.get(fingerprint)
+
+        if fit is not None:
+            self.hits += 1
+            self._fits.move_to_end(fingerprint)
+            return model_class.from_coefficients(coordinates, angle_divisor, *fit, backend)
+
+        self.misses += 1
+        model = model_class(coordinates, angle_divisor, backend)
+        self._fits[fingerprint] = (model.gradient, model.y_intercept, model.r_squared)
+        if len(self._fits) > self.capacity:
+            self._fits.popitem(last=False)
+        if self.path is not None:
+            self.save()
+
+        return model
+
+    def save(self) -> None:
+        """
+        Saves the cache to its JSON file, from the least to the most recently used fit. The cache
+        is written to a temporary file in the same directory, which then replaces the JSON file,
+        so that a reader never sees a partially written cache.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        fits = [[fingerprint, list(fit)] for fingerprint, fit in self._fits.items()]
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory or '.', suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as cache_file:
+                json.dump({'version': REGRESSION_CACHE_VERSION, 'fits': fits}, cache_file)
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def __len__(self) -> int:
+        return len(self._fits)
+
+
+_regression_caches = {None: RegressionCache()}
+
+
+def fit_regression(model_class: type, coordinates: list[tuple[float, float]], angle_divisor: int,
+                   cache_path: Optional[str] = None,
+                   backend: str = 'legacy') -> LinearRegressionModel:
+    """
+    Returns a model_class model of the coordinates, memoized in the cache persisted to
+    cache_path, or in an in-memory cache shared by the process if cache_path is None. Fits that
+    are not cached are estimated with the given angle sweep backend.
+    """
+    if cache_path not in _regression_caches:
+        _regression_caches[cache_path] = RegressionCache(path=cache_path)
+
+    return _regression_caches[cache_path].fit(model_class, coordinates, angle_divisor, backend)
+
+
 if __name__ == '__main__':
     import python_ta.contracts
 
@@ -191,8 +1037,9 @@ if __name__ == '__main__':
 
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['math'],
-        'allowed-io': [],
+        'extra-imports': ['hashlib', 'json', 'math', 'os', 'tempfile', 'collections', 'typing',
+                          'numpy'],
+        'allowed-io': ['RegressionCache.__init__', 'RegressionCache.save'],
         'max-line-length': 100,
         'disable': ['R1705', 'C0200']
     })
@@ -0,0 +1,283 @@
+"""
+Module Name: Shared Dataset Module
+Source Path: modules/shared_dataset.py
+
+Description:
+
+The Shared Dataset Module places the cases, regions and neighbourhood geometry of a model in a
+single block of shared memory, so that the worker processes of a parallel experiment (such as a
+sweep over angle divisors, date windows or colour breakpoints) can use the dataset without each
+of them reading and parsing the datasets again, and without each holding a copy of it.
+
+The process that loads the model creates a SharedDataset and passes its small, picklable handle to
+the workers. Each worker attaches to the shared memory with the handle and receives read-only
+City and Neighbourhood views: the attributes of the regions are rebuilt from the shared arrays,
+and the covid cases and boundary polygons stay in shared memory, so the memory used by a sweep
+stays close to that of one dataset however many workers it has.
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import datetime
+from collections.abc import Mapping
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterator, Optional
+
+import numpy as np
+
+from modules.entities import City, CovidCase, Neighbourhood
+from modules.geometry import NeighbourhoodBoundaries
+from modules.snapshot import ARRAY_ALIGNMENT, CaseArrays
+
+
+class SharedDatasetHandle:
+    """
+    Class to represent the picklable handle of a SharedDataset, which worker processes use to
+    attach to it.
+
+    Instance Attributes:
+        - memory_name: the name of the block of shared memory.
+        - layout: the (dtype, shape, offset) of every array in the block, by array name.
+        - metadata: the city name and population, and the name and code of every neighbourhood.
+    """
+
+    memory_name: str
+    layout: dict[str, tuple[str, tuple[int, ...], int]]
+    metadata: dict[str, any]
+
+    def __init__(self, memory_name: str, layout: dict[str, tuple[str, tuple[int, ...], int]],
+                 metadata: dict[str, any]) -> None:
+        self.memory_name = memory_name
+        self.layout = layout
+        self.metadata = metadata
+
+
+class SharedCases(Mapping):
+    """
+    Class to represent a read-only mapping of case ids to the covid cases of one neighbourhood,
+    backed by shared arrays. A CovidCase is only created when a case is looked up.
+
+    Instance Attributes:
+        - neighbourhood: the neighbourhood the cases belong to.
+        - case_ids: the id of every case, in shared memory.
+        - dates: the date ordinal of every case, in shared memory.
+    """
+
+    neighbourhood: Neighbourhood
+    case_ids: np.ndarray
+    dates: np.ndarray
+    _positions: Optional[dict[int, int]]
+
+    def __init__(self, neighbourhood: Neighbourhood, case_ids: np.ndarray,
+                 dates: np.ndarray) -> None:
+        self.neighbourhood = neighbourhood
+        self.case_ids = case_ids
+        self.dates = dates
+        self._positions = None
+
+    def __getitem__(self, case_id: int) -> CovidCase:
+        if self._positions is None:
+            self._positions = {int(key): position
+                               for position, key in enumerate(self.case_ids.tolist())}
+        position = self._positions[case_id]
+
+        return CovidCase(case_id, datetime.date.fromordinal(int(self.dates[position])),
+                         self.neighbourhood.super_region, self.neighbourhood)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.case_ids.tolist())
+
+    def __len__(self) -> int:
+        return len(self.case_ids)
+
+
+class AttachedDataset:
+    """
+    Class to represent a SharedDataset attached to by a process.
+
+    Instance Attributes:
+        - city: a read-only City view of the dataset, with its scaling updated. The cases of
+        each neighbourhood are a SharedCases mapping.
+        - case_arrays: the case arrays of the city, in shared memory.
+        - boundaries: the neighbourhood boundaries, with polygons in shared memory, or None if the
+        dataset has no geometry.
+    """
+
+    city: City
+    case_arrays: CaseArrays
+    boundaries: Optional[NeighbourhoodBoundaries]
+    _memory: SharedMemory
+
+    def __init__(self, handle: SharedDatasetHandle) -> None:
+        self._memory = SharedMemory(name=handle.memory_name)
+        arrays = {}
+        for name, (dtype, shape, offset) in handle.layout.items():
+            array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._memory.buf,
+                               offset=offset)
+            array.flags.writeable = False
+            arrays[name] = array
+
+        metadata = handle.metadata
+        names = metadata['names']
+        self.case_arrays = CaseArrays(names, arrays['case_pointers'], arrays['case_ids'],
+                                      arrays['case_dates'])
+        self.city = self._build_city(metadata, arrays)
+
+        if 'vertices' in arrays:
+            polygon_pointers = arrays['polygon_pointers'].tolist()
+            ring_pointers = arrays['ring_pointers'].tolist()
+            ring_starts = arrays['ring_starts'].tolist()
+            polygons = [arrays['vertices'][polygon_pointers[i]:polygon_pointers[i + 1]]
+                        for i in range(len(names))]
+            parts = [ring_starts[ring_pointers[i]:ring_pointers[i + 1]] for i in range(len(names))]
+            self.boundaries = NeighbourhoodBoundaries.from_arrays(
+                metadata['shapes_path'], names, metadata['codes'], polygons, parts)
+        else:
+            self.boundaries = None
+
+    def _build_city(self, metadata: dict[str, any], arrays: dict[str, np.ndarray]) -> City:
+        """
+        Returns the City view of the dataset, with its economic and case scaling updated.
+        """
+        city = City(metadata['city_name'], metadata['city_population'])
+        pointers = arrays['case_pointers'].tolist()
+        neighbourhoods = []
+
+        for index, (name, population, income) in enumerate(zip(
+                metadata['names'], arrays['populations'].tolist(), arrays['incomes'].tolist())):
+            neighbourhood = Neighbourhood(name, population, city, income)
+            start, end = pointers[index], pointers[index + 1]
+            neighbourhood.cases = SharedCases(neighbourhood, arrays['case_ids'][start:end],
+                                              arrays['case_dates'][start:end])
+            neighbourhood.num_cases_per_cap = (len(neighbourhood.cases) / population) * 100000
+            neighbourhoods.append(neighbourhood)
+
+        city.add_sub_regions(neighbourhoods)
+        city.update_economic_scaling()
+        city.update_case_scaling()
+
+        return city
+
+    def close(self) -> None:
+        """
+        Detaches from the shared memory. The views of the dataset must not be used afterwards.
+        """
+        self.city = None
+        self.case_arrays = None
+        self.boundaries = None
+        self._memory.close()
+
+
+class SharedDataset:
+    """
+    Class to represent the cases, regions and neighbourhood geometry of a city in one block of
+    shared memory, owned by the process that created it.
+
+    Instance Attributes:
+        - handle: the handle to pass to the processes attaching to the dataset.
+    """
+
+    handle: SharedDatasetHandle
+    _memory: SharedMemory
+
+    def __init__(self, city: City, boundaries: Optional[NeighbourhoodBoundaries] = None) -> None:
+        neighbourhoods = list(city.neighbourhoods.values())
+        case_arrays = CaseArrays.from_city(city)
+        arrays = {
+            'populations': np.array([hood.population for hood in neighbourhoods], dtype=np.int64),
+            'incomes': np.array([hood.median_household_income for hood in neighbourhoods],
+                                dtype=np.int64),
+            'case_pointers': case_arrays.pointers,
+            'case_ids': case_arrays.case_ids,
+            'case_dates': case_arrays.dates
+        }
+        metadata = {'city_name': city.name, 'city_population': city.population,
+                    'names': [hood.name for hood in neighbourhoods], 'codes': None,
+                    'shapes_path': None}
+
+        if boundaries is not None:
+            order = [boundaries.index_of(hood.name) for hood in neighbourhoods]
+            polygons = [boundaries.polygons[index] for index in order]
+            parts = [boundaries.parts[index] for index in order]
+            arrays['vertices'] = np.concatenate(polygons)
+            arrays['polygon_pointers'] = np.cumsum([0] + [len(polygon) for polygon in polygons])
+            arrays['ring_pointers'] = np.cumsum([0] + [len(rings) for rings in parts])
+            arrays['ring_starts'] = np.array([start for rings in parts for start in rings],
+                                             dtype=np.int64)
+            metadata['codes'] = [boundaries.codes[index] for index in order]
+            metadata['shapes_path'] = boundaries.path
+
+        layout = {}
+        size = 0
+        for name, array in arrays.items():
+            offset = -(-size // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+            layout[name] = (array.dtype.str, array.shape, offset)
+            size = offset + array.nbytes
+
+        self._memory = SharedMemory(create=True, size=max(size, 1))
+        for name, array in arrays.items():
+            dtype, shape, offset = layout[name]
+            np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._memory.buf,
+                       offset=offset)[...] = array
+
+        self.handle = SharedDatasetHandle(self._memory.name, layout, metadata)
+
+    def attach(self) -> AttachedDataset:
+        """
+        Returns the views of the dataset in this process.
+        """
+        return AttachedDataset(self.handle)
+
+    def close(self) -> None:
+        """
+        Frees the shared memory. Processes attached to the dataset must detach first.
+        """
+        self._memory.close()
+        self._memory.unlink()
+
+    def __enter__(self) -> 'SharedDataset':
+        return self
+
+    def __exit__(self, *exception_info: any) -> None:
+        self.close()
+
+
+_attached_datasets = {}
+
+
+def attach(handle: SharedDatasetHandle) -> AttachedDataset:
+    """
+    Returns the views of the shared dataset of handle in this process. A worker process only
+    attaches to each dataset once, however many tasks it runs with the handle.
+    """
+    if handle.memory_name not in _attached_datasets:
+        _attached_datasets[handle.memory_name] = AttachedDataset(handle)
+
+    return _attached_datasets[handle.memory_name]
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+
+    python_ta.contracts.DEBUG_CONTRACTS = False
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+
+    doctest.testmod(verbose=True)
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'extra-imports': ['datetime', 'collections.abc', 'multiprocessing.shared_memory', 'typing',
+                          'numpy', 'modules.entities', 'modules.geometry', 'modules.snapshot'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
@@ -0,0 +1,307 @@
+"""
+Module Name: Snapshot Module
+Source Path: modules/snapshot.py
+
+Description:
+
+The Snapshot Module saves the super regions of a built PreprocessingSystem to a single binary file
+and restores them without loading, scaling or fitting the model again, so that a visualization or
+reporting process can reach a ready model in milliseconds.
+
+A snapshot file is laid out as follows:
+
+    - an 8 byte magic string, a little-endian uint32 format version and a uint64 header length;
+    - a UTF-8 JSON header holding the attributes, scaling state and regression coefficients of every
+    super region and its sub regions, the high-water mark of its case file, and the location of
+    each of its case arrays;
+    - padding to a multiple of ARRAY_ALIGNMENT bytes, followed by the raw little-endian case arrays
+    of every super region, each starting on a multiple of ARRAY_ALIGNMENT bytes.
+
+The case arrays hold the id and date ordinal of every covid case, grouped by sub region, so they
+can be memory-mapped and read by a reporting process without creating a CovidCase object per case.
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import datetime
+import json
+import struct
+from typing import Optional
+
+import numpy as np
+
+from modules.data_loading import CaseFileWatermark
+from modules.entities import City, CovidCase, Neighbourhood
+from modules.regression import ExponentialRegressionModel
+
+SNAPSHOT_MAGIC = b'CSEMSNAP'
+SNAPSHOT_VERSION = 1
+ARRAY_ALIGNMENT = 64
+
+# Magic string, format version and header length.
+PREAMBLE = struct.Struct('<8sIQ')
+
+# Scaling state saved for every super region.
+SCALING_ATTRIBUTES = ('economic_multiplier', 'max_household_income', 'min_household_income',
+                      'case_multiplier', 'max_num_cases_per_cap', 'min_num_cases_per_cap')
+
+
+class CaseArrays:
+    """
+    Class to represent the covid cases of every sub region of a super region as flat arrays.
+
+    Instance Attributes:
+        - names: the name of each sub region, in the super region's order.
+        - pointers: the cases of the i-th sub region are at positions pointers[i] to
+        pointers[i + 1] of case_ids and dates.
+        - case_ids: the id of every case.
+        - dates: the date of every case as a proleptic Gregorian ordinal (datetime.date.toordinal).
+
+    Representation Invariants:
+        - len(self.pointers) == len(self.names) + 1
+        - len(self.case_ids) == len(self.dates) == self.pointers[-1]
+    """
+
+    names: list[str]
+    pointers: np.ndarray
+    case_ids: np.ndarray
+    dates: np.ndarray
+
+    def __init__(self, names: list[str], pointers: np.ndarray, case_ids: np.ndarray,
+                 dates: np.ndarray) -> None:
+        self.names = names
+        self.pointers = pointers
+        self.case_ids = case_ids
+        self.dates = dates
+
+    @classmethod
+    def from_city(cls, city: City) -> 'CaseArrays':
+        """
+        Returns the case arrays of every neighbourhood of city.
+        """
+        neighbourhoods = list(city.neighbourhoods.values())
+        counts = [len(neighbourhood.cases) for neighbourhood in neighbourhoods]
+        case_ids = np.fromiter((case_id for neighbourhood in neighbourhoods
+                                for case_id in neighbourhood.cases), np.int64, sum(counts))
+        dates = np.fromiter((case.date.toordinal() for neighbourhood in neighbourhoods
+                             for case in neighbourhood.cases.values()), np.int32, sum(counts))
+
+        return cls([neighbourhood.name for neighbourhood in neighbourhoods],
+                   np.concatenate(([0], np.cumsum(counts))).astype(np.int64), case_ids, dates)
+
+    def cases_of(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the case ids and date ordinals of the sub region with the given name.
+        """
+        index = self.names.index(name)
+        start, end = self.pointers[index], self.pointers[index + 1]
+
+        return self.case_ids[start:end], self.dates[start:end]
+
+    def count_between(self, start: datetime.date, end: datetime.date) -> np.ndarray:
+        """
+        Returns the number of cases of each sub region dated within start and end, inclusive.
+        """
+        in_window = (self.dates >= start.toordinal()) & (self.dates <= end.toordinal())
+        cumulative = np.concatenate(([0], np.cumsum(in_window)))
+
+        return cumulative[self.pointers[1:]] - cumulative[self.pointers[:-1]]
+
+
+def _aligned(offset: int) -> int:
+    """
+    Returns the smallest multiple of ARRAY_ALIGNMENT that is at least offset.
+
+    >>> _aligned(0), _aligned(1), _aligned(64)
+    (0, 64, 64)
+    """
+    return -(-offset // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+
+def save_snapshot(path: str, regions: dict[str, City],
+                  watermarks: dict[str, CaseFileWatermark]) -> None:
+    """
+    Saves the super regions, and the high-water marks of their case files, to a snapshot file at
+    path.
+    """
+    header = {'regions': []}
+    arrays = []
+    data_length = 0
+
+    for name, city in regions.items():
+        case_arrays = CaseArrays.from_city(city)
+        locations = {}
+        for array_name in ('pointers', 'case_ids', 'dates'):
+            array = np.ascontiguousarray(getattr(case_arrays, array_name))
+            array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+            data_length = _aligned(data_length)
+            locations[array_name] = {'dtype': array.dtype.str, 'length': len(array),
+                                     'offset': data_length}
+            arrays.append((data_length, array))
+            data_length += array.nbytes
+
+        model = city.regression_model
+        watermark = watermarks.get(name)
+        header['regions'].append({
+            'key': name,
+            'name': city.name,
+            'population': city.population,
+            'scaling': {attribute: getattr(city, attribute) for attribute in SCALING_ATTRIBUTES},
+            'neighbourhoods': [[neighbourhood.name, neighbourhood.population,
+                                neighbourhood.median_household_income,
+                                neighbourhood.num_cases_per_cap,
+                                neighbourhood.scaled_economic_index,
+                                neighbourhood.scaled_case_index]
+                               for neighbourhood in city.neighbourhoods.values()],
+            'regression': None if model is None else {
+                'angle_divisor': model.angle_divisor, 'gradient': model.gradient,
+                'y_intercept': model.y_intercept, 'r_squared': model.r_squared},
+            'watermark': None if watermark is None else {
+                'offset': watermark.offset, 'checksum': watermark.checksum,
+                'open_row': watermark.open_row},
+            'cases': locations
+        })
+
+    encoded_header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    data_start = _aligned(PREAMBLE.size + len(encoded_header))
+
+    with open(path, 'wb') as snapshot:
+        snapshot.write(PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(encoded_header)))
+        snapshot.write(encoded_header)
+        for offset, array in arrays:
+            snapshot.write(b'\0' * (data_start + offset - snapshot.tell()))
+            snapshot.write(array.tobytes())
+
+
+def read_snapshot_header(path: str) -> tuple[dict, int]:
+    """
+    Returns the header of the snapshot file at path and the byte offset of its case arrays.
+    Raises a ValueError if the file is not a snapshot, or was written by an unsupported version.
+    """
+    with open(path, 'rb') as snapshot:
+        preamble = snapshot.read(PREAMBLE.size)
+        if len(preamble) < PREAMBLE.size or preamble[:8] != SNAPSHOT_MAGIC:
+            raise ValueError(path + ' is not a model snapshot')
+
+        _, version, header_length = PREAMBLE.unpack(preamble)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError('Unsupported model snapshot version: ' + str(version))
+
+        header = json.loads(snapshot.read(header_length).decode('utf-8'))
+
+    return header, _aligned(PREAMBLE.size + header_length)
+
+
+def _read_array(path: str, location: dict, data_start: int, memory_map: bool) -> np.ndarray:
+    """
+    Returns the case array at location in the snapshot file at path, either memory-mapped
+    read-only or read into memory.
+    """
+    dtype = np.dtype(location['dtype'])
+    if location['length'] == 0:
+        return np.zeros(0, dtype=dtype)
+    elif memory_map:
+        return np.memmap(path, dtype=dtype, mode='r', offset=data_start + location['offset'],
+                         shape=(location['length'],))
+    else:
+        with open(path, 'rb') as snapshot:
+            snapshot.seek(data_start + location['offset'])
+            return np.fromfile(snapshot, dtype=dtype, count=location['length'])
+
+
+def _restore_city(region: dict, case_arrays: Optional[CaseArrays]) -> City:
+    """
+    Returns the City saved in a snapshot header region, with the covid cases of case_arrays if
+    given.
+    """
+    city = City(region['name'], region['population'])
+    neighbourhoods = []
+    for name, population, income, cases_per_cap, economic_index, case_index \
+            in region['neighbourhoods']:
+        neighbourhood = Neighbourhood(name, population, city, income)
+        neighbourhood.num_cases_per_cap = cases_per_cap
+        neighbourhood.scaled_economic_index = economic_index
+        neighbourhood.scaled_case_index = case_index
+        neighbourhoods.append(neighbourhood)
+    city.add_sub_regions(neighbourhoods)
+
+    for attribute, value in region['scaling'].items():
+        setattr(city, attribute, value)
+
+    if case_arrays is not None:
+        for neighbourhood, start, end in zip(neighbourhoods, case_arrays.pointers[:-1].tolist(),
+                                             case_arrays.pointers[1:].tolist()):
+            neighbourhood.cases = {
+                case_id: CovidCase(case_id, datetime.date.fromordinal(date), city, neighbourhood)
+                for case_id, date in zip(case_arrays.case_ids[start:end].tolist(),
+                                         case_arrays.dates[start:end].tolist())}
+
+    regression = region['regression']
+    if regression is not None:
+        coordinates = [(neighbourhood.scaled_economic_index, neighbourhood.scaled_case_index)
+                       for neighbourhood in neighbourhoods]
+        city.regression_model = ExponentialRegressionModel.from_coefficients(
+            coordinates, regression['angle_divisor'], regression['gradient'],
+            regression['y_intercept'], regression['r_squared'])
+
+    return city
+
+
+def load_snapshot(path: str, load_cases: bool = False, memory_map: bool = True) \
+        -> tuple[dict[str, City], dict[str, CaseFileWatermark], dict[str, CaseArrays]]:
+    """
+    Returns the super regions, the high-water marks of their case files and their case arrays from
+    the snapshot file at path. The case arrays are memory-mapped read-only unless memory_map is
+    False.
+
+    Every attribute, scaling value and regression coefficient is restored exactly as saved. The
+    sub regions only hold CovidCase objects if load_cases is True, which costs time proportional
+    to the number of cases. Without them the case file must be loaded in full before adding more
+    cases, so the high-water marks are then only returned if load_cases is True.
+    """
+    header, data_start = read_snapshot_header(path)
+    regions = {}
+    watermarks = {}
+    all_case_arrays = {}
+
+    for region in header['regions']:
+        locations = region['cases']
+        case_arrays = CaseArrays([neighbourhood[0] for neighbourhood in region['neighbourhoods']],
+                                 *(_read_array(path, locations[array_name], data_start, memory_map)
+                                   for array_name in ('pointers', 'case_ids', 'dates')))
+        all_case_arrays[region['key']] = case_arrays
+        regions[region['key']] = _restore_city(region, case_arrays if load_cases else None)
+
+        if load_cases and region['watermark'] is not None:
+            saved = region['watermark']
+            watermarks[region['key']] = CaseFileWatermark(saved['offset'], saved['checksum'],
+                                                          saved.get('open_row', False))
+
+    return regions, watermarks, all_case_arrays
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+
+    python_ta.contracts.DEBUG_CONTRACTS = False
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+
+    doctest.testmod(verbose=True)
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'extra-imports': ['datetime', 'json', 'struct', 'typing', 'numpy', 'modules.data_loading',
+                          'modules.entities', 'modules.regression'],
+        'allowed-io': ['save_snapshot', 'read_snapshot_header', '_read_array'],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
@@ -0,0 +1,435 @@
+"""
+Module Name: Spatial Analysis Module
+Source Path: modules/spatial_analysis.py
+
+Description:
+
+The Spatial Analysis Module measures how strongly the case and economic indexes of neighbourhoods
+cluster in space, which the regression model cannot see as it treats every neighbourhood as an
+independent point. It computes the global and local Moran's I statistics of a sub region attribute
+over the contiguity of the neighbourhood boundary polygons.
+
+Two neighbourhoods are contiguous (queen contiguity) when their boundaries share at least one
+vertex. The contiguity is derived from the shapefile once, stored as a row-standardized sparse
+matrix in compressed sparse row form and cached both in memory and on disk, so repeated analyses
+only pay for the statistics.
+
+The significance of the statistics is estimated with permutation tests. Permutations are generated
+and evaluated in vectorized batches, and the batches are spread across a pool of worker processes.
+
+===============================
+
+CSC110 Final Project:
+
+"Virus of Inequality: The Socio-Economic Disparity of COVID-19 Cases
+in the City of Toronto"
+
+This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
+"""
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from modules.config import TorontoConfig
+from modules.entities import City, SubRegion
+from modules.geometry import NeighbourhoodBoundaries, load_boundaries
+
+ADJACENCY_CACHE_VERSION = 1
+
+
+class SparseAdjacency:
+    """
+    Class to represent a row-standardized spatial weights matrix in compressed sparse row form.
+
+    Instance Attributes:
+        - names: the name of the sub region of each row and column.
+        - pointers: the weights of row i are stored at positions pointers[i]:pointers[i + 1] of
+        indices and weights.
+        - indices: the column (neighbour) of every stored weight.
+        - weights: the value of every stored weight. Each row with neighbours sums to 1.
+
+    Representation Invariants:
+        - len(self.pointers) == len(self.names) + 1
+        - len(self.indices) == len(self.weights) == self.pointers[-1]
+
+    >>> adjacency = SparseAdjacency.from_pairs(['a', 'b', 'c'], np.array([0]), np.array([1]))
+    >>> adjacency.neighbours(0)
+    ['b']
+    >>> adjacency.lag(np.array([1.0, 2.0, 3.0])).tolist()
+    [2.0, 1.0, 0.0]
+    """
+
+    names: list[str]
+    pointers: np.ndarray
+    indices: np.ndarray
+    weights: np.ndarray
+
+    def __init__(self, names: list[str], pointers: np.ndarray, indices: np.ndarray,
+                 weights: np.ndarray) -> None:
+        self.names = names
+        self.pointers = pointers
+        self.indices = indices
+        self.weights = weights
+
+    @classmethod
+    def from_pairs(cls, names: list[str], firsts: np.ndarray,
+                   seconds: np.ndarray) -> 'SparseAdjacency':
+        """
+        Returns the row-standardized adjacency of the symmetric relation given by the pairs
+        (firsts[k], seconds[k]). Duplicate pairs and self pairs are ignored.
+        """
+        rows = np.concatenate((firsts, seconds))
+        columns = np.concatenate((seconds, firsts))
+        keep = rows != columns
+        pairs = np.unique(rows[keep] * len(names) + columns[keep])
+        rows, columns = pairs // len(names), pairs % len(names)
+
+        counts = np.bincount(rows, minlength=len(names))
+        pointers = np.concatenate(([0], np.cumsum(counts)))
+        weights = 1 / counts[rows]
+
+        return cls(names, pointers, columns, weights)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def cardinalities(self) -> np.ndarray:
+        """
+        Returns the number of neighbours of every sub region.
+        """
+        return np.diff(self.pointers)
+
+    def neighbours(self, index: int) -> list[str]:
+        """
+        Returns the names of the neighbours of the sub region at index.
+        """
+        return [self.names[column]
+                for column in self.indices[self.pointers[index]:self.pointers[index + 1]]]
+
+    def lag(self, values: np.ndarray) -> np.ndarray:
+        """
+        Returns the spatial lag W @ values. If values is two dimensional, each row is treated as a
+        separate set of values, so a batch of permutations is lagged in one operation.
+        """
+        weighted = values[..., self.indices] * self.weights
+        # A trailing zero keeps every row start a valid index, including rows without neighbours.
+        weighted = np.concatenate((weighted, np.zeros(values.shape[:-1] + (1,))), axis=-1)
+        lagged = np.add.reduceat(weighted, self.pointers[:-1], axis=-1)
+        lagged[..., self.cardinalities() == 0] = 0
+
+        return lagged
+
+
+def build_contiguity(boundaries: NeighbourhoodBoundaries) -> SparseAdjacency:
+    """
+    Returns the queen contiguity of the neighbourhood boundaries: two neighbourhoods are neighbours
+    when their boundaries share a vertex. Vertices are matched after rounding to about a centimetre,
+    and shared vertices are found with one sort of all vertices rather than comparing polygons
+    pairwise.
+    """
+    vertices = np.concatenate(boundaries.polygons)
+    owners = np.repeat(np.arange(len(boundaries)),
+                       [len(polygon) for polygon in boundaries.polygons])
+
+    _, vertex_ids = np.unique(np.round(vertices, 7), axis=0, return_inverse=True)
+    vertex_ids = vertex_ids.ravel()
+    records = np.unique(vertex_ids.astype(np.int64) * len(boundaries) + owners)
+    vertex_ids, owners = records // len(boundaries), records % len(boundaries)
+
+    # Records are sorted by vertex, so the owners of a shared vertex are adjacent records.
+    firsts = []
+    seconds = []
+    offset = 1
+    while offset < len(records):
+        same_vertex = vertex_ids[offset:] == vertex_ids[:-offset]
+        if not same_vertex.any():
+            break
+        firsts.append(owners[:-offset][same_vertex])
+        seconds.append(owners[offset:][same_vertex])
+        offset += 1
+
+    if firsts:
+        firsts, seconds = np.concatenate(firsts), np.concatenate(seconds)
+    else:
+        firsts, seconds = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    return SparseAdjacency.from_pairs(list(boundaries.names), firsts, seconds)
+
+
+_adjacency_cache = {}
+
+
+def load_contiguity(shapes_path: str, cache_directory: Optional[str] = None) -> SparseAdjacency:
+    """
+    Returns the queen contiguity of the shapefile at shapes_path. Results are cached in memory and,
+    if cache_directory is given, on disk under a key derived from the shapefile's contents, so the
+    contiguity is only derived from the polygons once.
+    """
+    with open(shapes_path, 'rb') as shapes_file:
+        key = hashlib.sha256(shapes_file.read()).hexdigest()[:16]
+
+    if key in _adjacency_cache:
+        return _adjacency_cache[key]
+
+    cache_path = None
+    if cache_directory is not None:
+        cache_path = os.path.join(cache_directory, 'contiguity_v' + str(ADJACENCY_CACHE_VERSION)
+                                  + '_' + key + '.npz')
+
+    if cache_path is not None and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            adjacency = SparseAdjacency(cached['names'].tolist(), cached['pointers'],
+                                        cached['indices'], cached['weights'])
+    else:
+        print('[modules.spatial_analysis] Building neighbourhood contiguity')
+        adjacency = build_contiguity(load_boundaries(shapes_path))
+        if cache_path is not None:
+            os.makedirs(cache_directory, exist_ok=True)
+            np.savez(cache_path, names=np.array(adjacency.names), pointers=adjacency.pointers,
+                     indices=adjacency.indices, weights=adjacency.weights)
+
+    _adjacency_cache[key] = adjacency
+    return adjacency
+
+
+# Moran's I statistics
+
+def global_morans_i(values: np.ndarray, adjacency: SparseAdjacency) -> np.ndarray:
+    """
+    Returns the global Moran's I of values. If values is two dimensional, the statistic of every row
+    is returned.
+
+    >>> adjacency = SparseAdjacency.from_pairs(['a', 'b', 'c', 'd'], np.array([0, 2]),
+    ...                                        np.array([1, 3]))
+    >>> float(global_morans_i(np.array([1.0, 1.0, 5.0, 5.0]), adjacency))
+    1.0
+    """
+    deviations = values - values.mean(axis=-1, keepdims=True)
+    total_weight = adjacency.weights.sum()
+    cross_products = np.sum(deviations * adjacency.lag(deviations), axis=-1)
+
+    return (values.shape[-1] / total_weight) * cross_products / np.sum(deviations ** 2, axis=-1)
+
+
+def local_morans_i(values: np.ndarray, adjacency: SparseAdjacency) -> np.ndarray:
+    """
+    Returns the local Moran's I of every sub region for the given values.
+    """
+    deviations = values - values.mean()
+    second_moment = np.sum(deviations ** 2) / len(values)
+
+    return deviations * adjacency.lag(deviations) / second_moment
+
+
+def pseudo_p_values(observed: np.ndarray, simulated: np.ndarray) -> np.ndarray:
+    """
+    Returns the one-sided pseudo p-values of the observed statistics against the simulated ones,
+    where the first axis of simulated indexes the permutations. The tail in the direction of the
+    observed statistic is used.
+
+    >>> float(pseudo_p_values(np.array(0.9), np.array([0.1, 0.2, 0.3])))
+    0.25
+    """
+    permutations = simulated.shape[0]
+    larger = np.sum(simulated >= observed, axis=0)
+    larger = np.minimum(larger, permutations - larger)
+
+    return (larger + 1) / (permutations + 1)
+
+
+def _global_permutation_batch(values: np.ndarray, adjacency: SparseAdjacency, size: int,
+                              seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    Returns the global Moran's I of size random permutations of values, computed as one batch.
+    """
+    rng = np.random.default_rng(seed)
+    permuted = rng.permuted(np.tile(values, (size, 1)), axis=1)
+
+    return global_morans_i(permuted, adjacency)
+
+
+def _local_permutation_batch(values: np.ndarray, adjacency: SparseAdjacency, size: int,
+                             seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    Returns an array of shape (size, n) of conditionally permuted local Moran's I. For each sub
+    region, its own value is held fixed and its neighbours are drawn at random without
+    replacement from the other sub regions.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(values)
+    deviations = values - values.mean()
+    second_moment = np.sum(deviations ** 2) / n
+    cardinalities = adjacency.cardinalities()
+    max_neighbours = int(cardinalities.max()) if n > 0 else 0
+
+    # Pad each row's weights to max_neighbours so that every sub region is lagged at once.
+    padded_weights = np.zeros((n, max_neighbours))
+    slots = np.arange(max_neighbours)
+    has_slot = slots < cardinalities[:, np.newaxis]
+    padded_weights[has_slot] = adjacency.weights
+
+    simulated = np.empty((size, n))
+    chunk = max(2 ** 22 // max(n * n, 1), 1)
+    for start in range(0, size, chunk):
+        count = min(chunk, size - start)
+        # A random subset of max_neighbours of the n - 1 other sub regions, for each sub region.
+        draws = np.argpartition(rng.random((count, n, n - 1)), max_neighbours - 1,
+                                axis=2)[:, :, :max_neighbours]
+        draws = draws + (draws >= np.arange(n)[:, np.newaxis])
+        lags = np.sum(deviations[draws] * padded_weights, axis=2)
+        simulated[start:start + count] = deviations * lags / second_moment
+
+    return simulated
+
+
+class MoranResult:
+    """
+    Class to represent the global and local Moran's I of an attribute with permutation inference.
+
+    Instance Attributes:
+        - attribute: the name of the sub region attribute analysed.
+        - names: the name of the sub region of every local statistic.
+        - global_i: the global Moran's I.
+        - global_expected: the expected global Moran's I under spatial randomness.
+        - global_p_value: the pseudo p-value of the global Moran's I.
+        - local_i: the local Moran's I of every sub region.
+        - local_p_values: the pseudo p-value of every local Moran's I.
+        - permutations: the number of permutations used for inference.
+
+    Representation Invariants:
+        - len(self.local_i) == len(self.local_p_values) == len(self.names)
+    """
+
+    attribute: str
+    names: list[str]
+    global_i: float
+    global_expected: float
+    global_p_value: float
+    local_i: np.ndarray
+    local_p_values: np.ndarray
+    permutations: int
+
+    def __init__(self, attribute: str, names: list[str], global_i: float, global_p_value: float,
+                 local_i: np.ndarray, local_p_values: np.ndarray, permutations: int) -> None:
+        self.attribute = attribute
+        self.names = names
+        self.global_i = global_i
+        self.global_expected = -1 / (len(names) - 1)
+        self.global_p_value = global_p_value
+        self.local_i = local_i
+        self.local_p_values = local_p_values
+        self.permutations = permutations
+
+    def significant_clusters(self, alpha: float = 0.05) -> list[str]:
+        """
+        Returns the names of the sub regions whose local Moran's I is significant at level alpha.
+        """
+        return [self.names[i] for i in np.flatnonzero(self.local_p_values < alpha)]
+
+
+class SpatialAutocorrelationAnalysis:
+    """
+    Class to compute Moran's I statistics for the sub regions of a super region.
+
+    Instance Attributes:
+        - adjacency: the spatial weights of the sub regions.
+        - workers: the number of worker processes used for permutation tests.
+        - batch_size: the number of permutations evaluated in each vectorized batch.
+    """
+
+    adjacency: SparseAdjacency
+    workers: int
+    batch_size: int
+
+    def __init__(self, adjacency: SparseAdjacency, workers: Optional[int] = None,
+                 batch_size: int = 250) -> None:
+        self.adjacency = adjacency
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.batch_size = batch_size
+
+    def attribute_values(self, sub_regions: dict[str, SubRegion], attribute: str) -> np.ndarray:
+        """
+        Returns the values of attribute for the given sub regions, in adjacency order.
+        """
+        return np.array([getattr(sub_regions[name], attribute) for name in self.adjacency.names],
+                        dtype=np.float64)
+
+    def _run_batches(self, batch_function: any, values: np.ndarray, permutations: int,
+                     seed: int) -> np.ndarray:
+        """
+        Returns the simulated statistics of permutations random permutations, evaluated in batches
+        of self.batch_size across self.workers processes. The result only depends on seed and the
+        batch size, not on the number of workers.
+        """
+        sizes = [self.batch_size] * (permutations // self.batch_size)
+        if permutations % self.batch_size:
+            sizes.append(permutations % self.batch_size)
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        arguments = ([values] * len(sizes), [self.adjacency] * len(sizes), sizes, seeds)
+
+        if self.workers <= 1 or len(sizes) <= 1:
+            batches = list(map(batch_function, *arguments))
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(sizes))) as executor:
+                batches = list(executor.map(batch_function, *arguments))
+
+        return np.concatenate(batches)
+
+    def analyse(self, sub_regions: dict[str, SubRegion], attribute: str, permutations: int = 999,
+                seed: int = 0) -> MoranResult:
+        """
+        Returns the global and local Moran's I of attribute over the given sub regions, by name,
+        with pseudo p-values from permutations random permutations.
+        """
+        values = self.attribute_values(sub_regions, attribute)
+
+        global_i = global_morans_i(values, self.adjacency)
+        local_i = local_morans_i(values, self.adjacency)
+
+        global_simulated = self._run_batches(_global_permutation_batch, values, permutations, seed)
+        local_simulated = self._run_batches(_local_permutation_batch, values, permutations,
+                                            seed + 1)
+
+        return MoranResult(attribute, list(self.adjacency.names), float(global_i),
+                           float(pseudo_p_values(global_i, global_simulated)), local_i,
+                           pseudo_p_values(local_i, local_simulated), permutations)
+
+
+def toronto_spatial_autocorrelation(toronto: City, permutations: int = 999,
+                                    workers: Optional[int] = None,
+                                    seed: int = 0) -> dict[str, MoranResult]:
+    """
+    Returns the Moran's I analysis of the scaled case index and scaled economic index of the
+    Toronto neighbourhoods, by attribute name.
+    """
+    config = TorontoConfig()
+    adjacency = load_contiguity(config.paths['shapes'], config.paths['cache'])
+    analysis = SpatialAutocorrelationAnalysis(adjacency, workers)
+    print('[modules.spatial_analysis] Running permutation tests')
+
+    return {attribute: analysis.analyse(toronto.neighbourhoods, attribute, permutations, seed)
+            for attribute in ('scaled_case_index', 'scaled_economic_index')}
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+
+    python_ta.contracts.DEBUG_CONTRACTS = False
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+
+    doctest.testmod(verbose=True)
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'extra-imports': ['hashlib', 'os', 'concurrent.futures', 'typing', 'numpy',
+                          'modules.config', 'modules.entities', 'modules.geometry'],
+        'allowed-io': ['load_contiguity', 'toronto_spatial_autocorrelation'],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
@@ -21,17 +21,22 @@ in the City of Toronto"
 This file is Copyright (c) 2021 Harvey Ronan Donnelly and Ewan Robert Jordan.
 """
 
+import os
+from typing import Optional, TYPE_CHECKING
+
 from modules.preprocessing import PreprocessingSystem
-from modules.regression import ExponentialRegressionModel
+from modules.regression import ExponentialRegressionModel, fit_regression
 from modules.config import TorontoConfig
+from modules.geometry import neighbourhood_name_filtration
+from modules.level_of_detail import load_level_of_detail
+from modules.label_raster import load_label_raster
 
 import numpy as np
-import shapefile as shp
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-import seaborn as sns
 
-config = TorontoConfig()
+# matplotlib and seaborn take longer to import than the rest of the model together, so they are
+# only imported by the methods that draw.
+if TYPE_CHECKING:
+    import matplotlib.figure
 
 
 class RegionVisual:
@@ -40,11 +45,14 @@ class RegionVisual:
 
     Instance Attributes:
     - system: the preprocessing system which will have visuals created for.
+    - config: the config of the Toronto model.
     """
     system: PreprocessingSystem
+    config: TorontoConfig
 
     def __init__(self, system: PreprocessingSystem):
         self.system = system
+        self.config = TorontoConfig()
         self.colours_covid = ['#dadaebFF', '#bcbddcF0', '#9e9ac8F0',
                               '#807dbaF0', '#6a51a3F0', '#54278fF0']
         self.colours_income = ['#993404', '#d95f0e',
@@ -61,6 +69,8 @@ class RegionVisual:
         """
         Creates a scatter plot comparing toronto neighbourhoods' income against covid cases.
         """
+        import matplotlib.pyplot as plt
+
         data = {'Cases': [], 'Income': []}
         toronto = self.system.regions['Toronto']
         hoods = toronto.neighbourhoods
@@ -72,7 +82,10 @@ class RegionVisual:
             if hoods[subregion].scaled_case_index != 0 and hoods[subregion].scaled_economic_index != 0:
                 points.append((hoods[subregion].scaled_economic_index, hoods[subregion].scaled_case_index))
             print('[module.visualizer] Creating coordinate for neighbourhood: ' + subregion)
-        regression_model = ExponentialRegressionModel(points, 1000)
+        regression_model = fit_regression(ExponentialRegressionModel, points, 1000,
+                                          os.path.join(self.config.paths['cache'],
+                                                       'regressions.json'),
+                                          self.config.regression['backend'])
         x = np.linspace(0, 10, 100)
         y = (regression_model.b ** x) * regression_model.a
         fig, (ax1, ax2) = plt.subplots(1, 2)
@@ -99,37 +112,122 @@ class RegionVisual:
         ax2.annotate("Residual-squared = " + str(regression_model.r_squared), xy=(0.5, 0.9), xycoords='axes fraction',
                      fontsize=10)
 
-    def toronto_heatmap(self, variable: str) -> None:
-        """ Creates a heat map of a region's covid numbers.
+    def toronto_incidence_curves(self, names: Optional[list[str]] = None,
+                                 window: int = 7) -> None:
+        """ Creates a line plot of the cases per 100,000 people over the previous window days
+            of Toronto neighbourhoods, by default of the five neighbourhoods with the most cases
+            per capita.
+
+            Preconditions:
+            - names is None or all(name in toronto.neighbourhoods for name in names)
+            - window >= 1
+        """
+        import matplotlib.pyplot as plt
+
+        curves = self.system.toronto_epidemic_curves()
+        incidence = curves.incidence_per_capita(window)
+        if names is None:
+            totals = curves.cases_per_capita_between(curves.start_date, curves.dates()[-1])
+            names = [curves.names[index] for index in np.argsort(-totals, kind='stable')[:5]]
+
+        dates = curves.dates()
+        plt.figure(figsize=(11, 6))
+        for name in names:
+            plt.plot(dates, incidence[curves.names.index(name)], label=name)
+        plt.title('Covid-19 Incidence in Toronto Neighbourhoods (cases per 100,000 over '
+                  + str(window) + ' days)', fontweight="bold")
+        plt.xlabel("Date", fontweight="bold")
+        plt.ylabel("Cases per 100,000", fontweight="bold")
+        plt.legend()
+
+    def toronto_heatmap(self, variable: str, figsize: tuple[float, float] = (11, 9),
+                        dpi: Optional[float] = None, raster: bool = False) -> None:
+        """ Creates a heat map of a region's covid numbers. If raster is True, the map is
+            drawn as an image from a label raster of the neighbourhoods.
+
             Preconditions:
             - variable in ['Covid', 'Income']
         """
+        import matplotlib.pyplot as plt
+
+        if raster:
+            self.draw_toronto_raster_heatmap(variable, figsize, dpi)
+        else:
+            self.draw_toronto_heatmap(variable, figsize, dpi)
+        plt.show()
+
+    def draw_toronto_heatmap(self, variable: str, figsize: tuple[float, float] = (11, 9),
+                             dpi: Optional[float] = None) -> 'matplotlib.figure.Figure':
+        """ Draws a heat map of a region's covid numbers into a new figure and returns it. The
+            boundaries are drawn at the coarsest level of detail that looks the same at the
+            figure's size and dpi, so small figures draw a small fraction of the vertices.
+
+            Preconditions:
+            - variable in ['Covid', 'Income']
+        """
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
         sns.set(style='whitegrid', palette='pastel', color_codes=True)
         sns.mpl.rc('figure', figsize=(10, 6))
 
-        shp_path = config.paths['shapes']
-        print('[modules.visualizer] Extracting Shape files')
-        sf = shp.Reader(shp_path)
-        plt.figure(figsize=(11, 9))
-        id = 0
-        for p in range(len(sf.shapeRecords())):
-
-            shape = sf.shapeRecords()[p]
-            name = sf.records()[p][7]
-            name_result = ''
-            name_list = name.split()
-            for word in range(len(name_list) - 1):
-                name_result += (" " + name_list[word])
-            name_result = name_result.strip()
-            name_result = self.neighbourhood_name_filtration(name_result)
+        geometry = load_level_of_detail(self.config.paths['shapes'], self.config.paths['cache'])
+        figure = plt.figure(figsize=figsize, dpi=dpi)
+        level = geometry.level_for_output(figsize[0], figure.dpi)
+
+        for name_result, rings in zip(geometry.names, geometry.levels[level]):
             print('Extracted shape file from ' + name_result)
-            x = [i[0] for i in shape.shape.points[:]]
-            y = [i[1] for i in shape.shape.points[:]]
             colour = self.get_colour(name_result, variable)
-            plt.plot(x, y, 'k')
-            plt.fill(x, y, colour)
+            for ring in rings:
+                plt.plot(ring[:, 0], ring[:, 1], 'k')
+                plt.fill(ring[:, 0], ring[:, 1], colour)
+
+        self._draw_heatmap_legend(variable)
+
+        return figure
 
-            id = id + 1
+    def draw_toronto_raster_heatmap(self, variable: str, figsize: tuple[float, float] = (11, 9),
+                                    dpi: Optional[float] = None) -> 'matplotlib.figure.Figure':
+        """ Draws a heat map of a region's covid numbers into a new figure and returns it, as
+            a single image. The label raster of the neighbourhoods at the size of the figure's
+            axes is computed once and cached, after which drawing a map only looks up the colour
+            of every pixel from the colours of the neighbourhoods.
+
+            Preconditions:
+            - variable in ['Covid', 'Income']
+        """
+        import matplotlib.pyplot as plt
+        import matplotlib.colors as mcolors
+        import seaborn as sns
+
+        sns.set(style='whitegrid', palette='pastel', color_codes=True)
+        sns.mpl.rc('figure', figsize=(10, 6))
+
+        figure = plt.figure(figsize=figsize, dpi=dpi)
+        axes = figure.gca()
+        window = axes.get_window_extent()
+        shape = (max(int(round(window.height)), 1), max(int(round(window.width)), 1))
+        raster = load_label_raster(self.config.paths['shapes'], shape, self.config.paths['cache'])
+
+        colours = mcolors.to_rgba_array([self.get_colour(name, variable)
+                                         for name in raster.names])
+        image = raster.render(np.round(colours * 255))
+        # The image is drawn above the seaborn grid, like the filled polygons of the vector map.
+        axes.imshow(image, extent=raster.extent(), origin='lower', interpolation='nearest',
+                    aspect='auto', zorder=1)
+
+        self._draw_heatmap_legend(variable)
+
+        return figure
+
+    def _draw_heatmap_legend(self, variable: str) -> None:
+        """ Adds the title and legend of a heat map of variable to the current figure.
+
+            Preconditions:
+            - variable in ['Covid', 'Income']
+        """
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as mpatches
 
         if variable == 'Covid':
             plt.title('Covid-19 Intensity in Toronto Neighbourhoods (cases per 100,000) '
@@ -142,7 +240,6 @@ class RegionVisual:
             legend = [mpatches.Patch(color=col, label=rang) for col, rang in
                       zip(tuple(self.colours_income), tuple(self.ranges_income))]
             plt.legend(handles=legend)
-        plt.show()
 
     def get_colour(self, name_result: str, variable: str) -> str:
         """ Returns the colour corresponding to the amount of covid cases
@@ -197,15 +294,7 @@ class RegionVisual:
             Preconditions:
             - len(name_result) > 0
         """
-        if name_result == 'North St.James Town':
-            name_result = 'North St. James Town'
-        if name_result == 'Danforth East York':
-            name_result = 'Danforth-East York'
-        if name_result == 'Briar Hill-Belgravia':
-            name_result = 'Briar Hill - Belgravia'
-        if name_result == 'Cabbagetown-South St.James Town':
-            name_result = 'Cabbagetown-South St. James Town'
-        return name_result
+        return neighbourhood_name_filtration(name_result)
 
 
 if __name__ == '__main__':
@@ -221,8 +310,11 @@ if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
-        'extra-imports': ['modules.preprocessing', 'modules.regression', 'modules.config', 'numpy'
-                          'numpy', 'shapefile', 'matplotlib.pyplot', 'matplotlib.matches', 'seaborn'],
+        'extra-imports': ['os', 'typing', 'modules.preprocessing', 'modules.regression',
+                          'modules.config', 'modules.geometry', 'modules.level_of_detail',
+                          'modules.label_raster', 'numpy', 'matplotlib.figure',
+                          'matplotlib.pyplot', 'matplotlib.patches', 'matplotlib.colors',
+                          'seaborn'],
         'allowed-io': [],
         'max-line-length': 100,
         'disable': ['R1705', 'C0200']